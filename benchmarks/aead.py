@@ -0,0 +1,73 @@
+"""
+Measures the throughput of the encryption and decryption of messages
+with each AEAD engine, by message size.
+
+Messages are encrypted and decrypted through `EncryptionKey.encrypt_raw`
+and `DecryptionKey.decrypt_raw`, so the serialization is included.
+
+Usage: python -m benchmarks.aead [--duration 0.5]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import time
+from typing import Callable
+
+from sami.config import settings
+from sami.cryptography.symmetric import (
+    AEAD_ENGINES,
+    DecryptionKey,
+    EncryptionKey,
+    SymmetricKey,
+)
+
+_SIZES = (64, 1024, 16 * 1024, 256 * 1024, 1024 * 1024)
+
+
+def _measure(operation: Callable[[], object], duration: float) -> float:
+    """
+    Returns the average time taken by `operation`, repeated for at least
+    `duration` seconds.
+    """
+    iterations = 0
+    start = time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < duration:
+        operation()
+        iterations += 1
+    return elapsed / iterations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--duration", type=float, default=0.5)
+    args = parser.parse_args()
+
+    value = os.urandom(settings.aes_keys_length.get())
+    key = SymmetricKey(value=value, nonce=SymmetricKey.derive_nonce_from_key(value))
+    decryption_key = DecryptionKey.from_key(key)
+
+    print(f"{'Engine':<18} {'Size':>8} {'Encrypt':>12} {'Decrypt':>12}")
+    for aead in AEAD_ENGINES:
+        encryption_key = EncryptionKey.from_key(key, aead)
+        for size in _SIZES:
+            data = "0" * size
+            encrypted = encryption_key.encrypt_raw(data)
+            durations = [
+                _measure(lambda: encryption_key.encrypt_raw(data), args.duration),
+                _measure(
+                    lambda: decryption_key.decrypt_raw(*encrypted, aead),
+                    args.duration,
+                ),
+            ]
+            print(
+                f"{aead:<18} {size:>8} "
+                + " ".join(
+                    f"{size / duration / 2**20:8.1f}MB/s" for duration in durations
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Measures the time taken to compute the identifiers of each type of object,
+with the legacy (pickle) and the canonical hashing schemes.
+
+Identifiers are computed without their cache, by calling the function
+behind the `id` property.
+
+Usage: python -m benchmarks.hashing [--iterations 10000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import ipaddress
+import os
+import time
+from functools import partial
+from typing import Callable
+
+from sami.config import settings
+from sami.cryptography.asymmetric import ECPrivateKey
+from sami.cryptography.hashing import hashing_scheme
+from sami.cryptography.symmetric import SymmetricKey, SymmetricKeyPart
+from sami.network.requests import NPP, Request
+from sami.objects import Contact, Conversation, EncryptedMessage, Node
+
+
+def _new_node() -> Node:
+    private_key = ECPrivateKey.new()
+    public_key = private_key.get_public_key()
+    return Node(
+        public_key=public_key,
+        sig=private_key.get_signature(public_key.hash),
+        pattern={
+            "seed": 0,
+            "colors": ["36382e", "ffffff", "000000"],
+            "shapes_count": 10,
+        },
+    )
+
+
+def _objects() -> dict[str, object]:
+    nodes = [_new_node() for _ in range(8)]
+    now = int(time.time())
+    key_length = settings.aes_keys_length.get()
+    return {
+        "Request (NPP of 8 nodes)": Request.new(NPP(nodes=set(nodes))),
+        "Conversation": Conversation(members=set(nodes[:2])),
+        "Contact": Contact(address=ipaddress.ip_address("192.0.2.1"), port=1234),
+        "EncryptedMessage": EncryptedMessage(
+            author=nodes[0],
+            content=os.urandom(1024),
+            digest=os.urandom(16),
+            time_sent=now,
+            time_received=now,
+        ),
+        "SymmetricKeyPart": SymmetricKeyPart(
+            value=os.urandom(key_length // 2), author=nodes[0]
+        ),
+        "SymmetricKey": SymmetricKey(
+            value=os.urandom(key_length), nonce=os.urandom(key_length // 2)
+        ),
+    }
+
+
+def _measure(compute_id: Callable[[], object], iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        compute_id()
+    return (time.perf_counter() - start) / iterations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=10_000)
+    args = parser.parse_args()
+
+    print(f"{'Object':<26} {'Legacy':>10} {'Canonical':>10} {'Speedup':>8}")
+    for name, obj in _objects().items():
+        compute_id = partial(type(obj).id.func, obj)
+        durations = {}
+        for scheme in ("legacy", "canonical"):
+            with hashing_scheme(scheme):
+                durations[scheme] = _measure(compute_id, args.iterations)
+        print(
+            f"{name:<26} "
+            f"{durations['legacy'] * 1e6:8.1f}us "
+            f"{durations['canonical'] * 1e6:8.1f}us "
+            f"{durations['legacy'] / durations['canonical']:7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
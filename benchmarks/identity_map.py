@@ -0,0 +1,98 @@
+"""
+Measures the memory used by nodes when they are shared by many messages,
+with and without the identity map.
+
+Nodes use Ed25519 keys rather than RSA ones, as generating 100,000 RSA
+key pairs would take hours. Generating and signing them takes about a
+minute.
+
+Usage: python -m benchmarks.identity_map [--nodes 100000] [--messages 1000000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Generator
+from unittest import mock
+
+from sami.cryptography.asymmetric import ECPrivateKey
+from sami.design import IdentityMap
+from sami.objects import EncryptedMessage
+
+
+def _node_documents(count: int) -> list[dict]:
+    documents = []
+    for _ in range(count):
+        private_key = ECPrivateKey.new()
+        public_key = private_key.get_public_key()
+        documents.append(
+            {
+                "public_key": public_key.dict(),
+                "sig": private_key.get_signature(public_key.hash),
+                "pattern": {
+                    "seed": random.randint(0, 9999),
+                    "colors": ["36382e", "ffffff", "000000"],
+                    "shapes_count": 10,
+                },
+            }
+        )
+    return documents
+
+
+def _build_messages(nodes: list[dict], count: int) -> list[EncryptedMessage]:
+    now = int(time.time())
+    # Messages are built from documents, as they are when read from the
+    # database or from a request
+    return [
+        EncryptedMessage(
+            author=random.choice(nodes),
+            content=b"",
+            digest=i.to_bytes(16, "big"),
+            time_sent=now,
+            time_received=now,
+        )
+        for i in range(count)
+    ]
+
+
+@contextmanager
+def _without_interning() -> Generator[None, None, None]:
+    with mock.patch.object(IdentityMap, "intern", lambda _, __, factory: factory()):
+        yield
+
+
+def _measure(nodes: list[dict], messages: int) -> tuple[int, float]:
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    built = _build_messages(nodes, messages)
+    duration = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del built
+    return size, duration
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nodes", type=int, default=100_000)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    nodes = _node_documents(args.nodes)
+
+    size, duration = _measure(nodes, args.messages)
+    print(f"Identity map:    {size / 2**20:9.1f} MiB in {duration:.1f}s")
+    with _without_interning():
+        size, duration = _measure(nodes, args.messages)
+    print(f"No identity map: {size / 2**20:9.1f} MiB in {duration:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
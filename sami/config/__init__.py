@@ -6,8 +6,6 @@ from datetime import datetime as _dt
 from pathlib import Path as _Path
 from random import randint as _randint
 
-from Crypto.Cipher import AES as _AES
-
 from ._base import Setting
 from ._base import Settings as _Settings
 
@@ -95,10 +93,124 @@ settings.broadcast_limit = Setting(
         "Number of contacts we should know before stopping the autodiscover broadcast"
     ),
 )
+settings.dns_timeout = Setting(
+    default_value=5,
+    description="Time after which we give up resolving a DNS name, in seconds",
+    user_settable="advanced",
+)
+settings.dns_min_ttl = Setting(
+    default_value=60,
+    description="Minimum time we keep a resolved DNS name, in seconds",
+    user_settable="advanced",
+)
+settings.dns_max_ttl = Setting(
+    default_value=24 * 60 * 60,
+    description="Maximum time we keep a resolved DNS name, in seconds",
+    user_settable="advanced",
+)
+settings.dns_negative_ttl = Setting(
+    default_value=5 * 60,
+    description=(
+        "Time after which we try again to resolve a DNS name which could not "
+        "be resolved, in seconds"
+    ),
+    user_settable="advanced",
+)
+settings.dns_workers = Setting(
+    default_value=4,
+    description="Number of DNS names we resolve concurrently",
+    user_settable="advanced",
+)
 settings.databases_directory = Setting(
     default_value=_Path("./db/").absolute(),
     description="Local directory where the database files will be stored",
 )
+settings.database_batch_size = Setting(
+    default_value=256,
+    description="Number of documents read at once when iterating over a table",
+    user_settable="advanced",
+)
+settings.max_shared_objects = Setting(
+    default_value=512,
+    description=(
+        "Maximum number of contacts or nodes we send when another client "
+        "asks us to share the ones we know"
+    ),
+    user_settable="advanced",
+)
+settings.max_contacts = Setting(
+    default_value=4096,
+    description=(
+        "Maximum number of contacts we store. "
+        "When exceeded, the ones we haven't seen for the longest time are removed"
+    ),
+    user_settable="advanced",
+)
+settings.requests_log = Setting(
+    default_value=False,
+    description=(
+        "Whether to store the requests in a log-structured store rather than "
+        "in the database. Recommended for relays"
+    ),
+    user_settable="advanced",
+)
+settings.requests_segment_size = Setting(
+    default_value=16 * 1024 * 1024,
+    description="Size, in bytes, from which a new requests log segment is created",
+    user_settable="advanced",
+)
+settings.requests_compaction_schedule = Setting(
+    default_value=60 * 60,
+    description="How often should we compact the requests log, in seconds",
+    user_settable="advanced",
+)
+settings.requests_retention = Setting(
+    default_value={},
+    description=(
+        "Retention policies overriding the default ones, mapping request statuses (e.g."
+        " 'MPP') to a `sami.network.requests.RetentionPolicy`"
+    ),
+    user_settable="advanced",
+)
+settings.seen_requests_cache_size = Setting(
+    default_value=16384,
+    description=(
+        "Number of identifiers of requests we don't store (e.g. BCP) kept "
+        "in memory, so that they are not handled again if replayed"
+    ),
+    user_settable="advanced",
+)
+settings.clear_messages_cache_size = Setting(
+    default_value=64 * 2**20,
+    description=(
+        "Approximate memory, in bytes, used to keep decrypted messages, "
+        "so that opening a conversation again doesn't decrypt them again"
+    ),
+    user_settable="advanced",
+)
+settings.chat_page_size = Setting(
+    default_value=50,
+    description="Number of messages loaded at once when scrolling a conversation",
+    user_settable="advanced",
+)
+settings.messages_archive_age = Setting(
+    default_value=90 * 24 * 60 * 60,
+    description="Age after which messages are archived, in seconds",
+    user_settable="advanced",
+)
+settings.messages_archive_min_count = Setting(
+    default_value=100,
+    description=(
+        "Minimum number of messages to archive at once in a conversation, "
+        "so that we don't create many small archives"
+    ),
+    user_settable="advanced",
+)
+settings.messages_archive_schedule = Setting(
+    default_value=24 * 60 * 60,
+    description="How often should we archive old messages, in seconds",
+    user_settable="advanced",
+)
 settings.logging_conf_file = Setting(
     default_value=_Path("./sami/logging.conf").absolute(),
     description="Logging configuration file path",
@@ -160,20 +272,106 @@ settings.identifier_base = Setting(
     ),
     user_settable="no",
 )
+settings.asymmetric_engine = Setting(
+    default_value="rsa",
+    description="Asymmetric cryptosystem used for the keys we generate",
+    hint=(
+        "Either 'rsa' or 'ec' (Ed25519 and X25519, faster). "
+        "Older clients only understand RSA keys"
+    ),
+    user_settable="advanced",
+)
+settings.hashing_scheme = Setting(
+    default_value="legacy",
+    description="How objects are hashed to compute their identifiers",
+    hint=(
+        "Either 'legacy' or 'canonical'. Identifiers are shared with the "
+        "other clients, so only use 'canonical' if all of them do. "
+        "The data we stored is moved to the new identifiers on start"
+    ),
+    user_settable="advanced",
+)
 settings.rsa_keys_length = Setting(
     default_value=4096,
     description="RSA keys length, in bits",
     user_settable="advanced",
 )
+settings.public_keys_cache_size = Setting(
+    default_value=1024,
+    description=(
+        "Number of public keys of each engine whose objects (e.g. ciphers "
+        "and signers) are kept in memory, so that they are not built again "
+        "for each operation"
+    ),
+    user_settable="advanced",
+)
+settings.key_pool_size = Setting(
+    default_value=0,
+    description=(
+        "Number of key pairs generated in advance, so that creating an "
+        "identity is instant"
+    ),
+    hint=(
+        "Only useful when creating many identities, e.g. for a fleet of bots. "
+        "0 disables the pool"
+    ),
+    user_settable="advanced",
+)
+settings.signature_cache_size = Setting(
+    default_value=16384,
+    description="Number of signatures whose verification result we remember",
+    user_settable="advanced",
+)
+settings.session_keys_lifetime = Setting(
+    default_value=24 * 60 * 60,
+    description=(
+        "Time after which the session key shared with a node is replaced, in seconds"
+    ),
+    user_settable="advanced",
+)
+settings.session_keys_max_uses = Setting(
+    default_value=1000,
+    description=(
+        "Number of keys exchanges after which the session key shared with "
+        "a node is replaced"
+    ),
+    user_settable="advanced",
+)
+settings.session_keys_cache_size = Setting(
+    default_value=4096,
+    description="Number of session keys kept in memory, for each direction",
+    user_settable="advanced",
+)
+settings.crypto_executor = Setting(
+    default_value="thread",
+    description=(
+        "Whether the asymmetric cryptography operations are run on a pool "
+        "of threads or of processes"
+    ),
+    hint="Either 'thread' or 'process'",
+    user_settable="advanced",
+)
+settings.crypto_workers = Setting(
+    default_value=0,
+    description=(
+        "Number of asymmetric cryptography operations run concurrently. "
+        "0 means one per CPU core"
+    ),
+    user_settable="advanced",
+)
 settings.aes_keys_length = Setting(
     default_value=32,
     description="Length of the AES object in bytes",
     # Note: multiply by 8 to get the AES protocol used e.g., 32*8=256 (AES256)
     user_settable="advanced",
 )
-settings.aes_mode = Setting(
-    default_value=_AES.MODE_EAX,
-    description="AES mode",
+settings.aead_engine = Setting(
+    default_value="eax",
+    description="Authenticated encryption used for the messages of new conversations",
+    hint=(
+        "Either 'eax', the only one older clients can read, 'aes-gcm' (faster) "
+        "or 'chacha20-poly1305' (faster on processors without AES instructions)"
+    ),
     user_settable="advanced",
 )
 settings.pow_difficulty = Setting(
@@ -1,17 +1,22 @@
 from __future__ import annotations
 
 import logging as _logging
+from collections import OrderedDict
+from dataclasses import dataclass
 from functools import cached_property
 from pathlib import Path
+from threading import Lock
+from typing import ClassVar
 
 import pydantic
-from Crypto.Cipher import PKCS1_OAEP
 from Crypto.Hash import SHA256
-from Crypto.PublicKey import RSA
-from Crypto.Signature import pkcs1_15
+from Crypto.PublicKey import ECC, RSA
 
 from ..config import settings
+from ..design import IdentityMap, Singleton
+from .engines import Components, get_engine
 from .hashing import hash_object
+from .key_pool import KeyPool
 from .serialization import (
     decode_bytes,
     deserialize_string,
@@ -21,28 +26,231 @@ from .serialization import (
 
 logger = _logging.getLogger("cryptography")
 
+# Public keys are part of every node, which is itself part of many objects
+_public_keys: IdentityMap[tuple, AnyPublicKey] = IdentityMap()
 
-class PublicKey(pydantic.BaseModel):
 
+def raw_signature(sig: bytes | str) -> bytes:
     """
-    Asymmetric public encryption key.
+    Signatures are held raw, except in the models which still serialize
+    them (e.g. `Node.sig`).
+    """
+    return sig if isinstance(sig, bytes) else deserialize_string(sig)
+
+
+@dataclass(frozen=True)
+class SignatureCacheStats:
+    hits: int
+    misses: int
+    size: int
+    max_size: int
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class SignatureCache(Singleton):
+
+    """
+    Remembers the result of the signatures we verified, so that a request
+    or a node we receive many times is only verified once.
+
+    Entries are keyed by the hash of the public key, the hash signed and
+    the signature. The least recently used ones are dropped past
+    `settings.signature_cache_size` entries.
+    """
+
+    _results: OrderedDict[tuple[bytes, bytes, bytes], bool]
+    _lock: Lock
+    _hits: int
+    _misses: int
+
+    def __enter__(self) -> SignatureCache:
+        return self
+
+    def __exit__(self, *_) -> None:
+        pass
+
+    def init(self):
+        self._results = OrderedDict()
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: tuple[bytes, bytes, bytes]) -> bool | None:
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+                self._results.move_to_end(key)
+            return result
+
+    def add(self, key: tuple[bytes, bytes, bytes], result: bool) -> None:
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > settings.signature_cache_size.get():
+                self._results.popitem(last=False)
+
+    def stats(self) -> SignatureCacheStats:
+        with self._lock:
+            return SignatureCacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                size=len(self._results),
+                max_size=settings.signature_cache_size.get(),
+            )
+
+
+class _PublicKeyOperations:
+
+    """
+    Operations shared by the public keys of all engines,
+    see `sami.cryptography.engines`.
+    """
+
+    __slots__ = ()
+
+    engine: ClassVar[str]
+
+    @property
+    def public_components(self) -> Components:
+        raise NotImplementedError
+
+    def is_private(self) -> bool:
+        return False
+
+    def encrypt_asymmetric_raw(self, data: bytes) -> bytes:
+        return get_engine(self.engine).encrypt(self.public_components, data)
+
+    def encrypt_asymmetric(self, data: str) -> str:
+        """
+        Asymmetrically encrypts and serializes data.
+        Must be reversible with `decrypt_asymmetric()`.
+        """
+        return serialize_bytes(self.encrypt_asymmetric_raw(encode_string(data)))
+
+    def is_signature_valid(self, hash_obj: SHA256.SHA256Hash, sig: bytes | str) -> bool:
+        """
+        Takes a signature, raw or serialized, and checks whether it is valid.
+        Results are cached, see `SignatureCache`.
+        """
+        try:
+            raw_sig = raw_signature(sig)
+        except (ValueError, TypeError):
+            return False
+        key = (self.hash.digest(), hash_obj.digest(), raw_sig)
+        with SignatureCache() as cache:
+            valid = cache.get(key)
+            if valid is None:
+                valid = get_engine(self.engine).verify(
+                    self.public_components, hash_obj.digest(), raw_sig
+                )
+                cache.add(key, valid)
+        return valid
+
+
+class _PrivateKeyOperations:
+
+    """
+    Operations shared by the private keys of all engines.
+    """
+
+    __slots__ = ()
+
+    engine: ClassVar[str]
+
+    @property
+    def private_components(self) -> Components:
+        raise NotImplementedError
+
+    def is_private(self) -> bool:
+        return True
+
+    @classmethod
+    def _new_components(cls) -> Components:
+        """
+        Takes a key pair from the `KeyPool` if one is ready,
+        and generates one otherwise.
+        """
+        with KeyPool() as pool:
+            components = pool.take(cls.engine)
+        if components is None:
+            components = get_engine(cls.engine).generate()
+        return components
+
+    def decrypt_asymmetric_raw(self, en_data: bytes) -> bytes:
+        return get_engine(self.engine).decrypt(self.private_components, en_data)
+
+    def decrypt_asymmetric(self, se_en_data: str) -> str | None:
+        """
+        Deserializes and decrypts data.
+        Returns None if we cannot decrypt.
+        """
+        en_data = deserialize_string(se_en_data)
+        try:
+            return decode_bytes(self.decrypt_asymmetric_raw(en_data))
+        except ValueError:
+            return
+
+    def get_signature(self, hash_obj: SHA256.SHA256Hash) -> str:
+        """
+        Signs a hash with this private key.
+        """
+        return serialize_bytes(
+            get_engine(self.engine).sign(self.private_components, hash_obj.digest())
+        )
+
+
+class PublicKey(pydantic.BaseModel, _PublicKeyOperations):
+
+    """
+    RSA public encryption key.
 
     Instantiate with available classmethods to load an existing key.
-    To create a new pair, use `PrivateKey.new()`.
+    To create a new pair, use `new_private_key()`.
     """
 
+    # Allows registering instances in `_public_keys`
+    __slots__ = ("__weakref__",)
+
+    engine: ClassVar[str] = "rsa"
+
     n: int
     e: int
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self._rsa = RSA.construct((self.n, self.e), consistency_check=False)
+    @property
+    def public_components(self) -> Components:
+        return self.n, self.e
+
+    @property
+    def _rsa(self) -> RSA.RsaKey:
+        return get_engine(self.engine).key(self.public_components)
 
     @classmethod
     @pydantic.root_validator()
     def _rsa_consistency_check(cls, values):
         RSA.construct((values["n"], values["e"]), consistency_check=True)
 
+    @classmethod
+    def validate(cls, value) -> PublicKey:
+        """
+        Called by pydantic when validating a field of this type.
+        Returns the instance we already have for this key, if any.
+        """
+        if cls is not PublicKey:
+            return super().validate(value)
+        if type(value) is PublicKey:
+            key = (value.n, value.e)
+        elif isinstance(value, dict) and {"n", "e"} <= value.keys():
+            key = (value["n"], value["e"])
+        else:
+            return super().validate(value)
+        return _public_keys.intern(key, lambda: super(PublicKey, cls).validate(value))
+
     @classmethod
     def from_rsa(cls, public_key: RSA.RsaKey):
         return cls(n=public_key.n, e=public_key.e)
@@ -64,41 +272,25 @@ class PublicKey(pydantic.BaseModel):
         sha_length = sha_len_bits // 8
         return keys_length - (2 + sha_length * 2)
 
-    def is_private(self) -> bool:
-        return self._rsa.has_private()
-
-    def encrypt_asymmetric_raw(self, data: bytes) -> bytes:
-        return PKCS1_OAEP.new(self._rsa).encrypt(data)
-
-    def encrypt_asymmetric(self, data: str) -> str:
-        """
-        Asymmetrically encrypts and serializes data.
-        Must be reversible with `decrypt_asymmetric()`.
-        """
-        return serialize_bytes(self.encrypt_asymmetric_raw(encode_string(data)))
-
-    def is_signature_valid(self, hash_obj: SHA256.SHA256Hash, sig: str) -> bool:
-        """
-        Takes a signature and checks whether it is valid.
-        """
-        try:
-            pkcs1_15.new(self._rsa).verify(hash_obj, deserialize_string(sig))
-        except (ValueError, TypeError):
-            return False
-        return True
-
     @cached_property
     def hash(self) -> SHA256.SHA256Hash:
         """
         Returns a hash of the public key.
         """
-        return hash_object([self._rsa.n, self._rsa.e])
+        return hash_object([self.n, self.e])
 
+    @staticmethod
+    def hash_document(document: dict) -> SHA256.SHA256Hash:
+        """
+        Same as `hash`, from the stored form of the key.
+        """
+        return hash_object([document["n"], document["e"]])
 
-class PrivateKey(pydantic.BaseModel, PublicKey):
+
+class PrivateKey(_PrivateKeyOperations, PublicKey):
 
     """
-    Asymmetric private encryption key.
+    RSA private encryption key.
 
     Instantiate with `new` to get a brand-new key pair.
     Instantiate with other classmethods to load an existing key.
@@ -110,11 +302,13 @@ class PrivateKey(pydantic.BaseModel, PublicKey):
     p: int
     q: int
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self._rsa = RSA.construct(
-            (self.n, self.e, self.d, self.p, self.q), consistency_check=False
-        )
+    @property
+    def private_components(self) -> Components:
+        return self.n, self.e, self.d, self.p, self.q
+
+    @property
+    def _rsa(self) -> RSA.RsaKey:
+        return get_engine(self.engine).key(self.private_components)
 
     @classmethod
     @pydantic.root_validator()
@@ -136,8 +330,8 @@ class PrivateKey(pydantic.BaseModel, PublicKey):
 
     @classmethod
     def new(cls) -> PrivateKey:
-        key = RSA.generate(settings.rsa_keys_length)
-        return cls.from_rsa(key)
+        n, e, d, p, q = cls._new_components()
+        return cls(n=n, e=e, d=d, p=p, q=q)
 
     @staticmethod
     def get_key_from_components(
@@ -179,24 +373,173 @@ class PrivateKey(pydantic.BaseModel, PublicKey):
             f.write(self._rsa.export_key(format="DER", passphrase=passphrase))
 
     def get_public_key(self) -> PublicKey:
-        return PublicKey(
-            n=self._rsa.n,
-            e=self._rsa.e,
-        )
+        return PublicKey(n=self.n, e=self.e)
 
-    def decrypt_asymmetric_raw(self, en_data: bytes) -> bytes:
-        return PKCS1_OAEP.new(self._rsa).decrypt(en_data)
 
-    def decrypt_asymmetric(self, se_en_data: str) -> str | None:
+class ECPublicKey(pydantic.BaseModel, _PublicKeyOperations):
+
+    """
+    Elliptic-curve public key: an Ed25519 key for signatures, and an X25519
+    key for encryption, both serialized.
+    """
+
+    # Allows registering instances in `_public_keys`
+    __slots__ = ("__weakref__",)
+
+    engine: ClassVar[str] = "ec"
+
+    ed25519: str
+    x25519: str
+
+    @property
+    def public_components(self) -> Components:
+        return deserialize_string(self.ed25519), deserialize_string(self.x25519)
+
+    @classmethod
+    def validate(cls, value) -> ECPublicKey:
         """
-        Deserializes and decrypts data.
-        Returns None if we cannot decrypt.
+        See `PublicKey.validate`.
         """
-        en_data = deserialize_string(se_en_data)
-        return decode_bytes(self.decrypt_asymmetric_raw(en_data))
+        if cls is not ECPublicKey:
+            return super().validate(value)
+        if type(value) is ECPublicKey:
+            key = (value.ed25519, value.x25519)
+        elif isinstance(value, dict) and {"ed25519", "x25519"} <= value.keys():
+            key = (value["ed25519"], value["x25519"])
+        else:
+            return super().validate(value)
+        return _public_keys.intern(key, lambda: super(ECPublicKey, cls).validate(value))
 
-    def get_signature(self, hash_obj: SHA256.SHA256Hash) -> str:
+    def _to_file(self, file: Path) -> None:
+        """
+        See `PublicKey._to_file`.
+        """
+        file.write_text(self.json())
+
+    @cached_property
+    def hash(self) -> SHA256.SHA256Hash:
+        """
+        Returns a hash of the public key.
+        """
+        return hash_object([self.ed25519, self.x25519])
+
+    @staticmethod
+    def hash_document(document: dict) -> SHA256.SHA256Hash:
+        """
+        Same as `hash`, from the stored form of the key.
+        """
+        return hash_object([document["ed25519"], document["x25519"]])
+
+
+class ECPrivateKey(_PrivateKeyOperations, ECPublicKey):
+
+    """
+    Elliptic-curve private key.
+    Only its Ed25519 seed is secret: the X25519 key is derived from it.
+
+    Instantiate with `new` to get a brand-new key pair.
+    """
+
+    seed: str
+
+    @property
+    def private_components(self) -> Components:
+        return (deserialize_string(self.seed),)
+
+    @classmethod
+    def from_seed(cls, seed: bytes) -> ECPrivateKey:
+        ed25519, x25519 = get_engine(cls.engine).public_components((seed,))
+        return cls(
+            ed25519=serialize_bytes(ed25519),
+            x25519=serialize_bytes(x25519),
+            seed=serialize_bytes(seed),
+        )
+
+    @classmethod
+    def new(cls) -> ECPrivateKey:
+        (seed,) = cls._new_components()
+        return cls.from_seed(seed)
+
+    @classmethod
+    def from_file(
+        cls, file: Path, passphrase: str | None = None
+    ) -> ECPrivateKey | None:
+        with file.open(mode="rb") as k:
+            try:
+                private_key = ECC.import_key(k.read(), passphrase=passphrase)
+            except (ValueError, IndexError, TypeError):
+                logger.warning(f"Couldn't read private key from {file!s}")
+                return
+
+        if private_key.has_private() and private_key.curve == "Ed25519":
+            return cls.from_seed(private_key.seed)
+
+    def _to_file(self, file: Path, passphrase: str | None = None) -> None:
         """
-        Sign a hash using an RSA private key.
+        Writes the Ed25519 key, in PKCS#8 form.
         """
-        return serialize_bytes(pkcs1_15.new(self._rsa).sign(hash_obj))
+        private_key = ECC.construct(curve="Ed25519", seed=deserialize_string(self.seed))
+        if passphrase is None:
+            data = private_key.export_key(format="DER")
+        else:
+            data = private_key.export_key(
+                format="DER",
+                passphrase=passphrase,
+                protection="PBKDF2WithHMAC-SHA512AndAES256-CBC",
+            )
+        with file.open(mode="wb") as f:
+            f.write(data)
+
+    def get_public_key(self) -> ECPublicKey:
+        return ECPublicKey(ed25519=self.ed25519, x25519=self.x25519)
+
+
+AnyPublicKey = PublicKey | ECPublicKey
+AnyPrivateKey = PrivateKey | ECPrivateKey
+
+_PRIVATE_KEYS: dict[str, type[AnyPrivateKey]] = {
+    PrivateKey.engine: PrivateKey,
+    ECPrivateKey.engine: ECPrivateKey,
+}
+
+
+def new_private_key(engine: str | None = None) -> AnyPrivateKey:
+    """
+    Generates a new key pair, with `settings.asymmetric_engine` by default.
+    """
+    if engine is None:
+        engine = settings.asymmetric_engine.get()
+    return _PRIVATE_KEYS[engine].new()
+
+
+def private_key_from_file(
+    file: Path, passphrase: str | None = None
+) -> AnyPrivateKey | None:
+    """
+    Loads a private key of any engine from a file.
+    """
+    for private_key_class in _PRIVATE_KEYS.values():
+        private_key = private_key_class.from_file(file, passphrase)
+        if private_key is not None:
+            return private_key
+
+
+def validate_public_key(value) -> AnyPublicKey:
+    """
+    Validates a public key of any engine, e.g. from a document.
+    """
+    if isinstance(value, ECPublicKey) or (
+        isinstance(value, dict) and "ed25519" in value
+    ):
+        return ECPublicKey.validate(value)
+    return PublicKey.validate(value)
+
+
+def hash_public_key_document(document: dict) -> SHA256.SHA256Hash:
+    """
+    Computes the hash of a public key of any engine from its stored form,
+    without validating it.
+    """
+    if "ed25519" in document:
+        return ECPublicKey.hash_document(document)
+    return PublicKey.hash_document(document)
@@ -0,0 +1,312 @@
+"""
+Asymmetric cryptosystems.
+
+Engines implement the primitives on raw bytes, keys being passed as tuples
+of their components, so that operations can be sent to another process
+(see `CryptoService`). `PublicKey` and `PrivateKey` and their elliptic-curve
+counterparts wrap them.
+"""
+
+from __future__ import annotations
+
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable
+
+from Crypto.Cipher import AES, PKCS1_OAEP
+from Crypto.Hash import SHA256
+from Crypto.Protocol.DH import (
+    import_x25519_private_key,
+    import_x25519_public_key,
+    key_agreement,
+)
+from Crypto.Protocol.KDF import HKDF
+from Crypto.PublicKey import ECC, RSA
+from Crypto.Signature import eddsa, pkcs1_15
+
+from ..config import settings
+
+Components = tuple[Any, ...]
+
+
+class AsymmetricEngine(ABC):
+
+    """
+    Primitives of an asymmetric cryptosystem.
+    Operations which fail (e.g. decryption with the wrong key)
+    raise `ValueError`.
+    """
+
+    name: str
+
+    @abstractmethod
+    def generate(self) -> Components:
+        """
+        Generates a new key pair, and returns its private components.
+        """
+        pass
+
+    @abstractmethod
+    def public_components(self, private: Components) -> Components:
+        pass
+
+    @abstractmethod
+    def encrypt(self, public: Components, data: bytes) -> bytes:
+        pass
+
+    @abstractmethod
+    def decrypt(self, private: Components, en_data: bytes) -> bytes:
+        pass
+
+    @abstractmethod
+    def sign(self, private: Components, digest: bytes) -> bytes:
+        """
+        Signs the digest of a SHA-256 hash.
+        """
+        pass
+
+    @abstractmethod
+    def verify(self, public: Components, digest: bytes, sig: bytes) -> bool:
+        pass
+
+
+class _Digest:
+
+    """
+    Stands for a SHA-256 hash object whose digest was already computed,
+    as they cannot be pickled.
+    """
+
+    oid = SHA256.SHA256Hash.oid
+
+    def __init__(self, digest: bytes):
+        self._digest = digest
+
+    def digest(self) -> bytes:
+        return self._digest
+
+
+class _PublicKeysCache:
+
+    """
+    Objects built for public keys, by components, up to
+    `settings.public_keys_cache_size` keys, the least recently used ones
+    being dropped.
+    Private keys are not kept, so that they don't stay in memory once the
+    objects holding them are gone. Building them again is cheap next to the
+    operations done with them.
+    """
+
+    def __init__(self, build: Callable[[Components], Any]):
+        self._build = build
+        self._entries: OrderedDict[Components, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, public: Components) -> Any:
+        with self._lock:
+            value = self._entries.get(public)
+            if value is not None:
+                self._entries.move_to_end(public)
+                return value
+        # Built without the lock, another thread might do it too
+        value = self._build(public)
+        with self._lock:
+            value = self._entries.setdefault(public, value)
+            while len(self._entries) > settings.public_keys_cache_size.get():
+                self._entries.popitem(last=False)
+        return value
+
+
+class _RSAContexts:
+
+    """
+    Objects built for an RSA key: the key itself, which is shared, and its
+    cipher and signer, of which each thread gets its own.
+    """
+
+    __slots__ = ("key", "_local")
+
+    def __init__(self, components: Components):
+        self.key = RSA.construct(components, consistency_check=False)
+        self._local = threading.local()
+
+    @property
+    def cipher(self) -> PKCS1_OAEP.PKCS1OAEP_Cipher:
+        cipher = getattr(self._local, "cipher", None)
+        if cipher is None:
+            cipher = self._local.cipher = PKCS1_OAEP.new(self.key)
+        return cipher
+
+    @property
+    def signer(self) -> pkcs1_15.PKCS115_SigScheme:
+        signer = getattr(self._local, "signer", None)
+        if signer is None:
+            signer = self._local.signer = pkcs1_15.new(self.key)
+        return signer
+
+
+class RSAEngine(AsymmetricEngine):
+
+    """
+    RSA with OAEP encryption and PKCS#1 v1.5 signatures.
+    Public components are (n, e), private ones (n, e, d, p, q).
+
+    Public keys are only constructed once, see `_PublicKeysCache`.
+    """
+
+    name = "rsa"
+
+    def __init__(self):
+        self._public_contexts = _PublicKeysCache(_RSAContexts)
+
+    def _get_contexts(self, components: Components) -> _RSAContexts:
+        if len(components) > 2:
+            return _RSAContexts(components)
+        return self._public_contexts.get(components)
+
+    def key(self, components: Components) -> RSA.RsaKey:
+        return self._get_contexts(components).key
+
+    def generate(self) -> Components:
+        key = RSA.generate(settings.rsa_keys_length.get())
+        return key.n, key.e, key.d, key.p, key.q
+
+    def public_components(self, private: Components) -> Components:
+        return private[:2]
+
+    def encrypt(self, public: Components, data: bytes) -> bytes:
+        return self._get_contexts(public).cipher.encrypt(data)
+
+    def decrypt(self, private: Components, en_data: bytes) -> bytes:
+        return self._get_contexts(private).cipher.decrypt(en_data)
+
+    def sign(self, private: Components, digest: bytes) -> bytes:
+        return self._get_contexts(private).signer.sign(_Digest(digest))
+
+    def verify(self, public: Components, digest: bytes, sig: bytes) -> bool:
+        try:
+            self._get_contexts(public).signer.verify(_Digest(digest), sig)
+        except (ValueError, TypeError):
+            return False
+        return True
+
+
+class ECEngine(AsymmetricEngine):
+
+    """
+    Ed25519 signatures, and X25519 key agreement for encryption:
+    data is encrypted with AES-GCM, under a key derived from an ephemeral
+    X25519 key and the recipient's.
+
+    The private component is an Ed25519 seed, from which the X25519 seed is
+    derived. The public components are the Ed25519 and X25519 public keys,
+    32 bytes each.
+    """
+
+    name = "ec"
+
+    _SEED_LENGTH = 32
+    _POINT_LENGTH = 32
+    _TAG_LENGTH = 16
+    # Each encryption uses a new key, so the nonce needn't change
+    _NONCE = bytes(12)
+
+    @classmethod
+    def _x25519_seed(cls, ed25519_seed: bytes) -> bytes:
+        return HKDF(
+            ed25519_seed, cls._SEED_LENGTH, salt=b"", hashmod=SHA256, context=b"X25519"
+        )
+
+    def __init__(self):
+        self._public_cache = _PublicKeysCache(self._import_public_keys)
+
+    @staticmethod
+    def _private_keys(private: Components) -> tuple[ECC.EccKey, ECC.EccKey]:
+        (seed,) = private
+        return (
+            eddsa.import_private_key(seed),
+            import_x25519_private_key(ECEngine._x25519_seed(seed)),
+        )
+
+    @staticmethod
+    def _import_public_keys(public: Components) -> tuple[ECC.EccKey, ECC.EccKey]:
+        ed25519, x25519 = public
+        return (
+            eddsa.import_public_key(ed25519),
+            import_x25519_public_key(x25519),
+        )
+
+    def _public_keys(self, public: Components) -> tuple[ECC.EccKey, ECC.EccKey]:
+        return self._public_cache.get(public)
+
+    @classmethod
+    def _derive_key(cls, secret: bytes, ephemeral: bytes, recipient: bytes) -> bytes:
+        return HKDF(
+            secret,
+            settings.aes_keys_length.get(),
+            salt=ephemeral + recipient,
+            hashmod=SHA256,
+        )
+
+    def generate(self) -> Components:
+        return (ECC.generate(curve="Ed25519").seed,)
+
+    def public_components(self, private: Components) -> Components:
+        return tuple(
+            key.public_key().export_key(format="raw")
+            for key in self._private_keys(private)
+        )
+
+    def encrypt(self, public: Components, data: bytes) -> bytes:
+        _, x25519 = public
+        ephemeral = ECC.generate(curve="Curve25519")
+        ephemeral_raw = ephemeral.public_key().export_key(format="raw")
+        key = key_agreement(
+            static_priv=ephemeral,
+            static_pub=self._public_keys(public)[1],
+            kdf=lambda secret: self._derive_key(secret, ephemeral_raw, x25519),
+        )
+        cipher = AES.new(key, AES.MODE_GCM, nonce=self._NONCE)
+        ciphertext, tag = cipher.encrypt_and_digest(data)
+        return ephemeral_raw + ciphertext + tag
+
+    def decrypt(self, private: Components, en_data: bytes) -> bytes:
+        if len(en_data) < self._POINT_LENGTH + self._TAG_LENGTH:
+            raise ValueError("Ciphertext too short")
+        ephemeral_raw = en_data[: self._POINT_LENGTH]
+        ciphertext = en_data[self._POINT_LENGTH : -self._TAG_LENGTH]
+        tag = en_data[-self._TAG_LENGTH :]
+        _, x25519 = self._private_keys(private)
+        key = key_agreement(
+            static_priv=x25519,
+            static_pub=import_x25519_public_key(ephemeral_raw),
+            kdf=lambda secret: self._derive_key(
+                secret,
+                ephemeral_raw,
+                x25519.public_key().export_key(format="raw"),
+            ),
+        )
+        cipher = AES.new(key, AES.MODE_GCM, nonce=self._NONCE)
+        return cipher.decrypt_and_verify(ciphertext, tag)
+
+    def sign(self, private: Components, digest: bytes) -> bytes:
+        ed25519, _ = self._private_keys(private)
+        return eddsa.new(ed25519, "rfc8032").sign(digest)
+
+    def verify(self, public: Components, digest: bytes, sig: bytes) -> bool:
+        try:
+            ed25519, _ = self._public_keys(public)
+            eddsa.new(ed25519, "rfc8032").verify(digest, sig)
+        except (ValueError, TypeError):
+            return False
+        return True
+
+
+ENGINES: dict[str, AsymmetricEngine] = {
+    engine.name: engine for engine in (RSAEngine(), ECEngine())
+}
+
+
+def get_engine(name: str) -> AsymmetricEngine:
+    return ENGINES[name]
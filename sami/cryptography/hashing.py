@@ -1,19 +1,279 @@
+"""
+Hashing of objects.
+
+Identifiers are computed from the hash of a canonical encoding of objects,
+which only depends on their values. Each value is encoded as a one-byte
+tag, followed for variable-size values by their length, so that two
+different objects cannot have the same encoding. Containers are encoded
+recursively, and the elements of sets and dictionaries are sorted by their
+encoding, so that their order doesn't matter.
+
+As older clients identify objects by the hash of their pickle, this legacy
+scheme stays the default. The canonical one is selected with
+`settings.hashing_scheme`, once every client we talk to uses it.
+"""
+
+from __future__ import annotations
+
+import hashlib
 import logging as _logging
 import pickle
-from typing import Any
+import struct
+import threading
+import weakref
+from contextlib import contextmanager
+from enum import Enum
+from typing import Any, Callable, Generator
 
+import pydantic
 from Crypto.Hash import SHA256
 
 from ..config import settings
 
 logger = _logging.getLogger("cryptography")
 
+_LENGTH = struct.Struct(">Q")
+
+_scheme_override = threading.local()
+
+
+class Sha256Hash:
+
+    """
+    SHA-256 hash computed with `hashlib`, which releases the GIL on large
+    inputs. Exposes the interface of pycryptodome's hash objects, so that it
+    can be used in their place (e.g. with `pkcs1_15`).
+    """
+
+    __slots__ = ("_hash",)
+
+    oid = SHA256.SHA256Hash.oid
+    digest_size = 32
+    block_size = 64
+
+    def __init__(self, data: bytes | None = None):
+        self._hash = hashlib.sha256()
+        if data is not None:
+            self._hash.update(data)
+
+    def update(self, data: bytes) -> None:
+        self._hash.update(data)
+
+    def digest(self) -> bytes:
+        return self._hash.digest()
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+    def copy(self) -> Sha256Hash:
+        other = Sha256Hash()
+        other._hash = self._hash.copy()
+        return other
+
+    @staticmethod
+    def new(data: bytes | None = None) -> Sha256Hash:
+        return Sha256Hash(data)
+
+
+class Digest:
+
+    """
+    Hash of which we only know the digest, e.g. because we were sent it.
+    Can be used in place of a hash object where only its digest is read,
+    e.g. to check a signature.
+    """
+
+    __slots__ = ("_digest",)
+
+    def __init__(self, digest: bytes):
+        self._digest = digest
+
+    @classmethod
+    def from_hex(cls, hexdigest: str) -> Digest:
+        return cls(bytes.fromhex(hexdigest))
+
+    def digest(self) -> bytes:
+        return self._digest
+
+    def hexdigest(self) -> str:
+        return self._digest.hex()
+
+
+# Encodings of the immutable models we hashed, by object identifier.
+# Nodes and public keys are interned, and are part of many of the objects
+# we hash (requests, conversations, etc.), so they are only encoded once.
+_model_encodings: dict[int, bytes] = {}
+
+
+def _sized(tag: bytes, data: bytes) -> bytes:
+    return tag + _LENGTH.pack(len(data)) + data
+
+
+def _encode_none(_, out: list) -> None:
+    out.append(b"N")
+
+
+def _encode_bool(obj: bool, out: list) -> None:
+    out.append(b"T" if obj else b"F")
+
+
+def _encode_int(obj: int, out: list) -> None:
+    out.append(
+        _sized(b"I", obj.to_bytes((obj.bit_length() + 8) // 8, "big", signed=True))
+    )
+
+
+def _encode_float(obj: float, out: list) -> None:
+    out.append(b"D" + struct.pack(">d", obj))
+
+
+def _encode_str(obj: str, out: list) -> None:
+    out.append(_sized(b"S", obj.encode("utf-8")))
+
+
+def _encode_bytes(obj: bytes, out: list) -> None:
+    # Large values are appended as is rather than copied
+    out.append(b"B" + _LENGTH.pack(len(obj)))
+    out.append(bytes(obj))
+
+
+def _encode_sequence(obj: list | tuple, out: list) -> None:
+    out.append(b"L" + _LENGTH.pack(len(obj)))
+    for item in obj:
+        _encode(item, out)
+
+
+def _encode_set(obj: set | frozenset, out: list) -> None:
+    out.append(b"E" + _LENGTH.pack(len(obj)))
+    for encoded in sorted(canonical_encode(item) for item in obj):
+        out.append(_sized(b"", encoded))
+
+
+def _encode_dict(obj: dict, out: list) -> None:
+    out.append(b"M" + _LENGTH.pack(len(obj)))
+    for encoded_key, value in sorted(
+        (canonical_encode(key), value) for key, value in obj.items()
+    ):
+        out.append(_sized(b"", encoded_key))
+        _encode(value, out)
+
+
+def _encode_model(obj: pydantic.BaseModel, out: list) -> None:
+    """
+    Models are encoded as their name, followed by their fields in the order
+    they are declared.
+    """
+    encoded = _model_encodings.get(id(obj))
+    if encoded is not None:
+        out.append(encoded)
+        return
+    parts = [
+        _sized(b"O", type(obj).__name__.encode("utf-8")),
+        _LENGTH.pack(len(obj.__fields__)),
+    ]
+    for name in obj.__fields__:
+        parts.append(_sized(b"", name.encode("utf-8")))
+        _encode(getattr(obj, name), parts)
+    encoded = b"".join(parts)
+    if not obj.__config__.allow_mutation or obj.__config__.frozen:
+        try:
+            weakref.finalize(obj, _model_encodings.pop, id(obj), None)
+        except TypeError:
+            # Does not support weak references, see `IdentityMap`
+            pass
+        else:
+            _model_encodings[id(obj)] = encoded
+    out.append(encoded)
+
+
+def _encode_other(obj: Any, out: list) -> None:
+    """
+    Other values (IP addresses, DNS names, etc.) are encoded as their type
+    name and their string representation.
+    """
+    out.append(_sized(b"R", type(obj).__name__.encode("utf-8")))
+    out.append(_sized(b"", str(obj).encode("utf-8")))
+
+
+_ENCODERS: dict[type, Callable[[Any, list], None]] = {
+    type(None): _encode_none,
+    bool: _encode_bool,
+    int: _encode_int,
+    float: _encode_float,
+    str: _encode_str,
+    bytes: _encode_bytes,
+    bytearray: _encode_bytes,
+    memoryview: _encode_bytes,
+    list: _encode_sequence,
+    tuple: _encode_sequence,
+    set: _encode_set,
+    frozenset: _encode_set,
+    dict: _encode_dict,
+}
+
+
+def _encode(obj: Any, out: list) -> None:
+    encoder = _ENCODERS.get(type(obj))
+    if encoder is not None:
+        encoder(obj, out)
+    elif isinstance(obj, pydantic.BaseModel):
+        _encode_model(obj, out)
+    elif isinstance(obj, Enum):
+        _encode(obj.value, out)
+    else:
+        # Subclasses of the base types, e.g. `Identifier`
+        for base, encoder in _ENCODERS.items():
+            if isinstance(obj, base):
+                encoder(obj, out)
+                break
+        else:
+            _encode_other(obj, out)
+
+
+def canonical_encode(obj: Any) -> bytes:
+    """
+    Returns the canonical encoding of an object.
+    Only depends on the value of the object, and not on the version of
+    Python or of the libraries we use.
+    """
+    out = []
+    _encode(obj, out)
+    return b"".join(out)
+
+
+def legacy_hash_object(obj: Any) -> Sha256Hash:
+    """
+    Hash of the pickle of an object, which identifiers were computed from
+    before the canonical encoding.
+    """
+    return Sha256Hash(pickle.dumps(obj))
+
+
+def get_hashing_scheme() -> str:
+    return getattr(_scheme_override, "scheme", None) or settings.hashing_scheme.get()
+
+
+@contextmanager
+def hashing_scheme(scheme: str) -> Generator[None, None, None]:
+    """
+    Computes, in the current thread, the hashes with `scheme` rather than
+    `settings.hashing_scheme`. Used to compute legacy identifiers.
+    """
+    previous = getattr(_scheme_override, "scheme", None)
+    _scheme_override.scheme = scheme
+    try:
+        yield
+    finally:
+        _scheme_override.scheme = previous
+
 
-def hash_object(obj: Any) -> SHA256.SHA256Hash:
+def hash_object(obj: Any) -> Sha256Hash:
     """
     Returns a hash object of the value passed.
     """
-    return SHA256.new(pickle.dumps(obj))
+    if get_hashing_scheme() == "legacy":
+        return legacy_hash_object(obj)
+    return Sha256Hash(canonical_encode(obj))
 
 
 def compute_pow(request):
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import logging as _logging
+import time
+from collections import deque
+from concurrent import futures
+from dataclasses import dataclass
+from threading import Lock
+from typing import Callable
+
+from ..config import settings
+from ..design import Singleton
+from .engines import Components, get_engine
+
+logger = _logging.getLogger("cryptography")
+
+
+@dataclass(frozen=True)
+class KeyPoolProgress:
+    engine: str
+    # Number of key pairs ready to be used
+    ready: int
+    # Number of key pairs we keep ready
+    target: int
+    # Whether a key pair is being generated
+    generating: bool
+
+
+class KeyPool(Singleton):
+
+    """
+    Keeps a few key pairs of each engine ready, generated in the background,
+    so that creating an identity doesn't wait for the generation of a key.
+
+    Pools are filled up to `settings.key_pool_size` key pairs: when a key is
+    taken, another one is generated. A pool is only filled once it has been
+    used, or on a call to `fill`.
+    The pool is disabled by default, as a client rarely creates more than
+    one identity, and the keys generated in advance would be wasted.
+
+    Examples
+    --------
+    >>> with KeyPool() as pool:
+    >>>     pool.add_callback(lambda progress: print(progress.ready))
+    >>>     pool.fill("rsa")
+    >>> PrivateKey.new()  # Instant if a key is ready
+    """
+
+    _pools: dict[str, deque[Components]]
+    _generating: set[str]
+    _callbacks: list[Callable[[KeyPoolProgress], None]]
+    _lock: Lock
+    _executor: futures.ThreadPoolExecutor
+
+    def __enter__(self) -> KeyPool:
+        return self
+
+    def __exit__(self, *_) -> None:
+        pass
+
+    def init(self):
+        self._pools = {}
+        self._generating = set()
+        self._callbacks = []
+        self._lock = Lock()
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="KeyPool",
+        )
+
+    def add_callback(self, callback: Callable[[KeyPoolProgress], None]) -> None:
+        """
+        Registers a function called with the progress of a pool each time
+        it changes. It is called from the generating thread.
+        """
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def get_progress(self, engine: str) -> KeyPoolProgress:
+        with self._lock:
+            return self._get_progress(engine)
+
+    def _get_progress(self, engine: str) -> KeyPoolProgress:
+        """
+        Must be called with the lock held.
+        """
+        return KeyPoolProgress(
+            engine=engine,
+            ready=len(self._pools.get(engine, ())),
+            target=settings.key_pool_size.get(),
+            generating=engine in self._generating,
+        )
+
+    def _notify(self, progress: KeyPoolProgress) -> None:
+        for callback in list(self._callbacks):
+            try:
+                callback(progress)
+            except Exception:
+                logger.exception("Key pool progress callback failed")
+
+    def fill(self, engine: str) -> None:
+        """
+        Starts generating key pairs for `engine` in the background,
+        if its pool is not full.
+        """
+        with self._lock:
+            self._pools.setdefault(engine, deque())
+            if engine in self._generating:
+                return
+            if len(self._pools[engine]) >= settings.key_pool_size.get():
+                return
+            self._generating.add(engine)
+            progress = self._get_progress(engine)
+        self._notify(progress)
+        self._executor.submit(self._generate, engine)
+
+    def take(self, engine: str) -> Components | None:
+        """
+        Returns the private components of a key pair ready to be used,
+        or None if there is none, in which case the caller must generate
+        one. Either way, the pool is refilled in the background.
+        Key pairs are only ever returned once.
+        """
+        with self._lock:
+            pool = self._pools.setdefault(engine, deque())
+            components = pool.popleft() if pool else None
+        self.fill(engine)
+        return components
+
+    def _generate(self, engine: str) -> None:
+        """
+        Generates key pairs until the pool is full.
+        """
+        while True:
+            start = time.perf_counter()
+            try:
+                components = get_engine(engine).generate()
+            except Exception:
+                logger.exception(f"Could not generate a {engine} key pair")
+                components = None
+            with self._lock:
+                pool = self._pools[engine]
+                if components is not None:
+                    pool.append(components)
+                full = components is None or len(pool) >= settings.key_pool_size.get()
+                if full:
+                    self._generating.discard(engine)
+                progress = self._get_progress(engine)
+            logger.debug(
+                f"Generated a {engine} key pair in "
+                f"{time.perf_counter() - start:.2f}s "
+                f"({progress.ready}/{progress.target} ready)"
+            )
+            self._notify(progress)
+            if full:
+                return
@@ -1,28 +1,52 @@
+from concurrent import futures
+
 import pydantic
 
 from ..objects import MasterNode, Node, is_private_key_loaded
-from .serialization import deserialize_string
+from .serialization import BinaryModel, decode_bytes, deserialize_string
+from .service import CryptoService
 from .symmetric import SymmetricKey, SymmetricKeyPart
 
 
-class EncryptedSymmetricKeyPart(pydantic.BaseModel):
+class EncryptedSymmetricKeyPart(BinaryModel):
     """
     Asymmetrically encrypted symmetric encryption value part.
     """
 
-    value: str
+    value: bytes
     author: Node
 
     def to_clear(self) -> SymmetricKeyPart | None:
+        return self.to_clear_async().result()
+
+    def to_clear_async(self) -> futures.Future[SymmetricKeyPart | None]:
+        """
+        Same as `to_clear`, but decrypts on the `CryptoService`.
+        """
+        future = futures.Future()
         if not is_private_key_loaded():
-            return
+            future.set_result(None)
+            return future
         master_node = MasterNode()
-        clear_value = master_node.private_key.decrypt_asymmetric(self.value)
-        if clear_value is None:
-            return
-        return SymmetricKeyPart(
-            value=deserialize_string(clear_value), author=self.author
-        )
+
+        def _done(decrypted: futures.Future[bytes | None]) -> None:
+            try:
+                clear_value = decrypted.result()
+                if clear_value is None:
+                    future.set_result(None)
+                    return
+                future.set_result(
+                    SymmetricKeyPart(
+                        value=deserialize_string(decode_bytes(clear_value)),
+                        author=self.author,
+                    )
+                )
+            except BaseException as e:
+                future.set_exception(e)
+
+        with CryptoService() as crypto:
+            crypto.decrypt(master_node.private_key, self.value).add_done_callback(_done)
+        return future
 
 
 class EncryptedSymmetricKey(pydantic.BaseModel):
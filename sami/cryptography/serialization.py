@@ -1,4 +1,9 @@
+from __future__ import annotations
+
 import base64
+from typing import Any
+
+import pydantic
 
 
 def serialize_bytes(b: bytes) -> str:
@@ -25,9 +30,72 @@ def encode_string(data: str) -> bytes:
     return data.encode("utf-8")
 
 
-def decode_bytes(data: bytes) -> str:
+def decode_bytes(data: bytes | memoryview) -> str:
     """
     Takes a bytes object and return a decoded version of the data.
     Must be reversible with `encode_string()`.
     """
-    return data.decode("utf-8")
+    return str(data, "utf-8")
+
+
+class BinaryModel(pydantic.BaseModel):
+    """
+    Model whose `bytes` fields hold binary values (ciphertexts, tags,
+    signatures, etc.).
+    They are serialized as base64 in JSON, the only text format we write
+    them to. Where they are validated, their base64 form is accepted,
+    as it is what older versions held in memory and sent over the network.
+    """
+
+    class Config:
+        json_encoders = {bytes: serialize_bytes}
+
+    @pydantic.validator("*", pre=True)
+    def _bytes_from_base64(cls, value: Any, field: pydantic.fields.ModelField) -> Any:
+        if field.outer_type_ is bytes and isinstance(value, str):
+            return deserialize_string(value)
+        return value
+
+    def __getstate__(self) -> dict:
+        """
+        Models are always pickled in the form older versions hold them:
+        binary values in base64, and without the fields left to their
+        default value, which they don't have (e.g. the nonce of an
+        `EncryptedMessage`). Pickles are what we send to other clients,
+        whatever our hashing scheme, and what the legacy scheme hashes,
+        so that identifiers match theirs.
+        Identifiers can still differ if the pickles of other objects do,
+        e.g. a node which is both the author and a member of a request is
+        pickled once, as we share its instance.
+        """
+        state = super().__getstate__()
+        values = {}
+        for name, value in state["__dict__"].items():
+            field = self.__fields__.get(name)
+            if field is None:
+                values[name] = value
+            elif not field.required and value == field.get_default():
+                continue
+            elif field.outer_type_ is bytes and isinstance(value, bytes):
+                values[name] = serialize_bytes(value)
+            else:
+                values[name] = value
+        return {
+            **state,
+            "__dict__": values,
+            "__fields_set__": state["__fields_set__"] & values.keys(),
+        }
+
+    def __setstate__(self, state: dict) -> None:
+        """
+        Pickles of older versions, e.g. from the requests log or from
+        older peers, are not validated: their base64 values are decoded
+        here, and the fields they don't have are set to their default.
+        """
+        super().__setstate__(state)
+        for name, field in self.__fields__.items():
+            if name not in self.__dict__ and not field.required:
+                self.__dict__[name] = field.get_default()
+            value = self.__dict__.get(name)
+            if field.outer_type_ is bytes and isinstance(value, str):
+                self.__dict__[name] = deserialize_string(value)
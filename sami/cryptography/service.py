@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import logging as _logging
+import os
+from concurrent import futures
+from typing import Callable, Iterable, TypeVar
+
+from Crypto.Hash import SHA256
+
+from ..config import settings
+from ..design import Singleton
+from .asymmetric import AnyPrivateKey, AnyPublicKey, SignatureCache, raw_signature
+from .engines import Components, get_engine
+
+logger = _logging.getLogger("cryptography")
+
+_T = TypeVar("_T")
+
+# Operations are module-level functions taking plain values, so that they
+# can be sent to another process. Keys are passed as their components.
+
+
+def _encrypt(engine: str, public: Components, data: bytes) -> bytes:
+    return get_engine(engine).encrypt(public, data)
+
+
+def _decrypt(engine: str, private: Components, en_data: bytes) -> bytes | None:
+    try:
+        return get_engine(engine).decrypt(private, en_data)
+    except ValueError:
+        return
+
+
+def _sign(engine: str, private: Components, digest: bytes) -> bytes:
+    return get_engine(engine).sign(private, digest)
+
+
+def _verify(engine: str, public: Components, digest: bytes, sig: bytes) -> bool:
+    return get_engine(engine).verify(public, digest, sig)
+
+
+class CryptoService(Singleton):
+
+    """
+    Runs the asymmetric cryptography operations on a pool of workers,
+    so that they can be done in parallel, and don't block the thread
+    requesting them.
+
+    Each operation returns a future. The pool is made of threads or of
+    processes, depending on `settings.crypto_executor`.
+
+    Examples
+    --------
+    >>> with CryptoService() as crypto:
+    >>>     signatures = [crypto.sign(private_key, h) for h in hashes]
+    >>>     signatures = [future.result() for future in signatures]
+    """
+
+    _executor: futures.Executor
+
+    def __enter__(self) -> CryptoService:
+        return self
+
+    def __exit__(self, *_) -> None:
+        pass
+
+    def init(self):
+        workers = settings.crypto_workers.get() or os.cpu_count()
+        if settings.crypto_executor.get() == "process":
+            self._executor = futures.ProcessPoolExecutor(max_workers=workers)
+        else:
+            self._executor = futures.ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix="CryptoService",
+            )
+        logger.info(
+            f"Crypto service running on {workers} "
+            f"{settings.crypto_executor.get()} worker(s)"
+        )
+
+    def _submit(self, function: Callable[..., _T], *args) -> futures.Future[_T]:
+        return self._executor.submit(function, *args)
+
+    def encrypt(self, public_key: AnyPublicKey, data: bytes) -> futures.Future[bytes]:
+        """
+        See `PublicKey.encrypt_asymmetric_raw`.
+        """
+        return self._submit(
+            _encrypt, public_key.engine, public_key.public_components, data
+        )
+
+    def decrypt(
+        self, private_key: AnyPrivateKey, en_data: bytes
+    ) -> futures.Future[bytes | None]:
+        """
+        See `PrivateKey.decrypt_asymmetric_raw`.
+        The future's result is None if the data could not be decrypted.
+        """
+        return self._submit(
+            _decrypt, private_key.engine, private_key.private_components, en_data
+        )
+
+    def sign(
+        self, private_key: AnyPrivateKey, hash_obj: SHA256.SHA256Hash
+    ) -> futures.Future[bytes]:
+        """
+        See `PrivateKey.get_signature`, the signature is returned raw.
+        """
+        return self._submit(
+            _sign, private_key.engine, private_key.private_components, hash_obj.digest()
+        )
+
+    def verify(
+        self, public_key: AnyPublicKey, hash_obj: SHA256.SHA256Hash, sig: bytes | str
+    ) -> futures.Future[bool]:
+        """
+        See `PublicKey.is_signature_valid`.
+        Signatures verified already are answered from the `SignatureCache`.
+        """
+        future = futures.Future()
+        try:
+            raw_sig = raw_signature(sig)
+        except (ValueError, TypeError):
+            future.set_result(False)
+            return future
+        key = (public_key.hash.digest(), hash_obj.digest(), raw_sig)
+        with SignatureCache() as cache:
+            valid = cache.get(key)
+        if valid is not None:
+            future.set_result(valid)
+            return future
+
+        def _remember(valid: bool) -> bool:
+            with SignatureCache() as cache:
+                cache.add(key, valid)
+            return valid
+
+        raw = self._submit(
+            _verify,
+            public_key.engine,
+            public_key.public_components,
+            hash_obj.digest(),
+            raw_sig,
+        )
+        _chain(raw, future, _remember)
+        return future
+
+    def sign_many(
+        self, private_key: AnyPrivateKey, hash_objs: Iterable[SHA256.SHA256Hash]
+    ) -> dict[bytes, futures.Future[bytes]]:
+        """
+        Signs a batch of hashes, each distinct one only once.
+        Returns the futures by digest.
+        """
+        signatures = {}
+        for hash_obj in hash_objs:
+            digest = hash_obj.digest()
+            if digest not in signatures:
+                signatures[digest] = self.sign(private_key, hash_obj)
+        return signatures
+
+
+def _chain(source: futures.Future, target: futures.Future, function: Callable) -> None:
+    """
+    Sets the result of `target` to `function` applied to the result
+    of `source`, once it is done.
+    """
+
+    def _done(_) -> None:
+        try:
+            target.set_result(function(source.result()))
+        except BaseException as e:
+            target.set_exception(e)
+
+    source.add_done_callback(_done)
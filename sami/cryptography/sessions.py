@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import hashlib
+import hmac
+import logging as _logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from threading import Lock
+
+from Crypto.Hash import SHA256
+from Crypto.Protocol.KDF import HKDF
+from Crypto.Random import get_random_bytes
+
+from ..config import Identifier, settings
+from ..design import Singleton
+from .symmetric import get_aead_engine
+
+logger = _logging.getLogger("cryptography")
+
+_SESSION_KEY_LENGTH = 32
+_IDENTIFIER_LENGTH = 16
+_TAG_LENGTH = 16
+# Engine the key parts are encrypted with
+_AEAD = "aes-gcm"
+
+
+@dataclass
+class SessionKey:
+
+    """
+    Symmetric key shared by two nodes, which one of them (the author)
+    uses for the keys exchanges with the other (the peer).
+    The encryption and authentication keys are derived from `value`.
+    """
+
+    value: bytes
+    peer: Identifier
+    created: float = field(default_factory=time.monotonic)
+    uses: int = 0
+    # Whether the peer told us it has the key, outgoing keys only
+    confirmed: bool = False
+
+    def __post_init__(self):
+        derived = HKDF(
+            self.value,
+            _SESSION_KEY_LENGTH * 2 + _IDENTIFIER_LENGTH,
+            salt=b"",
+            hashmod=SHA256,
+            context=b"sami-session",
+        )
+        self._encryption_key = derived[:_SESSION_KEY_LENGTH]
+        self._mac_key = derived[_SESSION_KEY_LENGTH : _SESSION_KEY_LENGTH * 2]
+        # Sent along with the data, it doesn't reveal the key
+        self.identifier = derived[_SESSION_KEY_LENGTH * 2 :]
+
+    @classmethod
+    def new(cls, peer: Identifier) -> SessionKey:
+        return cls(value=get_random_bytes(_SESSION_KEY_LENGTH), peer=peer)
+
+    def get_age(self) -> float:
+        return time.monotonic() - self.created
+
+    def is_expired(self) -> bool:
+        return (
+            self.get_age() > settings.session_keys_lifetime.get()
+            or self.uses >= settings.session_keys_max_uses.get()
+        )
+
+    def encrypt(self, data: bytes) -> bytes:
+        """
+        Returns the nonce, the encrypted data and the tag, concatenated.
+        """
+        engine = get_aead_engine(_AEAD)
+        nonce = get_random_bytes(engine.nonce_length)
+        en_data, tag = engine.encrypt(self._encryption_key, nonce, data)
+        return nonce + en_data + tag
+
+    def decrypt(self, en_data: bytes) -> bytes:
+        """
+        Must be reversible with `encrypt`.
+        Raises `ValueError` if we cannot decrypt.
+        """
+        engine = get_aead_engine(_AEAD)
+        nonce_length = engine.nonce_length
+        if len(en_data) < nonce_length + _TAG_LENGTH:
+            raise ValueError("Ciphertext too short")
+        return engine.decrypt(
+            self._encryption_key,
+            en_data[:nonce_length],
+            en_data[nonce_length:-_TAG_LENGTH],
+            en_data[-_TAG_LENGTH:],
+        )
+
+    def get_mac(self, data: bytes) -> bytes:
+        return hmac.new(self._mac_key, data, hashlib.sha256).digest()
+
+    def is_mac_valid(self, data: bytes, mac: bytes) -> bool:
+        return hmac.compare_digest(self.get_mac(data), mac)
+
+
+class SessionKeys(Singleton):
+
+    """
+    Pairwise session keys, so that only the first keys exchange (KEP)
+    between two nodes uses asymmetric cryptography.
+
+    Each node creates a key for each of its peers (outgoing), and sends it
+    encrypted with the peer's public key in a KEP. The peer keeps it
+    (incoming), and acknowledges it in the KEPs it sends back. Once
+    acknowledged, our key parts are encrypted and authenticated (HMAC) with
+    it instead of the peer's public key and our private key, until the
+    peer's KEPs stop acknowledging it.
+
+    Outgoing keys are rotated, i.e. a new one is exchanged, once they are
+    older than `settings.session_keys_lifetime` seconds or were used
+    `settings.session_keys_max_uses` times. Incoming keys are accepted
+    twice as long, so that the key parts sent during a rotation can still
+    be read. At most `settings.session_keys_cache_size` keys of each kind
+    are kept, the least recently used ones being dropped.
+    They are never written anywhere.
+    """
+
+    _outgoing: OrderedDict[Identifier, SessionKey]
+    _incoming: OrderedDict[bytes, SessionKey]
+    # Identifier of the latest incoming key of each peer
+    _latest_incoming: dict[Identifier, bytes]
+    _lock: Lock
+
+    def __enter__(self) -> SessionKeys:
+        return self
+
+    def __exit__(self, *_) -> None:
+        pass
+
+    def init(self):
+        self._outgoing = OrderedDict()
+        self._incoming = OrderedDict()
+        self._latest_incoming = {}
+        self._lock = Lock()
+
+    def _trim(self) -> None:
+        """
+        Must be called with the lock held.
+        """
+        while len(self._outgoing) > settings.session_keys_cache_size.get():
+            self._outgoing.popitem(last=False)
+        while len(self._incoming) > settings.session_keys_cache_size.get():
+            _, dropped = self._incoming.popitem(last=False)
+            if self._latest_incoming.get(dropped.peer) == dropped.identifier:
+                del self._latest_incoming[dropped.peer]
+
+    def get_outgoing(self, peer: Identifier) -> SessionKey | None:
+        """
+        Returns the key to use with `peer`, if it acknowledged it and it
+        must not be rotated. Counts as a use.
+        """
+        with self._lock:
+            key = self._outgoing.get(peer)
+            if key is None or not key.confirmed or key.is_expired():
+                return
+            self._outgoing.move_to_end(peer)
+            key.uses += 1
+            return key
+
+    def get_pending(self, peer: Identifier) -> SessionKey:
+        """
+        Returns the key to send to `peer`: the one we sent already if it is
+        not acknowledged yet and still valid, a new one otherwise.
+        """
+        with self._lock:
+            key = self._outgoing.get(peer)
+            if key is None or key.confirmed or key.is_expired():
+                if key is not None:
+                    logger.debug(f"Rotating the session key of {peer}")
+                key = self._outgoing[peer] = SessionKey.new(peer)
+                self._trim()
+            self._outgoing.move_to_end(peer)
+            return key
+
+    def acknowledge(self, peer: Identifier, identifier: bytes) -> None:
+        """
+        Called with the acknowledgement of an authenticated KEP of `peer`:
+        the identifier of the latest key of ours it has, empty if none.
+        Our key is confirmed if it is this one. Otherwise, it is not
+        anymore, e.g. because the peer restarted and lost it, so that we
+        go back to the asymmetric handshake and send it again.
+        """
+        with self._lock:
+            key = self._outgoing.get(peer)
+            if key is not None:
+                key.confirmed = key.identifier == identifier
+
+    def add_incoming(self, peer: Identifier, value: bytes) -> None:
+        """
+        Keeps a key `peer` sent us.
+        """
+        key = SessionKey(value=value, peer=peer)
+        with self._lock:
+            self._incoming[key.identifier] = key
+            self._latest_incoming[peer] = key.identifier
+            self._trim()
+
+    def get_incoming(self, identifier: bytes, peer: Identifier) -> SessionKey | None:
+        with self._lock:
+            key = self._incoming.get(identifier)
+            if (
+                key is None
+                or key.peer != peer
+                or key.get_age() > 2 * settings.session_keys_lifetime.get()
+            ):
+                return
+            self._incoming.move_to_end(identifier)
+            return key
+
+    def get_acknowledgement(self, peer: Identifier) -> bytes:
+        """
+        Returns the identifier of the latest key `peer` sent us,
+        empty if we have none.
+        """
+        with self._lock:
+            return self._latest_incoming.get(peer, b"")
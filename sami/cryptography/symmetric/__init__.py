@@ -1,10 +1,15 @@
-from ._key import DecryptionKey, EncryptionKey, SymmetricKey
+from ._aead import AEAD_ENGINES, AEADEngine, get_aead_engine
+from ._key import BatchResult, DecryptionKey, EncryptionKey, SymmetricKey
 from ._key_part import SymmetricKeyPart, get_expected_key_length
 
 __all__ = [
+    AEAD_ENGINES,
+    AEADEngine,
+    BatchResult,
     DecryptionKey,
     EncryptionKey,
     SymmetricKey,
     SymmetricKeyPart,
+    get_aead_engine,
     get_expected_key_length,
 ]
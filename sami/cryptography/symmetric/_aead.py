@@ -0,0 +1,120 @@
+"""
+Authenticated encryption of the messages.
+
+Engines encrypt each message with a new cipher, under the key of the
+conversation and a nonce. Except for the legacy EAX engine, the nonce is
+drawn at random for each message, and sent along with it.
+"""
+
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+
+from Crypto.Cipher import AES, ChaCha20_Poly1305
+
+
+class AEADEngine(ABC):
+
+    """
+    Authenticated encryption with associated data.
+    Decryption of tampered data, or with the wrong key or nonce,
+    raises `ValueError`.
+    """
+
+    name: str
+    nonce_length: int
+    # Whether messages are encrypted under the nonce of the key
+    # (see `SymmetricKey.derive_nonce_from_key`), rather than their own
+    key_nonce: bool = False
+
+    @abstractmethod
+    def _new(self, key: bytes, nonce: bytes):
+        """
+        Returns a new cipher, which must only be used for one message.
+        """
+        pass
+
+    def encrypt(self, key: bytes, nonce: bytes, data: bytes) -> tuple[bytes, bytes]:
+        """
+        Returns the encrypted data and its tag.
+        """
+        return self._new(key, nonce).encrypt_and_digest(data)
+
+    def decrypt(self, key: bytes, nonce: bytes, en_data: bytes, tag: bytes) -> bytes:
+        return self._new(key, nonce).decrypt_and_verify(en_data, tag)
+
+    def decrypt_into(
+        self,
+        key: bytes,
+        nonce: bytes,
+        en_data: bytes,
+        tag: bytes,
+        output: memoryview,
+    ) -> None:
+        """
+        Same as `decrypt`, but writes the data to `output`, which must be as
+        long as `en_data`. Its content must be ignored if it raises.
+        """
+        cipher = self._new(key, nonce)
+        cipher.decrypt(en_data, output=output)
+        cipher.verify(tag)
+
+
+class EAXEngine(AEADEngine):
+
+    """
+    AES-EAX, which messages used to be encrypted with.
+    All the messages of a conversation share the nonce of its key,
+    so it is only kept to read the messages of older clients.
+    """
+
+    name = "eax"
+    nonce_length = 16
+    key_nonce = True
+
+    def _new(self, key: bytes, nonce: bytes):
+        return AES.new(key=key, nonce=nonce, mode=AES.MODE_EAX)
+
+
+class GCMEngine(AEADEngine):
+
+    """
+    AES-GCM, fastest on processors with AES instructions.
+    """
+
+    name = "aes-gcm"
+    nonce_length = 12
+
+    def _new(self, key: bytes, nonce: bytes):
+        return AES.new(key=key, nonce=nonce, mode=AES.MODE_GCM)
+
+
+class ChaCha20Poly1305Engine(AEADEngine):
+
+    """
+    ChaCha20-Poly1305, fastest on processors without AES instructions
+    (e.g. most ARM ones). Requires 32-byte keys.
+    """
+
+    name = "chacha20-poly1305"
+    nonce_length = 12
+
+    def _new(self, key: bytes, nonce: bytes):
+        return ChaCha20_Poly1305.new(key=key, nonce=nonce)
+
+
+AEAD_ENGINES: dict[str, AEADEngine] = {
+    engine.name: engine
+    for engine in (EAXEngine(), GCMEngine(), ChaCha20Poly1305Engine())
+}
+
+
+def get_aead_engine(name: str) -> AEADEngine:
+    """
+    Raises `ValueError` if there is no engine `name`, e.g. because
+    a message was encrypted by a newer client.
+    """
+    try:
+        return AEAD_ENGINES[name]
+    except KeyError:
+        raise ValueError(f"Unknown AEAD engine {name!r}") from None
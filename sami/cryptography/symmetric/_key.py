@@ -1,24 +1,66 @@
 from __future__ import annotations
 
 import logging as _logging
+from concurrent import futures
 from functools import cached_property
+from typing import Any, Callable, NamedTuple, Sequence, TypeVar
 
 import pydantic
-from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
 
 from ...config import Identifier, settings
 from ...utils import get_id
 from ..hashing import hash_object
-from ..serialization import (
-    decode_bytes,
-    deserialize_string,
-    encode_string,
-    serialize_bytes,
-)
+from ..serialization import decode_bytes, encode_string
+from ._aead import AEAD_ENGINES, get_aead_engine
 from ._key_part import SymmetricKeyPart
 
 logger = _logging.getLogger("cryptography")
 
+_T = TypeVar("_T")
+
+# Number of items processed by `encrypt_many` and `decrypt_many` at once.
+# Chunks are the unit of work sent to the executor.
+_CHUNK_SIZE = 256
+
+
+class BatchResult(NamedTuple):
+    """
+    Result of the operation on one item of a batch:
+    its value, or the error it raised.
+    """
+
+    value: Any = None
+    error: Exception | None = None
+
+
+def _run_in_chunks(
+    function: Callable[[Sequence[_T]], list[BatchResult]],
+    items: Sequence[_T],
+    chunk_size: int,
+    executor: futures.Executor | None,
+) -> list[BatchResult]:
+    """
+    Applies `function` to `items` by chunks, on `executor` if passed.
+    Results are returned in the order of the items.
+    """
+    chunks = [items[i : i + chunk_size] for i in range(0, len(items), chunk_size)]
+    if executor is None or len(chunks) < 2:
+        results = map(function, chunks)
+    else:
+        results = executor.map(function, chunks)
+    return [result for chunk_results in results for result in chunk_results]
+
+
+def _get_buffer(buffer: bytearray, length: int) -> tuple[bytearray, memoryview]:
+    """
+    Returns a buffer of at least `length` bytes, `buffer` if it is large
+    enough, and a view of its first `length` bytes.
+    """
+    if len(buffer) < length:
+        buffer = bytearray(max(length, 2 * len(buffer)))
+    return buffer, memoryview(buffer)[:length]
+
 
 class SymmetricKey(pydantic.BaseModel):
     value: bytes
@@ -58,14 +100,6 @@ class SymmetricKey(pydantic.BaseModel):
             nonce=cls.derive_nonce_from_key(value),
         )
 
-    @cached_property
-    def _aes(self):
-        return AES.new(
-            key=self.value,
-            nonce=self.nonce,
-            mode=settings.aes_mode,
-        )
-
     @cached_property
     def id(self) -> Identifier:
         return get_id(hash_object([self.value, self.nonce]))
@@ -73,32 +107,77 @@ class SymmetricKey(pydantic.BaseModel):
 
 class EncryptionKey(SymmetricKey):
     """
-    Stateful encrypting value.
+    Encrypts messages with the AEAD engine `aead`.
     """
 
+    aead: str
+
+    @pydantic.validator("aead")
+    def _check_aead(cls, aead: str) -> str:
+        assert aead in AEAD_ENGINES, f"Unknown AEAD engine {aead!r}"
+        return aead
+
     @classmethod
-    def from_key(cls, key: SymmetricKey) -> EncryptionKey:
+    def from_key(cls, key: SymmetricKey, aead: str | None = None) -> EncryptionKey:
+        """
+        By default, messages are encrypted with `settings.aead_engine`.
+        """
         return cls(
             value=key.value,
             nonce=key.nonce,
+            aead=aead or settings.aead_engine.get(),
         )
 
-    def encrypt_raw(self, data: str) -> tuple[str, str]:
+    def encrypt_raw(self, data: str) -> tuple[bytes, bytes, bytes]:
         """
-        Encrypts and serializes data.
-        Returns a tuple with (1) the serialized and encrypted data and
-        (2) the tag.
+        Encrypts data.
+        Returns a tuple with (1) the encrypted data, (2) the tag and
+        (3) the nonce, which is empty if the engine uses the nonce of the key.
         Must be reversible with decrypt_raw().
         """
-        en_data, tag = self._aes.encrypt_and_digest(encode_string(data))
-        se_en_data = serialize_bytes(en_data)
-        se_tag = serialize_bytes(tag)
-        return se_en_data, se_tag
+        engine = get_aead_engine(self.aead)
+        nonce = b"" if engine.key_nonce else get_random_bytes(engine.nonce_length)
+        en_data, tag = engine.encrypt(
+            self.value, nonce or self.nonce, encode_string(data)
+        )
+        return en_data, tag, nonce
+
+    def encrypt_many(
+        self,
+        data: Sequence[str],
+        chunk_size: int = _CHUNK_SIZE,
+        executor: futures.Executor | None = None,
+    ) -> list[BatchResult]:
+        """
+        Encrypts a list of data, by chunks of `chunk_size` items, which are
+        processed in parallel if a thread pool `executor` is passed.
+        Returns, in order, a result per item, whose value is what
+        `encrypt_raw()` returns.
+        """
+        return _run_in_chunks(self._encrypt_chunk, data, chunk_size, executor)
+
+    def _encrypt_chunk(self, chunk: Sequence[str]) -> list[BatchResult]:
+        engine = get_aead_engine(self.aead)
+        length = 0 if engine.key_nonce else engine.nonce_length
+        nonces = get_random_bytes(length * len(chunk))
+        # Unlike decryption, there is no shared output buffer: messages hold
+        # their ciphertext as bytes, which would copy it out of the buffer
+        results = []
+        for i, data in enumerate(chunk):
+            try:
+                nonce = nonces[i * length : (i + 1) * length]
+                en_data, tag = engine.encrypt(
+                    self.value, nonce or self.nonce, encode_string(data)
+                )
+                results.append(BatchResult((en_data, tag, nonce)))
+            except Exception as e:
+                results.append(BatchResult(error=e))
+        return results
 
 
 class DecryptionKey(SymmetricKey):
     """
-    Stateful decrypting value.
+    Decrypts messages, with the AEAD engine each was encrypted with.
     """
 
     @classmethod
@@ -108,13 +187,49 @@ class DecryptionKey(SymmetricKey):
             nonce=key.nonce,
         )
 
-    def decrypt_raw(self, se_en_data: str, se_tag: str) -> str:
+    def decrypt_raw(
+        self, en_data: bytes, tag: bytes, nonce: bytes = b"", aead: str = "eax"
+    ) -> str:
         """
-        Deserializes and decrypts data.
+        Decrypts data.
         Must be reversible with encrypt_raw().
-        Returns None if we cannot decrypt.
+        Raises `ValueError` if we cannot decrypt.
         """
-        en_data = deserialize_string(se_en_data)
-        tag = deserialize_string(se_tag)
-        data = self._aes.decrypt_and_verify(en_data, tag)
+        engine = get_aead_engine(aead)
+        if engine.key_nonce:
+            nonce = self.nonce
+        data = engine.decrypt(self.value, nonce, en_data, tag)
         return decode_bytes(data)
+
+    def decrypt_many(
+        self,
+        items: Sequence[tuple[bytes, bytes, bytes, str]],
+        chunk_size: int = _CHUNK_SIZE,
+        executor: futures.Executor | None = None,
+    ) -> list[BatchResult]:
+        """
+        Decrypts a list of items, each being the arguments of
+        `decrypt_raw()`, by chunks of `chunk_size` items, which are processed
+        in parallel if a thread pool `executor` is passed.
+        Returns, in order, a result per item, whose value is the data.
+        """
+        return _run_in_chunks(self._decrypt_chunk, items, chunk_size, executor)
+
+    def _decrypt_chunk(
+        self, chunk: Sequence[tuple[bytes, bytes, bytes, str]]
+    ) -> list[BatchResult]:
+        # The data is decrypted to a buffer shared by the chunk,
+        # and only copied once, when decoded
+        buffer = bytearray()
+        results = []
+        for en_data, tag, nonce, aead in chunk:
+            try:
+                engine = get_aead_engine(aead)
+                if engine.key_nonce:
+                    nonce = self.nonce
+                buffer, output = _get_buffer(buffer, len(en_data))
+                engine.decrypt_into(self.value, nonce, en_data, tag, output)
+                results.append(BatchResult(decode_bytes(output)))
+            except Exception as e:
+                results.append(BatchResult(error=e))
+        return results
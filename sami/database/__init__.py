@@ -1,5 +1,13 @@
 from ._db import Database
+from ._messages import MessageRecord, MessagesStore
+from ._query import Query, QueryPlan
+from ._requests import RequestsLog
 
 __all__ = [
     Database,
+    MessageRecord,
+    MessagesStore,
+    Query,
+    QueryPlan,
+    RequestsLog,
 ]
@@ -1,14 +1,17 @@
 from __future__ import annotations
 
-from typing import Callable, TypeVar
+from itertools import chain
+from threading import Lock
+from typing import Any, Callable, Generator, Iterable, TypeVar
 
 from tinydb import TinyDB
-from tinydb.table import Document
+from tinydb.table import Document, Table
 
 from ..config import Identifier
-from ..design import Singleton
+from ..design import ReadWriteLock, Singleton
 from ..objects.nodes import MasterNode
 from ..utils import SupportsComparison
+from ._query import ID_FIELD, Index, Query, QueryPlan, combine
 
 _T = TypeVar("_T")
 
@@ -20,48 +23,300 @@ def _get_table_name(obj) -> str:
         return obj.__table_name__
 
 
+def _matches(document: Document, filters: dict[str, Any]) -> bool:
+    return all(document.get(field) == value for field, value in filters.items())
+
+
 class Database(Singleton):
 
     """
     Simple, generic interface to access a TinyDB file.
     Database logic is implemented in the Sami objects.
+
+    TinyDB is not thread-safe, so accesses go through a readers-writer lock:
+    any number of threads can read at the same time, while writes are
+    exclusive.
     """
 
     _db: TinyDB
+    _lock: ReadWriteLock
+    _tables_lock: Lock
+    # Maps table names to their indexes, which are built on first use
+    _indexes: dict[str, dict[str, Index]]
+    _indexes_lock: Lock
+    _tracer: Callable[[QueryPlan], None] | None
 
     def __enter__(self) -> Database:
         return self
 
-    def __exit__(self) -> None:
+    def __exit__(self, *_) -> None:
         pass
 
     def init(self):
         self._db = TinyDB()  # FIXME
+        self._lock = ReadWriteLock()
+        self._tables_lock = Lock()
+        self._indexes = {}
+        self._indexes_lock = Lock()
+        self._tracer = None
+
+    def _table(self, obj: _T) -> Table:
+        # Creating a table instance is not thread-safe in TinyDB.
+        # We also disable the query cache, which is modified on reads.
+        with self._tables_lock:
+            return self._db.table(_get_table_name(obj), cache_size=0)
 
     def get_by_id(self, obj: _T, identifier: Identifier) -> Document:
-        return self._db.table(_get_table_name(obj)).get(doc_id=identifier)
+        table = self._table(obj)
+        with self._lock.read():
+            return table.get(doc_id=identifier)
 
     def get_all(self, obj: _T) -> list[Document]:
-        return self._db.table(_get_table_name(obj)).all()
+        table = self._table(obj)
+        with self._lock.read():
+            return table.all()
+
+    def iter_batches(
+        self,
+        obj: _T,
+        batch_size: int,
+        filters: dict[str, Any] | None = None,
+    ) -> Generator[list[Document], None, None]:
+        """
+        Iterates over the documents of a table, yielding them by batches of
+        (at most) `batch_size` documents.
+        If `filters` is passed, only documents whose fields are equal to the
+        values specified are yielded.
+
+        The iteration works on a snapshot of the table, taken when the
+        first batch is requested, so the lock is not held between batches.
+        """
+        table = self._table(obj)
+        documents = iter(table)
+        with self._lock.read():
+            # Getting the first document makes TinyDB read the table
+            first = next(documents, None)
+        if first is None:
+            return
+        batch = []
+        for document in chain([first], documents):
+            if filters and not _matches(document, filters):
+                continue
+            batch.append(document)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
 
     def is_known(self, obj: _T) -> bool:
-        return self._db.table(_get_table_name(obj)).contains(doc_id=obj.id)
+        table = self._table(obj)
+        with self._lock.read():
+            return table.contains(doc_id=obj.id)
+
+    def count(self, obj: _T) -> int:
+        table = self._table(obj)
+        with self._lock.read():
+            return len(table)
 
     def get_last(
         self, obj: _T, key: Callable[[_T], SupportsComparison]
     ) -> Document | None:
-        results = sorted(self._db.table(_get_table_name(obj)).all(), key=key)
-        if results:
-            return results[0]
+        table = self._table(obj)
+        with self._lock.read():
+            return max(table, key=key, default=None)
 
     def upsert(self, obj: _T) -> None:
         """
         Takes any object from Sami and inserts/updates the information
         in the database.
         """
-        table = self._db.table(_get_table_name(obj))
-        table.upsert(Document(obj.dict(), doc_id=obj.id))
+        table = self._table(obj)
+        document = Document(obj.to_document(), doc_id=obj.id)
+        with self._lock.write():
+            table.upsert(document)
+            for index in self._indexes.get(table.name, {}).values():
+                index.add(document.doc_id, document)
 
-    def remove(self, identifier: int) -> None:
-        # FIXME: table-wise
-        self._db.remove(doc_ids=[identifier])
+    def insert_many(self, obj: _T, documents: Iterable[Document]) -> int:
+        """
+        Inserts documents in bulk, in a single write.
+        Documents whose identifier is already known are skipped.
+        Returns the number of documents inserted.
+        """
+        table = self._table(obj)
+        with self._lock.write():
+            known = {document.doc_id for document in table}
+            new = [document for document in documents if document.doc_id not in known]
+            table.insert_multiple(new)
+            # Rather than updating the indexes for each document,
+            # we drop them, and they will be rebuilt on their next use.
+            self._indexes.pop(table.name, None)
+        return len(new)
+
+    def move_table(self, name: str, obj: _T) -> int:
+        """
+        Moves the documents of the table `name` to the table of `obj`,
+        e.g. when the name of a node-specific table changes.
+        Documents whose identifier is already known are dropped.
+        Returns the number of documents moved.
+        """
+        table = self._table(obj)
+        with self._lock.write():
+            if name == table.name or name not in self._db.tables():
+                return 0
+            with self._tables_lock:
+                old_table = self._db.table(name, cache_size=0)
+            known = {document.doc_id for document in table}
+            new = [document for document in old_table if document.doc_id not in known]
+            table.insert_multiple(new)
+            self._db.drop_table(name)
+            self._indexes.pop(name, None)
+            self._indexes.pop(table.name, None)
+        return len(new)
+
+    def remove(self, obj: _T, identifier: Identifier) -> None:
+        self.remove_many(obj, [identifier])
+
+    def remove_many(self, obj: _T, identifiers: Iterable[Identifier]) -> None:
+        table = self._table(obj)
+        identifiers = list(identifiers)
+        with self._lock.write():
+            table.remove(doc_ids=identifiers)
+            for index in self._indexes.get(table.name, {}).values():
+                for identifier in identifiers:
+                    index.discard(identifier)
+
+    def _get_indexes(self, obj: _T, table: Table) -> dict[str, Index]:
+        """
+        Returns the indexes declared by the object type (`__indexes__`),
+        building them if needed. Must be called with the lock held.
+        """
+        definitions = getattr(obj, "__indexes__", {})
+        if not definitions:
+            return {}
+        with self._indexes_lock:
+            if table.name not in self._indexes:
+                indexes = {name: Index(key) for name, key in definitions.items()}
+                for document in table:
+                    for index in indexes.values():
+                        index.add(document.doc_id, document)
+                self._indexes[table.name] = indexes
+            return self._indexes[table.name]
+
+    def _plan(self, query: Query, table: Table) -> tuple[QueryPlan, set[int] | None]:
+        plan = QueryPlan(table=table.name)
+        indexes = self._get_indexes(query.obj, table)
+        candidates = None
+        for condition in query.conditions:
+            if condition.field == ID_FIELD and condition.operator in ("eq", "isin"):
+                doc_ids = (
+                    {condition.value}
+                    if condition.operator == "eq"
+                    else set(condition.value)
+                )
+                plan.indexes.append(f"{ID_FIELD}: {condition}")
+            elif condition.field in indexes and (
+                (doc_ids := indexes[condition.field].lookup(condition)) is not None
+            ):
+                plan.indexes.append(f"{condition.field}: {condition}")
+            else:
+                if condition.field in indexes or condition.field == ID_FIELD:
+                    plan.computed.append(str(condition))
+                else:
+                    plan.native.append(str(condition))
+                continue
+            candidates = doc_ids if candidates is None else candidates & doc_ids
+        if candidates is not None:
+            plan.candidates = len(candidates)
+        return plan, candidates
+
+    def set_tracer(self, tracer: Callable[[QueryPlan], None] | None) -> None:
+        """
+        Registers a callable which receives the plan of each query executed.
+        Pass None to remove it.
+        """
+        self._tracer = tracer
+
+    def explain(self, query: Query) -> QueryPlan:
+        """
+        Returns how the query would be executed, without executing it.
+        """
+        table = self._table(query.obj)
+        with self._lock.read():
+            plan, _ = self._plan(query, table)
+        return plan
+
+    def find(self, query: Query) -> list[Document]:
+        """
+        Executes a query, and returns the matching documents.
+        Conditions on indexed fields and on the identifier are resolved with
+        the indexes, the others are evaluated by TinyDB.
+        """
+        table = self._table(query.obj)
+        with self._lock.read():
+            plan, candidates = self._plan(query, table)
+            indexes = self._get_indexes(query.obj, table)
+            native = combine(
+                [
+                    condition
+                    for condition in query.conditions
+                    if condition.field not in indexes and condition.field != ID_FIELD
+                ]
+            )
+            if candidates is None:
+                # Note: we don't use `table.search`, which writes to the
+                # query cache, and therefore isn't safe for concurrent reads.
+                documents = [
+                    document for document in table if native is None or native(document)
+                ]
+            else:
+                documents = [
+                    document
+                    for document in table.get(doc_ids=list(candidates))
+                    if native is None or native(document)
+                ]
+
+        def accepts(document: Document) -> bool:
+            for condition in query.conditions:
+                if condition.field == ID_FIELD:
+                    values = (document.doc_id,)
+                elif condition.field in indexes:
+                    values = indexes[condition.field].values(document)
+                else:
+                    continue
+                if not condition.accepts(values):
+                    return False
+            return True
+
+        documents = [document for document in documents if accepts(document)]
+
+        if query.order is not None:
+            field_name, reverse = query.order
+            # Documents without the field, e.g. written by an older version,
+            # come first
+            documents.sort(
+                key=lambda document: (
+                    document.doc_id
+                    if field_name == ID_FIELD
+                    else (field_name in document, document.get(field_name))
+                ),
+                reverse=reverse,
+            )
+        if query.max_results is not None:
+            documents = documents[: query.max_results]
+
+        if self._tracer is not None:
+            self._tracer(plan)
+        return documents
+
+    def find_ids(self, query: Query) -> set[Identifier]:
+        return {Identifier(document.doc_id) for document in self.find(query)}
+
+    def count_by(self, obj: _T, index_name: str) -> dict[Any, int]:
+        """
+        Returns the number of documents for each value of an index.
+        """
+        table = self._table(obj)
+        with self._lock.read():
+            return self._get_indexes(obj, table)[index_name].counts()
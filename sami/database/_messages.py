@@ -0,0 +1,533 @@
+from __future__ import annotations
+
+import json
+import os
+import struct
+import zlib
+from bisect import bisect_left
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from threading import Lock
+from typing import Generator, NamedTuple
+
+from loguru import logger
+
+from ..config import Identifier, settings
+from ..design import Singleton
+from ..objects.nodes import MasterNode
+
+# Size of the chunks read when going through a log backwards, in bytes
+_TAIL_CHUNK_SIZE = 4096
+_HOT_SUFFIX = ".log"
+_COLD_SUFFIX = ".cold"
+_INDEX_SUFFIX = ".idx"
+_MANIFEST_SUFFIX = ".manifest"
+# The index of a log holds the offset of each of its lines
+_OFFSET = struct.Struct(">Q")
+
+
+def _write_file(path: Path, data: bytes) -> None:
+    """
+    Writes a file aside then renames it, so that it is never left partial.
+    """
+    temp_path = path.with_suffix(".tmp")
+    temp_path.write_bytes(data)
+    os.replace(temp_path, path)
+
+
+class MessageRecord(NamedTuple):
+    """
+    A message, as written in a conversation log.
+    The payload is the serialized message, which we don't interpret here.
+    """
+
+    time: int
+    identifier: Identifier
+    payload: str
+
+    def to_line(self) -> bytes:
+        return f"{self.time}\t{self.identifier:x}\t{self.payload}\n".encode("utf-8")
+
+    @classmethod
+    def from_line(cls, line: bytes) -> MessageRecord:
+        time, identifier, payload = line.decode("utf-8").rstrip("\n").split("\t", 2)
+        return cls(
+            time=int(time),
+            identifier=Identifier(identifier, 16),
+            payload=payload,
+        )
+
+
+class _ColdSegment(NamedTuple):
+    """
+    A compressed chunk of the oldest messages of a conversation.
+    Its metadata is part of its file name, so that we can count its messages
+    without decompressing it.
+    """
+
+    path: Path
+    number: int
+    count: int
+    first_time: int
+    last_time: int
+
+    @classmethod
+    def from_path(cls, path: Path) -> _ColdSegment:
+        # "<conversation>.<number>.<count>.<first time>.<last time>.cold"
+        _, number, count, first_time, last_time = path.stem.split(".")
+        return cls(
+            path=path,
+            number=int(number),
+            count=int(count),
+            first_time=int(first_time),
+            last_time=int(last_time),
+        )
+
+    @staticmethod
+    def get_name(
+        conversation_id: Identifier, number: int, records: list[MessageRecord]
+    ) -> str:
+        return (
+            f"{conversation_id:x}.{number:06d}.{len(records)}."
+            f"{records[0].time}.{records[-1].time}{_COLD_SUFFIX}"
+        )
+
+
+@lru_cache(maxsize=8)
+def _read_cold_segment(path: Path) -> tuple[MessageRecord, ...]:
+    """
+    Decompresses a cold segment.
+    The last segments read are kept in memory, as the user scrolling back
+    in a conversation is likely to read them again.
+    """
+    lines = zlib.decompress(path.read_bytes()).splitlines(keepends=True)
+    return tuple(MessageRecord.from_line(line) for line in lines)
+
+
+class _Files(NamedTuple):
+    """
+    The files holding the messages of a conversation.
+    """
+
+    log: Path
+    cold_segments: tuple[_ColdSegment, ...]
+
+    @property
+    def index(self) -> Path:
+        return self.log.with_suffix(_INDEX_SUFFIX)
+
+
+class MessagesStore(Singleton):
+
+    """
+    Append-only storage for the messages of the conversations.
+
+    Each conversation has its own log file, in which messages are appended
+    one per line, in the order we received them.
+    Adding a message therefore never rewrites the conversation's history.
+
+    The oldest messages are moved by `archive` from this "hot" log to
+    compressed "cold" segments, which are only decompressed when read.
+    Once a conversation was archived, its manifest lists its log and cold
+    segments, so that replacing it switches to the new files at once.
+    Conversations without a manifest have their log under their identifier.
+
+    Next to each log, an index holds the offset of each message, so that
+    we can read any window of the conversation (see `read`) without going
+    through the rest of it.
+    """
+
+    _directory: Path
+    _locks: dict[Identifier, Lock]
+    # Guards the creation of the conversations' locks
+    _locks_lock: Lock
+    # Conversations whose index is known to be complete
+    _synced: set[Identifier]
+    # Files of the conversations, read from their manifest on first use
+    _files: dict[Identifier, _Files]
+
+    def __enter__(self) -> MessagesStore:
+        return self
+
+    def __exit__(self, *_) -> None:
+        pass
+
+    def init(self):
+        self._directory = (
+            settings.databases_directory.get() / f"messages_{MasterNode().id}"
+        )
+        self._directory.mkdir(parents=True, exist_ok=True)
+        # Accesses are serialized per conversation. Only the iteration over
+        # a conversation is not, it goes through the files it started with.
+        self._locks = {}
+        self._locks_lock = Lock()
+        self._synced = set()
+        self._files = {}
+
+    def _get_lock(self, conversation_id: Identifier) -> Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(conversation_id, Lock())
+
+    def _get_manifest_path(self, conversation_id: Identifier) -> Path:
+        return self._directory / f"{conversation_id:x}{_MANIFEST_SUFFIX}"
+
+    def _get_files(self, conversation_id: Identifier) -> _Files:
+        """
+        Must be called with the conversation's lock held.
+        """
+        if (files := self._files.get(conversation_id)) is not None:
+            return files
+        manifest_path = self._get_manifest_path(conversation_id)
+        if manifest_path.is_file():
+            manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+            files = _Files(
+                log=self._directory / manifest["log"],
+                cold_segments=tuple(
+                    _ColdSegment.from_path(self._directory / name)
+                    for name in manifest["cold_segments"]
+                ),
+            )
+        else:
+            files = _Files(
+                log=self._directory / f"{conversation_id:x}{_HOT_SUFFIX}",
+                cold_segments=tuple(
+                    sorted(
+                        (
+                            _ColdSegment.from_path(path)
+                            for path in self._directory.glob(
+                                f"{conversation_id:x}.*{_COLD_SUFFIX}"
+                            )
+                        ),
+                        key=lambda segment: segment.number,
+                    )
+                ),
+            )
+        self._files[conversation_id] = files
+        return files
+
+    def _set_files(self, conversation_id: Identifier, files: _Files) -> None:
+        """
+        Replaces the manifest of the conversation, which switches to the
+        files passed. Must be called with the conversation's lock held.
+        """
+        manifest = {
+            "log": files.log.name,
+            "cold_segments": [segment.path.name for segment in files.cold_segments],
+        }
+        _write_file(
+            self._get_manifest_path(conversation_id),
+            json.dumps(manifest).encode("utf-8"),
+        )
+        self._files[conversation_id] = files
+
+    def _sync_index(self, conversation_id: Identifier) -> int:
+        """
+        Indexes the lines of the log which are not yet, and returns the
+        number of messages in the log.
+        Appends keep the index up to date, but it can lag behind after a
+        crash.
+        Must be called with the conversation's lock held.
+        """
+        files = self._get_files(conversation_id)
+        if not files.log.is_file():
+            files.index.unlink(missing_ok=True)
+            return 0
+        with files.log.open(mode="rb") as log, files.index.open(mode="a+b") as index:
+            indexed, partial = divmod(index.seek(0, os.SEEK_END), _OFFSET.size)
+            if partial:
+                index.truncate(indexed * _OFFSET.size)
+            position = 0
+            if indexed:
+                index.seek((indexed - 1) * _OFFSET.size)
+                (offset,) = _OFFSET.unpack(index.read(_OFFSET.size))
+                log.seek(offset)
+                line = log.readline()
+                if line.endswith(b"\n"):
+                    position = offset + len(line)
+                else:
+                    # The index doesn't match the log, we rebuild it
+                    index.truncate(0)
+                    indexed = 0
+            log.seek(position)
+            for line in log:
+                if not line.endswith(b"\n"):
+                    break
+                index.write(_OFFSET.pack(position))
+                position += len(line)
+                indexed += 1
+        self._synced.add(conversation_id)
+        return indexed
+
+    def append(self, conversation_id: Identifier, record: MessageRecord) -> None:
+        """
+        Appends a message at the end of the conversation's log.
+        """
+        with self._get_lock(conversation_id):
+            if conversation_id not in self._synced:
+                self._sync_index(conversation_id)
+            files = self._get_files(conversation_id)
+            with files.log.open(mode="ab") as log:
+                offset = log.seek(0, os.SEEK_END)
+                log.write(record.to_line())
+            with files.index.open(mode="ab") as index:
+                index.write(_OFFSET.pack(offset))
+
+    def iter(
+        self, conversation_id: Identifier, start: int = 0
+    ) -> Generator[MessageRecord, None, None]:
+        """
+        Iterates over the messages of a conversation, from the oldest to the
+        most recent, skipping the first `start` ones.
+        Cold segments are decompressed one at a time, when reached.
+        The messages are the ones stored when the iteration starts.
+        """
+        with self._get_lock(conversation_id):
+            files = self._get_files(conversation_id)
+            hot_count = self._sync_index(conversation_id)
+            # Opened now, so that we keep reading it if it is archived
+            log = files.log.open(mode="rb") if hot_count else None
+        try:
+            for segment in files.cold_segments:
+                if start >= segment.count:
+                    # Skipped without decompressing it
+                    start -= segment.count
+                    continue
+                yield from _read_cold_segment(segment.path)[start:]
+                start = 0
+            if log is not None:
+                lines = islice(log, start, hot_count)
+                yield from map(MessageRecord.from_line, lines)
+        finally:
+            if log is not None:
+                log.close()
+
+    def count(self, conversation_id: Identifier) -> int:
+        with self._get_lock(conversation_id):
+            cold_count = sum(
+                segment.count
+                for segment in self._get_files(conversation_id).cold_segments
+            )
+            return cold_count + self._sync_index(conversation_id)
+
+    def _read_hot(
+        self, conversation_id: Identifier, start: int, stop: int
+    ) -> list[MessageRecord]:
+        """
+        Must be called with the conversation's lock held.
+        """
+        stop = min(stop, self._sync_index(conversation_id))
+        if start >= stop:
+            return []
+        files = self._get_files(conversation_id)
+        with files.index.open(mode="rb") as index:
+            index.seek(start * _OFFSET.size)
+            (offset,) = _OFFSET.unpack(index.read(_OFFSET.size))
+        with files.log.open(mode="rb") as log:
+            log.seek(offset)
+            return [MessageRecord.from_line(log.readline()) for _ in range(start, stop)]
+
+    def read(
+        self, conversation_id: Identifier, start: int, stop: int
+    ) -> list[MessageRecord]:
+        """
+        Returns the messages from position `start` to `stop` (excluded),
+        the oldest message of the conversation being at position 0.
+        Only the cold segments and the part of the log holding them are read.
+        """
+        records = []
+        position = 0
+        with self._get_lock(conversation_id):
+            for segment in self._get_files(conversation_id).cold_segments:
+                end = position + segment.count
+                if start < end and stop > position:
+                    records.extend(
+                        _read_cold_segment(segment.path)[
+                            max(start - position, 0) : stop - position
+                        ]
+                    )
+                position = end
+            if stop > position:
+                records.extend(
+                    self._read_hot(
+                        conversation_id, max(start - position, 0), stop - position
+                    )
+                )
+        return records
+
+    def bisect_time(self, conversation_id: Identifier, time: int) -> int:
+        """
+        Returns the position of the first message received at or after
+        `time`, or the number of messages if there is none.
+        As messages are appended when received, they are sorted by time.
+        """
+        position = 0
+        with self._get_lock(conversation_id):
+            for segment in self._get_files(conversation_id).cold_segments:
+                if segment.last_time >= time:
+                    records = _read_cold_segment(segment.path)
+                    return position + bisect_left(records, time, key=lambda r: r.time)
+                position += segment.count
+            # Binary search in the log, reading one message at each step
+            low, high = 0, self._sync_index(conversation_id)
+            while low < high:
+                middle = (low + high) // 2
+                (record,) = self._read_hot(conversation_id, middle, middle + 1)
+                if record.time < time:
+                    low = middle + 1
+                else:
+                    high = middle
+        return position + low
+
+    def get_last(self, conversation_id: Identifier) -> MessageRecord | None:
+        """
+        Returns the last message of a conversation, reading the log backwards.
+        """
+        with self._get_lock(conversation_id):
+            files = self._get_files(conversation_id)
+            if files.log.is_file():
+                with files.log.open(mode="rb") as log:
+                    end = log.seek(0, os.SEEK_END)
+                    position = end
+                    tail = b""
+                    # The log always ends with a newline, which we skip
+                    while position > 0 and tail.count(b"\n") < 2:
+                        position = max(0, position - _TAIL_CHUNK_SIZE)
+                        log.seek(position)
+                        tail = log.read(end - position)
+                    # Ignores a message which is being written
+                    lines = tail[: tail.rfind(b"\n") + 1].splitlines()
+                    if lines:
+                        return MessageRecord.from_line(lines[-1])
+            # Everything has been archived
+            if files.cold_segments:
+                return _read_cold_segment(files.cold_segments[-1].path)[-1]
+
+    def archive(self, conversation_id: Identifier, older_than: int) -> int:
+        """
+        Moves the messages received before `older_than` from the log to a new
+        cold segment, and returns how many were moved.
+        Only the leading messages are moved, so that the order is preserved.
+        Nothing is done if there are less than
+        `settings.messages_archive_min_count` of them.
+        """
+        with self._get_lock(conversation_id):
+            files = self._get_files(conversation_id)
+            if not (hot_count := self._sync_index(conversation_id)):
+                return 0
+            with files.log.open(mode="rb") as log:
+                records = [
+                    MessageRecord.from_line(line) for line in islice(log, hot_count)
+                ]
+            old_count = 0
+            for record in records:
+                if record.time >= older_than:
+                    break
+                old_count += 1
+            if not old_count or old_count < settings.messages_archive_min_count.get():
+                return 0
+
+            if not self._get_manifest_path(conversation_id).is_file():
+                # So that the files we write below are ignored until we
+                # switch to them, even if the last cold segment is not
+                # listed by its manifest after a crash
+                self._set_files(conversation_id, files)
+            old, recent = records[:old_count], records[old_count:]
+            number = files.cold_segments[-1].number + 1 if files.cold_segments else 0
+            # The new files are written aside, a crash leaving the ones listed
+            # by the manifest untouched. They are overwritten on next try.
+            cold_path = self._directory / _ColdSegment.get_name(
+                conversation_id, number, old
+            )
+            _write_file(
+                cold_path,
+                zlib.compress(b"".join(record.to_line() for record in old), level=9),
+            )
+            log_path = (
+                self._directory / f"{conversation_id:x}.{number:06d}{_HOT_SUFFIX}"
+            )
+            _write_file(log_path, b"".join(record.to_line() for record in recent))
+            new_files = _Files(
+                log=log_path,
+                cold_segments=(
+                    *files.cold_segments,
+                    _ColdSegment.from_path(cold_path),
+                ),
+            )
+            new_files.index.unlink(missing_ok=True)
+            self._synced.discard(conversation_id)
+            self._set_files(conversation_id, new_files)
+            files.log.unlink(missing_ok=True)
+            files.index.unlink(missing_ok=True)
+        return old_count
+
+    def _get_conversation_ids(self) -> set[Identifier]:
+        return {
+            Identifier(path.name.split(".", 1)[0], 16)
+            for path in self._directory.glob(f"*{_HOT_SUFFIX}")
+        }
+
+    def archive_all(self, older_than: int) -> int:
+        """
+        Archives the old messages of every conversation.
+        """
+        archived = 0
+        for conversation_id in self._get_conversation_ids():
+            archived += self.archive(conversation_id, older_than)
+        if archived:
+            logger.info(f"Archived {archived} messages")
+        return archived
+
+    def rename(self, old_id: Identifier, new_id: Identifier) -> bool:
+        """
+        Moves the messages of a conversation to another identifier.
+        Nothing is done if there are already messages under `new_id`.
+        Returns whether messages were moved.
+        """
+        first, second = sorted((old_id, new_id))
+        with self._get_lock(first), self._get_lock(second):
+            new_files = self._get_files(new_id)
+            if new_files.log.exists() or new_files.cold_segments:
+                logger.warning(
+                    f"Conversation {new_id:x} already has messages, "
+                    f"did not move the ones of {old_id:x}"
+                )
+                return False
+            old_files = self._get_files(old_id)
+
+            def move(path: Path) -> Path:
+                _, rest = path.name.split(".", 1)
+                return path.replace(self._directory / f"{new_id:x}.{rest}")
+
+            moved = old_files.log.exists()
+            if moved:
+                new_files = new_files._replace(log=move(old_files.log))
+            if old_files.index.exists():
+                old_files.index.replace(new_files.index)
+            new_files = new_files._replace(
+                cold_segments=tuple(
+                    _ColdSegment.from_path(move(segment.path))
+                    for segment in old_files.cold_segments
+                )
+            )
+            moved = moved or bool(old_files.cold_segments)
+            if moved:
+                self._set_files(new_id, new_files)
+            self._get_manifest_path(old_id).unlink(missing_ok=True)
+            self._files.pop(old_id, None)
+            self._synced.discard(old_id)
+            self._synced.discard(new_id)
+        _read_cold_segment.cache_clear()
+        return moved
+
+    def remove(self, conversation_id: Identifier) -> None:
+        with self._get_lock(conversation_id):
+            files = self._get_files(conversation_id)
+            self._get_manifest_path(conversation_id).unlink(missing_ok=True)
+            files.log.unlink(missing_ok=True)
+            files.index.unlink(missing_ok=True)
+            for segment in files.cold_segments:
+                segment.path.unlink(missing_ok=True)
+            self._files.pop(conversation_id, None)
+            self._synced.discard(conversation_id)
+        _read_cold_segment.cache_clear()
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from functools import reduce
+from typing import Any, Callable, Hashable, Iterable, Literal
+
+from tinydb import where
+from tinydb.queries import QueryInstance
+
+# Pseudo-field designating the identifier of the documents
+ID_FIELD = "id"
+
+_Operator = Literal["eq", "between", "isin", "notin"]
+
+
+@dataclass(frozen=True)
+class Condition:
+    field: str
+    operator: _Operator
+    value: Any
+
+    def __str__(self) -> str:
+        return f"{self.field} {self.operator} {self.value!r}"
+
+    def to_tinydb(self) -> QueryInstance:
+        """
+        Translates the condition into a TinyDB query.
+        Only valid for fields actually present in the documents.
+        """
+        target = where(self.field)
+        if self.operator == "eq":
+            return target == self.value
+        elif self.operator == "between":
+            low, high = self.value
+            return (target >= low) & (target <= high)
+        elif self.operator == "isin":
+            return target.one_of(list(self.value))
+        elif self.operator == "notin":
+            return ~target.one_of(list(self.value))
+
+    def accepts(self, values: tuple) -> bool:
+        """
+        Checks whether the condition holds for at least one of the values.
+        Used for the identifier and for indexed, computed fields.
+        """
+        if self.operator == "eq":
+            return self.value in values
+        elif self.operator == "between":
+            low, high = self.value
+            return any(low <= value <= high for value in values)
+        elif self.operator == "isin":
+            return not set(values).isdisjoint(self.value)
+        elif self.operator == "notin":
+            return set(values).isdisjoint(self.value)
+
+
+class Query:
+
+    """
+    Describes a selection of documents in a table.
+    It is executed by the database (see `Database.find`), which uses the
+    indexes of the table when it can, so that only the documents matching
+    are returned.
+
+    Examples
+    --------
+    >>> query = Query(Conversation).where(size=2).limit(10)
+    >>> Conversation.find(query)
+    """
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.conditions: list[Condition] = []
+        self.order: tuple[str, bool] | None = None
+        self.max_results: int | None = None
+
+    def where(self, **fields: Any) -> Query:
+        """
+        Selects the documents whose fields are equal to the values passed.
+        """
+        for name, value in fields.items():
+            self.conditions.append(Condition(name, "eq", value))
+        return self
+
+    def between(self, field_name: str, low: Any, high: Any) -> Query:
+        """
+        Selects the documents whose field is comprised between `low` and
+        `high` (inclusive).
+        """
+        self.conditions.append(Condition(field_name, "between", (low, high)))
+        return self
+
+    def isin(self, field_name: str, values: Iterable[Any]) -> Query:
+        self.conditions.append(Condition(field_name, "isin", frozenset(values)))
+        return self
+
+    def notin(self, field_name: str, values: Iterable[Any]) -> Query:
+        self.conditions.append(Condition(field_name, "notin", frozenset(values)))
+        return self
+
+    def order_by(self, field_name: str, reverse: bool = False) -> Query:
+        self.order = (field_name, reverse)
+        return self
+
+    def limit(self, max_results: int) -> Query:
+        self.max_results = max_results
+        return self
+
+
+@dataclass
+class QueryPlan:
+
+    """
+    Describes how a query is executed, as returned by `Database.explain`.
+    """
+
+    table: str
+    # Conditions resolved with an index, formatted as "<index>: <condition>"
+    indexes: list[str] = field(default_factory=list)
+    # Number of documents selected by the indexes, None if we scan the table
+    candidates: int | None = None
+    # Conditions evaluated by TinyDB on the documents
+    native: list[str] = field(default_factory=list)
+    # Conditions evaluated on the documents with the table's index functions
+    computed: list[str] = field(default_factory=list)
+
+    @property
+    def full_scan(self) -> bool:
+        return self.candidates is None
+
+
+class Index:
+
+    """
+    Maps the values computed from the documents of a table to their
+    identifiers.
+    The function computing the value can return a collection, in which case
+    the document is indexed under each of its items.
+    """
+
+    def __init__(self, key: Callable[[dict], Hashable | Iterable[Hashable]]):
+        self._key = key
+        self._entries: defaultdict[Hashable, set[int]] = defaultdict(set)
+        self._values_of: dict[int, tuple] = {}
+
+    def values(self, document: dict) -> tuple:
+        try:
+            value = self._key(document)
+        except (KeyError, TypeError):
+            return ()
+        if isinstance(value, (list, tuple, set, frozenset)):
+            return tuple(value)
+        return (value,)
+
+    def add(self, doc_id: int, document: dict) -> None:
+        self.discard(doc_id)
+        values = self.values(document)
+        self._values_of[doc_id] = values
+        for value in values:
+            self._entries[value].add(doc_id)
+
+    def discard(self, doc_id: int) -> None:
+        for value in self._values_of.pop(doc_id, ()):
+            self._entries[value].discard(doc_id)
+            if not self._entries[value]:
+                del self._entries[value]
+
+    def lookup(self, condition: Condition) -> set[int] | None:
+        """
+        Returns the identifiers of the documents matching the condition,
+        or None if this index can't resolve it.
+        """
+        if condition.operator == "eq":
+            return set(self._entries.get(condition.value, ()))
+        elif condition.operator == "isin":
+            return set().union(
+                *(self._entries.get(value, ()) for value in condition.value)
+            )
+        elif condition.operator == "between":
+            low, high = condition.value
+            return set().union(
+                *(
+                    doc_ids
+                    for value, doc_ids in self._entries.items()
+                    if low <= value <= high
+                )
+            )
+
+    def counts(self) -> dict[Hashable, int]:
+        """
+        Returns the number of documents indexed under each value.
+        """
+        return {value: len(doc_ids) for value, doc_ids in self._entries.items()}
+
+
+def combine(conditions: list[Condition]) -> QueryInstance | None:
+    if conditions:
+        return reduce(
+            lambda left, right: left & right,
+            (condition.to_tinydb() for condition in conditions),
+        )
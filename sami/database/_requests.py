@@ -0,0 +1,356 @@
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Generator, Iterable, NamedTuple
+
+from loguru import logger
+
+from ..config import Identifier, settings
+from ..design import ReadWriteLock, Singleton
+
+# Each record is a header followed by the payload.
+# The header contains (1) the identifier of the request, (2) its timestamp,
+# (3) its status and (4) the length of the payload.
+_HEADER = struct.Struct(">32sq8sI")
+_SEGMENT_SUFFIX = ".seg"
+
+
+class _IndexEntry(NamedTuple):
+    offset: int
+    length: int
+    timestamp: int
+    status: str
+
+
+class CompactionResult(NamedTuple):
+    removed: int
+    reclaimed: int
+
+
+def _pack_header(identifier: Identifier, entry: _IndexEntry) -> bytes:
+    return _HEADER.pack(
+        identifier.to_bytes(32, "big"),
+        entry.timestamp,
+        entry.status.encode("ascii"),
+        entry.length,
+    )
+
+
+@dataclass
+class _Segment:
+
+    """
+    An append-only file of records, along with its index.
+    The index maps each identifier to the location of its last record.
+    """
+
+    path: Path
+    index: dict[Identifier, _IndexEntry] = field(default_factory=dict)
+    size: int = 0
+    _map: mmap.mmap | None = None
+    _mapped_size: int = 0
+    _map_lock: Lock = field(default_factory=Lock)
+
+    @property
+    def first_timestamp(self) -> int | None:
+        return min((entry.timestamp for entry in self.index.values()), default=None)
+
+    @property
+    def last_timestamp(self) -> int | None:
+        return max((entry.timestamp for entry in self.index.values()), default=None)
+
+    def view(self) -> mmap.mmap | None:
+        """
+        Returns a read-only memory map of the segment,
+        remapping it if it has grown since the last call.
+        """
+        if self.size == 0:
+            return
+        # Several readers might want to remap the segment at the same time
+        with self._map_lock:
+            if self._map is None or self._mapped_size != self.size:
+                self.close()
+                with self.path.open(mode="rb") as f:
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._mapped_size = self.size
+            return self._map
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def load_index(self) -> None:
+        """
+        Builds the index by going through the records' headers.
+        Payloads are skipped, not parsed.
+        """
+        self.index.clear()
+        self.size = self.path.stat().st_size
+        view = self.view()
+        offset = 0
+        while view is not None and offset < self.size:
+            if offset + _HEADER.size > self.size:
+                self._truncate(offset)
+                break
+            raw_id, timestamp, status, length = _HEADER.unpack_from(view, offset)
+            if offset + _HEADER.size + length > self.size:
+                self._truncate(offset)
+                break
+            self.index[Identifier(int.from_bytes(raw_id, "big"))] = _IndexEntry(
+                offset=offset + _HEADER.size,
+                length=length,
+                timestamp=timestamp,
+                status=status.rstrip(b"\0").decode("ascii"),
+            )
+            offset += _HEADER.size + length
+
+    def _truncate(self, size: int) -> None:
+        """
+        Drops an incomplete record at the end of the segment,
+        which is probably the result of a crash during a write.
+        """
+        logger.warning(f"Truncated record found in {self.path!s}, dropped it")
+        self.close()
+        os.truncate(self.path, size)
+        self.size = size
+
+    def read(self, entry: _IndexEntry) -> bytes:
+        return self.view()[entry.offset : entry.offset + entry.length]
+
+
+class RequestsLog(Singleton):
+
+    """
+    Log-structured storage for the requests, used by relays.
+
+    Requests are appended to segment files, which are read through memory
+    maps. Reads can happen concurrently, while writes and compactions are
+    exclusive. The most recent segment receives the writes ; once it reaches
+    `settings.requests_segment_size`, a new one is created.
+    Expired and superseded records are dropped by `compact`.
+    """
+
+    _directory: Path
+    _segments: list[_Segment]
+    _lock: ReadWriteLock
+
+    def __enter__(self) -> RequestsLog:
+        return self
+
+    def __exit__(self, *_) -> None:
+        pass
+
+    def init(self):
+        self._directory = settings.databases_directory.get() / "requests"
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._lock = ReadWriteLock()
+        self._segments = []
+        for path in sorted(self._directory.glob(f"*{_SEGMENT_SUFFIX}")):
+            segment = _Segment(path=path)
+            segment.load_index()
+            self._segments.append(segment)
+        if not self._segments:
+            self._new_segment()
+
+    def _new_segment(self) -> _Segment:
+        if self._segments:
+            number = int(self._segments[-1].path.stem) + 1
+        else:
+            number = 0
+        path = self._directory / f"{number:08d}{_SEGMENT_SUFFIX}"
+        path.touch()
+        segment = _Segment(path=path)
+        self._segments.append(segment)
+        return segment
+
+    def _locate(self, identifier: Identifier) -> tuple[_Segment, _IndexEntry] | None:
+        """
+        Finds the most recent record of a request.
+        """
+        for segment in reversed(self._segments):
+            if (entry := segment.index.get(identifier)) is not None:
+                return segment, entry
+
+    def append(
+        self, identifier: Identifier, timestamp: int, status: str, payload: bytes
+    ) -> None:
+        with self._lock.write():
+            segment = self._segments[-1]
+            if segment.size >= settings.requests_segment_size.get():
+                segment = self._new_segment()
+            entry = _IndexEntry(
+                offset=segment.size + _HEADER.size,
+                length=len(payload),
+                timestamp=timestamp,
+                status=status,
+            )
+            with segment.path.open(mode="ab") as f:
+                f.write(_pack_header(identifier, entry) + payload)
+            segment.index[identifier] = entry
+            segment.size += _HEADER.size + len(payload)
+
+    def append_many(self, records: Iterable[tuple[Identifier, int, str, bytes]]) -> int:
+        """
+        Appends records of (identifier, timestamp, status, payload) in bulk.
+        Records already known are skipped.
+        The index of the segments written to is only built once all the
+        records are written.
+        Returns the number of records appended.
+        """
+        appended = 0
+        with self._lock.write():
+            known = set().union(*(segment.index.keys() for segment in self._segments))
+            written = []
+            segment = self._segments[-1]
+            f = segment.path.open(mode="ab")
+            try:
+                for identifier, timestamp, status, payload in records:
+                    if identifier in known:
+                        continue
+                    if segment.size >= settings.requests_segment_size.get():
+                        f.close()
+                        written.append(segment)
+                        segment = self._new_segment()
+                        f = segment.path.open(mode="ab")
+                    entry = _IndexEntry(
+                        offset=segment.size + _HEADER.size,
+                        length=len(payload),
+                        timestamp=timestamp,
+                        status=status,
+                    )
+                    f.write(_pack_header(identifier, entry) + payload)
+                    segment.size += _HEADER.size + len(payload)
+                    known.add(identifier)
+                    appended += 1
+            finally:
+                f.close()
+                written.append(segment)
+                for segment in written:
+                    segment.load_index()
+        return appended
+
+    def contains(self, identifier: Identifier) -> bool:
+        with self._lock.read():
+            return self._locate(identifier) is not None
+
+    def get(self, identifier: Identifier) -> bytes | None:
+        with self._lock.read():
+            if (location := self._locate(identifier)) is not None:
+                segment, entry = location
+                return segment.read(entry)
+
+    def get_between(
+        self, beginning: int, end: int
+    ) -> Generator[tuple[int, bytes], None, None]:
+        """
+        Yields the timestamp and payload of the requests whose timestamp is
+        comprised between `beginning` and `end`.
+        Segments are read sequentially, in the order records were written.
+        """
+        with self._lock.read():
+            segments = list(self._segments)
+        for segment in segments:
+            first, last = segment.first_timestamp, segment.last_timestamp
+            if first is None or last < beginning or first > end:
+                continue
+            with self._lock.read():
+                entries = sorted(
+                    (entry, identifier) for identifier, entry in segment.index.items()
+                )
+            for entry, identifier in entries:
+                if not beginning <= entry.timestamp <= end:
+                    continue
+                with self._lock.read():
+                    # The segment might have been compacted in the meantime
+                    if segment.index.get(identifier) != entry:
+                        continue
+                    payload = segment.read(entry)
+                yield entry.timestamp, payload
+
+    def get_last(self) -> bytes | None:
+        """
+        Returns the payload of the request with the most recent timestamp.
+        """
+        with self._lock.read():
+            last = None
+            for segment in self._segments:
+                for entry in segment.index.values():
+                    if last is None or entry.timestamp > last[1].timestamp:
+                        last = segment, entry
+            if last is not None:
+                segment, entry = last
+                return segment.read(entry)
+
+    def entries(self) -> list[tuple[Identifier, _IndexEntry]]:
+        """
+        Returns the location of the most recent record of each request.
+        """
+        with self._lock.read():
+            latest = {}
+            for segment in self._segments:
+                latest.update(segment.index)
+            return list(latest.items())
+
+    def compact(
+        self, discard: Callable[[Identifier, _IndexEntry], bool] | None = None
+    ) -> CompactionResult:
+        """
+        Rewrites the segments without the records which are superseded by a
+        more recent record of the same request, or for which `discard`
+        returns True.
+        """
+        removed = reclaimed = 0
+        with self._lock.write():
+            for position, segment in enumerate(self._segments):
+                newer_ids = set().union(
+                    *(newer.index.keys() for newer in self._segments[position + 1 :])
+                )
+                kept = sorted(
+                    (entry, identifier)
+                    for identifier, entry in segment.index.items()
+                    if identifier not in newer_ids
+                    and not (discard is not None and discard(identifier, entry))
+                )
+                live_size = sum(_HEADER.size + entry.length for entry, _ in kept)
+                if live_size == segment.size:
+                    continue
+                removed += len(segment.index) - len(kept)
+                reclaimed += self._rewrite(segment, kept)
+            self._segments = [segment for segment in self._segments if segment.size]
+            if not self._segments:
+                self._new_segment()
+        if reclaimed:
+            logger.info(
+                f"Compacted the requests log, removed {removed} records "
+                f"and reclaimed {reclaimed} bytes"
+            )
+        return CompactionResult(removed=removed, reclaimed=reclaimed)
+
+    @staticmethod
+    def _rewrite(segment: _Segment, kept: list[tuple[_IndexEntry, Identifier]]) -> int:
+        """
+        Rewrites a segment with only the records passed,
+        and returns the number of bytes reclaimed.
+        """
+        previous_size = segment.size
+        temp_path = segment.path.with_suffix(".tmp")
+        with temp_path.open(mode="wb") as f:
+            for entry, identifier in kept:
+                f.write(_pack_header(identifier, entry))
+                f.write(segment.read(entry))
+        segment.close()
+        if kept:
+            os.replace(temp_path, segment.path)
+            segment.load_index()
+        else:
+            temp_path.unlink()
+            segment.path.unlink()
+            segment.index.clear()
+            segment.size = 0
+        return previous_size - segment.size
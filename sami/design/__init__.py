@@ -1,9 +1,13 @@
+from .identity_map import IdentityMap
 from .monad import Maybe, Monad
+from .rwlock import ReadWriteLock
 from .singleton import Singleton, SingletonMeta
 
 __all__ = [
+    IdentityMap,
     Maybe,
     Monad,
+    ReadWriteLock,
     Singleton,
     SingletonMeta,
 ]
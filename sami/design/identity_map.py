@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+from threading import Lock
+from typing import Callable, Generic, Hashable, TypeVar
+from weakref import WeakValueDictionary
+
+_K = TypeVar("_K", bound=Hashable)
+_V = TypeVar("_V")
+
+
+class IdentityMap(Generic[_K, _V]):
+    """
+    Registry of the canonical instance of objects, by key.
+
+    Objects are held weakly: once no one else references an instance,
+    it is dropped from the map.
+
+    Examples
+    --------
+    >>> nodes = IdentityMap()
+    >>> node = nodes.intern(identifier, lambda: Node(**dbo))
+    >>> nodes.intern(identifier, lambda: Node(**dbo)) is node
+    True
+    """
+
+    def __init__(self):
+        self._instances: WeakValueDictionary[_K, _V] = WeakValueDictionary()
+        self._lock = Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def __len__(self) -> int:
+        return len(self._instances)
+
+    def get(self, key: _K) -> _V | None:
+        return self._instances.get(key)
+
+    def intern(self, key: _K, factory: Callable[[], _V]) -> _V:
+        """
+        Returns the instance registered under `key`.
+        If there is none, creates it with `factory` and registers it.
+        """
+        with self._lock:
+            instance = self._instances.get(key)
+            if instance is not None:
+                self.hits += 1
+                return instance
+            self.misses += 1
+        # The factory is called without holding the lock, as it can be slow
+        # and itself intern other objects. If another thread registered an
+        # instance in the meantime, we return that one.
+        instance = factory()
+        with self._lock:
+            return self._instances.setdefault(key, instance)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._instances.clear()
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from threading import Condition, Lock
+from typing import Generator
+
+
+class ReadWriteLock:
+    """
+    A lock allowing either many concurrent readers, or a single writer.
+
+    Writers have priority: once a writer is waiting, new readers wait until
+    it is done, so that a steady flow of reads can't starve the writes.
+    It is not reentrant: a thread holding the lock must not acquire it again.
+
+    Examples
+    --------
+    >>> lock = ReadWriteLock()
+    >>> with lock.read():
+    >>>     ...  # Other readers can enter this block at the same time
+    >>> with lock.write():
+    >>>     ...  # Exclusive access
+    """
+
+    def __init__(self):
+        self._condition = Condition(Lock())
+        self._readers: int = 0
+        self._writing: bool = False
+        self._waiting_writers: int = 0
+
+    @contextmanager
+    def read(self) -> Generator[None, None, None]:
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self) -> Generator[None, None, None]:
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
@@ -0,0 +1,160 @@
+"""
+Migrations of the data we store on disk.
+
+Identifiers are computed from the hash of the pickle of objects, unless
+`settings.hashing_scheme` selects their canonical encoding
+(see `sami.cryptography.hashing`). The data stored under the legacy
+identifiers is then moved to the canonical ones by `migrate_identifiers`.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Iterable
+
+import pydantic
+from loguru import logger
+from tinydb.table import Document
+
+from .config import Identifier, settings
+from .cryptography.asymmetric import hash_public_key_document
+from .cryptography.hashing import hashing_scheme
+from .database import Database, MessagesStore, RequestsLog
+from .network.requests import Request
+from .objects import Contact, Conversation, MasterNode, Node, StoredSamiObject
+from .utils import get_id
+
+
+@dataclass
+class IdentifiersMigration:
+    # Whether the messages directory of our node was moved
+    messages_directory: bool = False
+    # Documents of the database stored under their new identifier,
+    # including the ones of the conversations table, named after our node
+    documents: int = 0
+    # Conversations whose messages were moved
+    conversations: int = 0
+    requests: int = 0
+
+
+def get_legacy_node_id(node: Node) -> Identifier:
+    with hashing_scheme("legacy"):
+        return get_id(hash_public_key_document(node.public_key.dict()))
+
+
+def get_legacy_conversation_id(members: Iterable[Node]) -> Identifier:
+    member_ids = [get_legacy_node_id(node) for node in members]
+    with hashing_scheme("legacy"):
+        return Conversation.get_id_from_member_ids(member_ids)
+
+
+def _migrate_messages_directory() -> bool:
+    master_node = MasterNode()
+    directory = settings.databases_directory.get()
+    old_path = directory / f"messages_{get_legacy_node_id(master_node)}"
+    new_path = directory / f"messages_{master_node.id}"
+    if old_path == new_path or not old_path.is_dir():
+        return False
+    if new_path.is_dir():
+        if any(new_path.iterdir()):
+            logger.warning(
+                f"Both {old_path!s} and {new_path!s} exist, "
+                "did not migrate the messages"
+            )
+            return False
+        # Created empty by the `MessagesStore`
+        new_path.rmdir()
+    old_path.rename(new_path)
+    return True
+
+
+def _migrate_table(obj: type[StoredSamiObject]) -> int:
+    """
+    Stores the documents of a table under their current identifier.
+    Invalid documents are left as is, they are removed when read.
+    """
+    legacy_ids = []
+    documents = []
+    with Database() as db:
+        for batch in db.iter_batches(obj, settings.database_batch_size.get()):
+            for document in batch:
+                try:
+                    item = obj.from_document(document)
+                except pydantic.ValidationError:
+                    continue
+                if item.id != document.doc_id:
+                    legacy_ids.append(document.doc_id)
+                    documents.append(Document(item.to_document(), doc_id=item.id))
+        db.remove_many(obj, legacy_ids)
+        db.insert_many(obj, documents)
+    return len(documents)
+
+
+def _migrate_database() -> int:
+    legacy_node_id = get_legacy_node_id(MasterNode())
+    with Database() as db:
+        migrated = db.move_table(
+            f"{Conversation.__table_name__}_{legacy_node_id}", Conversation
+        )
+    for obj in (Node, Contact, Conversation):
+        migrated += _migrate_table(obj)
+    return migrated
+
+
+def _migrate_conversations() -> int:
+    migrated = 0
+    with MessagesStore() as store:
+        for conversation in Conversation.iter_all():
+            legacy_id = get_legacy_conversation_id(conversation.members)
+            if legacy_id != conversation.id and store.rename(
+                legacy_id, conversation.id
+            ):
+                migrated += 1
+    return migrated
+
+
+def _migrate_requests_log() -> int:
+    with RequestsLog() as log:
+        records = []
+        legacy_ids = set()
+        for identifier, entry in log.entries():
+            if (payload := log.get(identifier)) is None:
+                continue
+            request = Request.from_bytes(payload)
+            if request.id == identifier:
+                continue
+            records.append((request.id, entry.timestamp, entry.status, payload))
+            legacy_ids.add(identifier)
+        if not records:
+            return 0
+        log.append_many(records)
+        log.compact(discard=lambda identifier, _: identifier in legacy_ids)
+    return len(records)
+
+
+def migrate_identifiers() -> IdentifiersMigration:
+    """
+    Moves the data stored under legacy identifiers to the current ones:
+    the documents of the database, the messages of our node and of its
+    conversations, and the requests.
+    Data already migrated is left as is, so this can be run on each start.
+
+    Must be called once the private key is loaded, and before the messages
+    are read, as the `MessagesStore` is bound to the directory of our node.
+    Conversations are looked up in the database, so the messages of the
+    ones it doesn't contain are not migrated.
+    """
+    if settings.hashing_scheme.get() == "legacy":
+        return IdentifiersMigration()
+    migration = IdentifiersMigration(
+        messages_directory=_migrate_messages_directory(),
+        documents=_migrate_database(),
+    )
+    # Looks the conversations up with their new identifier
+    migration.conversations = _migrate_conversations()
+    if settings.requests_log.get():
+        migration.requests = _migrate_requests_log()
+    else:
+        migration.requests = _migrate_table(Request)
+    logger.info(f"Migrated identifiers: {migration}")
+    return migration
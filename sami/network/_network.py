@@ -3,6 +3,7 @@ from __future__ import annotations
 import ipaddress
 import socket
 import threading as th
+from itertools import islice
 from typing import Generator
 
 import pydantic
@@ -69,7 +70,8 @@ class Network:
         """
         # Note: we don't pass the request to the send queue because this
         #  method is only called by the job scheduler.
-        if len(Contact.all()) < settings.min_peers:
+        min_peers = settings.min_peers.get()
+        if len(list(islice(Contact.iter_all(), min_peers))) < min_peers:
             # We don't know enough unique contacts
             return
 
@@ -100,6 +102,10 @@ class Network:
         """
         if self.address.is_loopback:
             return False
+        contact.update_address()
+        if not contact.is_resolved:
+            # Its DNS name is being resolved in the background
+            return False
         if contact.address.is_global:
             if not self.is_primary:
                 return False
@@ -128,10 +134,15 @@ class Network:
         for beacon in shuffled(settings.beacons.get()):
             if self.can_connect_to(beacon):
                 yield beacon
-        # Then, the contacts
-        for contact in shuffled(Contact.all()):
-            if self.can_connect_to(contact):
-                yield contact
+        # Then, the contacts, which are read lazily from the database.
+        # They are shuffled by batches, so that we do not always try
+        # the same ones first.
+        contacts = Contact.iter_all()
+        batch_size = settings.database_batch_size.get()
+        while batch := list(islice(contacts, batch_size)):
+            for contact in shuffled(batch):
+                if self.can_connect_to(contact):
+                    yield contact
 
     def _receive_all(
         self, sock: socket.socket, address_check: str | None = None
@@ -222,6 +233,9 @@ class Network:
         Send a Request to a specific Contact.
         Returns True if we managed to send the Request, False otherwise.
         """
+        # This is called by the sender thread, which can wait for the
+        # contact's address to be resolved.
+        contact.update_address(wait=True)
         if not self.can_connect_to(contact):
             return False
 
@@ -249,5 +263,6 @@ class Network:
                 logger.info(
                     f"Sent {request.status!r} request {request.id!r} to {contact!r}"
                 )
+                contact.seen()
                 return True
         return False
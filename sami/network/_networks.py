@@ -19,13 +19,14 @@ from urllib.request import urlopen
 import upnpclient
 
 from ..config import settings
+from ..database import MessagesStore
 from ..design import Singleton
 from ..jobs import Job
 from ..objects import Contact
 from ..threads.jobs import JobsThread
 from ..utils import get_time
 from ._network import Network
-from .requests import Request
+from .requests import Request, enforce_retention
 from .threads import RequestHandlingThread, RequestSenderThread
 from .utils import (
     IPV6_REGEX,
@@ -80,6 +81,18 @@ class Networks(Singleton):
                 schedule=settings.contact_discovery_schedule,
             )
         )
+        self.jobs_thread.jobs.register(
+            Job(
+                action=self.compact_requests,
+                schedule=settings.requests_compaction_schedule,
+            )
+        )
+        self.jobs_thread.jobs.register(
+            Job(
+                action=self.archive_messages,
+                schedule=settings.messages_archive_schedule,
+            )
+        )
         self.jobs_thread.start()
 
     @cached_property
@@ -119,6 +132,15 @@ class Networks(Singleton):
         # TODO
         pass
 
+    @staticmethod
+    def compact_requests():
+        enforce_retention()
+
+    @staticmethod
+    def archive_messages():
+        with MessagesStore() as store:
+            store.archive_all(get_time() - settings.messages_archive_age.get())
+
     def refresh_upnp(self, /, force: bool = False) -> None:
         """
         Update the UPnP port mapping on the router if appropriate.
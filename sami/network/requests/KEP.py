@@ -1,20 +1,46 @@
 from __future__ import annotations
 
+from concurrent import futures
+from typing import Iterable
+
 import pydantic
+from loguru import logger
 
-from ...cryptography.hashing import hash_object
+from ...cryptography.hashing import Digest, Sha256Hash, hash_object
 from ...cryptography.mix import EncryptedSymmetricKeyPart
-from ...cryptography.serialization import serialize_bytes
-from ...objects import Conversation, MasterNode, Node
+from ...cryptography.serialization import (
+    BinaryModel,
+    decode_bytes,
+    deserialize_string,
+    encode_string,
+    serialize_bytes,
+)
+from ...cryptography.service import CryptoService
+from ...cryptography.sessions import SessionKey, SessionKeys
+from ...cryptography.symmetric import SymmetricKeyPart
+from ...objects import Conversation, MasterNode, Node, is_private_key_loaded
 from ._base import RequestData
 
 
-class KEP(RequestData, pydantic.BaseModel):
+class KEP(BinaryModel, RequestData, pydantic.BaseModel):
     our_key_part: EncryptedSymmetricKeyPart
+    # Hash of the clear key part
     hash: str
-    sig: str
+    # Signature by the author of the KEPs encrypted asymmetrically,
+    # see `get_authenticated_hash`
+    sig: bytes = b""
     author: Node
     members: set[Node]
+    # Session keys, see `SessionKeys`. Either the key part is encrypted with
+    # the recipient's public key, along with a new session key of the
+    # author (`session_key`), or it is encrypted with an acknowledged
+    # session key (`session`), and authenticated by `mac` instead of `sig`.
+    # `ack` is the identifier of the latest session key the recipient
+    # sent the author.
+    session_key: bytes = b""
+    session: bytes = b""
+    mac: bytes = b""
+    ack: bytes = b""
 
     _full_name = "Keys Exchange Protocol"
     _to_store = True
@@ -23,48 +49,251 @@ class KEP(RequestData, pydantic.BaseModel):
     class Config:
         allow_mutation = False
 
-    @classmethod
-    @pydantic.validator("hash")
-    def _check_hash(cls, value: str, values: dict) -> str:
-        assert hash_object(values["our_key_part"]).hexdigest() == value, "Invalid hash"
-        return value
-
-    @classmethod
-    @pydantic.validator("sig")
-    def _check_sig(cls, sig: str, values: dict) -> str:
-        h = hash_object(values["our_key_part"])
+    @pydantic.root_validator(skip_on_failure=True)
+    def _check_sig(cls, values: dict) -> dict:
+        """
+        KEPs encrypted with a session key are authenticated by their MAC,
+        which only the recipient can check, in `to_clear_async`.
+        """
+        if values["session"]:
+            return values
         assert values["author"].public_key.is_signature_valid(
-            h, sig
+            cls._get_signed_hash(**values), values["sig"]
         ), "Invalid signature"
-        return sig
+        return values
+
+    @staticmethod
+    def get_authenticated_hash(
+        hash: str,
+        members: set[Node],
+        session_key: bytes,
+        session: bytes,
+        ack: bytes,
+        **_,
+    ) -> Sha256Hash:
+        """
+        Hash the author signs, or authenticates with the session key.
+        It covers the key part, through the hash of its clear value, the
+        conversation it is for, and the session fields, so that none of them
+        can be altered.
+        """
+        return hash_object(
+            [
+                hash,
+                Conversation.get_id_from_members(members),
+                session_key,
+                session,
+                ack,
+            ]
+        )
 
     @classmethod
-    def new(cls, conversation: Conversation, recipient: Node) -> KEP:
-        master_node = MasterNode()
+    def _get_signed_hash(cls, **fields) -> Sha256Hash | Digest:
+        """
+        Older versions don't send session keys, and only sign the hash
+        of the key part.
+        """
+        if not fields["session_key"]:
+            return Digest.from_hex(fields["hash"])
+        return cls.get_authenticated_hash(**fields)
 
-        our_key_part = [
-            key for key in conversation.key if key.author.id == master_node.id
-        ][0]
+    @classmethod
+    def new(cls, conversation: Conversation, recipient: Node) -> KEP:
+        return cls.new_many([(conversation, recipient)])[0]
 
-        key_part_value_str = serialize_bytes(our_key_part.value)
-        se_en_value = recipient.public_key.encrypt_asymmetric(key_part_value_str)
-        h_obj = hash_object(key_part_value_str)
-        h_str = h_obj.hexdigest()
-        se_sig = master_node.private_key.get_signature(h_obj)
+    @classmethod
+    def new_many(cls, to_send: Iterable[tuple[Conversation, Node]]) -> list[KEP]:
+        """
+        Creates the KEPs for a batch of conversations and recipients.
 
+        Key parts are encrypted with the session key we share with the
+        recipient if it acknowledged one. Otherwise, they are encrypted with
+        its public key, along with a session key, and signed. These
+        encryptions are submitted at once to the `CryptoService`, then the
+        signatures, which cover the encrypted session keys.
+        """
+        master_node = MasterNode()
         own_node = Node(
             public_key=master_node.public_key,
             sig=master_node.sig,
             pattern=master_node.pattern,
         )
 
-        return cls(
-            our_key_part=EncryptedSymmetricKeyPart(
-                value=se_en_value,
+        keps = []
+        pending = []
+        with CryptoService() as crypto, SessionKeys() as sessions:
+            for conversation, recipient in to_send:
+                our_key_part = [
+                    key for key in conversation.key if key.author.id == master_node.id
+                ][0]
+                # Older versions expect the key part in base64
+                key_part_value_str = serialize_bytes(our_key_part.value)
+                h_str = hash_object(key_part_value_str).hexdigest()
+                ack = sessions.get_acknowledgement(recipient.id)
+                session = sessions.get_outgoing(recipient.id)
+                if session is not None:
+                    authenticated = cls.get_authenticated_hash(
+                        h_str, conversation.members, b"", session.identifier, ack
+                    )
+                    keps.append(
+                        cls(
+                            our_key_part=EncryptedSymmetricKeyPart(
+                                value=session.encrypt(
+                                    encode_string(key_part_value_str)
+                                ),
+                                author=own_node,
+                            ),
+                            hash=h_str,
+                            author=own_node,
+                            members=conversation.members,
+                            session=session.identifier,
+                            mac=session.get_mac(authenticated.digest()),
+                            ack=ack,
+                        )
+                    )
+                    continue
+                session = sessions.get_pending(recipient.id)
+                pending.append(
+                    (
+                        conversation,
+                        h_str,
+                        ack,
+                        crypto.encrypt(
+                            recipient.public_key, encode_string(key_part_value_str)
+                        ),
+                        crypto.encrypt(recipient.public_key, session.value),
+                    )
+                )
+            # The encrypted session keys are signed,
+            # so they must be encrypted first
+            to_sign = []
+            for conversation, h_str, ack, en_value, en_session_key in pending:
+                session_key = en_session_key.result()
+                authenticated = cls.get_authenticated_hash(
+                    h_str, conversation.members, session_key, b"", ack
+                )
+                to_sign.append(
+                    (conversation, h_str, ack, en_value, session_key, authenticated)
+                )
+            signatures = crypto.sign_many(
+                master_node.private_key, (signed for *_, signed in to_sign)
+            )
+
+        keps.extend(
+            cls(
+                our_key_part=EncryptedSymmetricKeyPart(
+                    value=en_value.result(),
+                    author=own_node,
+                ),
+                hash=h_str,
+                sig=signatures[signed.digest()].result(),
                 author=own_node,
-            ),
-            hash=h_str,
-            sig=se_sig,
-            author=own_node,
-            members=conversation.members,
+                members=conversation.members,
+                session_key=session_key,
+                ack=ack,
+            )
+            for conversation, h_str, ack, en_value, session_key, signed in to_sign
+        )
+        return keps
+
+    def to_clear_async(self) -> futures.Future[SymmetricKeyPart | None]:
+        """
+        Decrypts our key part, if this KEP is addressed to us.
+        The result is None otherwise, or if it could not be authenticated.
+        Only once it is, the session key the author sent is registered,
+        and its acknowledgement processed.
+        """
+        if not self.session:
+            return self._to_clear_asymmetric()
+        future = futures.Future()
+        with SessionKeys() as sessions:
+            session = sessions.get_incoming(self.session, self.author.id)
+        future.set_result(
+            None if session is None else self._to_clear_with_session(session)
+        )
+        return future
+
+    def _is_hash_valid(self, key_part_value_str: str) -> bool:
+        return hash_object(key_part_value_str).hexdigest() == self.hash
+
+    def _to_clear_with_session(self, session: SessionKey) -> SymmetricKeyPart | None:
+        try:
+            key_part_value_str = decode_bytes(session.decrypt(self.our_key_part.value))
+        except ValueError:
+            return
+        authenticated = self.get_authenticated_hash(**dict(self))
+        if not self._is_hash_valid(key_part_value_str) or not session.is_mac_valid(
+            authenticated.digest(), self.mac
+        ):
+            logger.warning(f"Could not authenticate a KEP of {self.author.id}")
+            return
+        self._acknowledge()
+        return SymmetricKeyPart(
+            value=deserialize_string(key_part_value_str),
+            author=self.our_key_part.author,
         )
+
+    def _to_clear_asymmetric(self) -> futures.Future[SymmetricKeyPart | None]:
+        """
+        Once our key part is decrypted, the signature is checked,
+        then the session key is decrypted.
+        """
+        future = futures.Future()
+        key_part = self.our_key_part.to_clear_async()
+
+        def _register_session(decrypted: futures.Future[bytes | None]) -> None:
+            try:
+                value = decrypted.result()
+                if value is not None:
+                    with SessionKeys() as sessions:
+                        sessions.add_incoming(self.author.id, value)
+            except Exception:
+                logger.exception("Could not register a session key")
+            future.set_result(key_part.result())
+
+        def _verified(valid: futures.Future[bool]) -> None:
+            try:
+                if not valid.result():
+                    logger.warning(f"Invalid signature on a KEP of {self.author.id}")
+                    future.set_result(None)
+                    return
+            except BaseException as e:
+                future.set_exception(e)
+                return
+            self._acknowledge()
+            if not self.session_key or not is_private_key_loaded():
+                # Older versions don't send session keys
+                future.set_result(key_part.result())
+                return
+            with CryptoService() as crypto:
+                crypto.decrypt(
+                    MasterNode().private_key, self.session_key
+                ).add_done_callback(_register_session)
+
+        def _decrypted(_) -> None:
+            try:
+                clear = key_part.result()
+                if clear is None or not self._is_hash_valid(
+                    serialize_bytes(clear.value)
+                ):
+                    future.set_result(None)
+                    return
+            except BaseException as e:
+                future.set_exception(e)
+                return
+            with CryptoService() as crypto:
+                crypto.verify(
+                    self.author.public_key,
+                    self._get_signed_hash(**dict(self)),
+                    self.sig,
+                ).add_done_callback(_verified)
+
+        key_part.add_done_callback(_decrypted)
+        return future
+
+    def _acknowledge(self) -> None:
+        """
+        Must only be called once this KEP is authenticated.
+        """
+        with SessionKeys() as sessions:
+            sessions.acknowledge(self.author.id, self.ack)
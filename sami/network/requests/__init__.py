@@ -1,5 +1,11 @@
 from ._handle import RequestsHandler
 from ._request import WUP_REP, Request, all_data_types
+from ._retention import (
+    RetentionPolicy,
+    RetentionReport,
+    enforce_retention,
+    get_retention_policy,
+)
 from .BCP import BCP
 from .CEP import CEP_INI, CEP_REP
 from .CSP import CSP
@@ -23,5 +29,9 @@ __all__ = [
     WUP_REP,
     Request,
     RequestsHandler,
+    RetentionPolicy,
+    RetentionReport,
     all_data_types,
+    enforce_retention,
+    get_retention_policy,
 ]
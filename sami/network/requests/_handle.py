@@ -1,6 +1,10 @@
+from collections import OrderedDict
+from threading import Lock
+
 import pydantic
 from loguru import logger
 
+from ...config import settings
 from ...network import Network, Networks
 from ...network.requests import (
     BCP,
@@ -18,6 +22,7 @@ from ...network.requests import (
 )
 from ...objects import Contact, Conversation, MasterNode, Node
 from .._queue import handle_queue, send_queue
+from ._retention import get_retention_policy
 
 
 class ToBroadcast(pydantic.BaseModel):
@@ -38,6 +43,33 @@ ToDo = ToBroadcast | ToSend | ToHandle
 ToProcess = ToDo | list[ToDo] | None
 
 
+class _SeenRequests:
+
+    """
+    Identifiers of the requests we handled without storing them (e.g. BCP),
+    so that `Request.is_known` can't tell us they were replayed.
+    Up to `settings.seen_requests_cache_size` are kept, the oldest ones
+    being dropped.
+    """
+
+    def __init__(self):
+        self._ids: OrderedDict[int, None] = OrderedDict()
+        self._lock = Lock()
+
+    def add(self, identifier: int) -> bool:
+        """
+        Returns False if we saw this request already.
+        """
+        with self._lock:
+            if identifier in self._ids:
+                self._ids.move_to_end(identifier)
+                return False
+            self._ids[identifier] = None
+            while len(self._ids) > settings.seen_requests_cache_size.get():
+                self._ids.popitem(last=False)
+            return True
+
+
 class RequestsHandler:
 
     """
@@ -47,6 +79,7 @@ class RequestsHandler:
     """
 
     networks = Networks()
+    _seen = _SeenRequests()
 
     def __call__(self, raw_request: bytes, from_address: str) -> None:
         try:
@@ -63,8 +96,10 @@ class RequestsHandler:
         """
         if request.is_known():
             return
-        else:
+        elif get_retention_policy(request.status).should_store(request):
             request.upsert()
+        elif not self._seen.add(request.id):
+            return
 
         # Programmatically get the handler function, and call with the request
         result: ToProcess = self.__getattribute__(request.status.lower())(
@@ -85,7 +120,7 @@ class RequestsHandler:
     @staticmethod
     def wup_ini(data: WUP_INI, **_) -> ToProcess:
         contact = data.author
-        contact.upsert()
+        contact.seen()
 
         nic = Networks().get_corresponding_network(contact)
         if nic is None:
@@ -93,9 +128,11 @@ class RequestsHandler:
 
         req = Request.new(
             WUP_REP(
-                requests=Request.get_between(
-                    data.beginning,
-                    data.end,
+                requests=set(
+                    Request.get_between(
+                        data.beginning,
+                        data.end,
+                    )
                 ),
             )
         )
@@ -118,13 +155,14 @@ class RequestsHandler:
     @staticmethod
     def dnp(data: DNP, networks: Networks, **_) -> ToProcess:
         contact = data.author
-        contact.upsert()
+        contact.seen()
 
         nic = networks.get_corresponding_network(contact)
         if nic is None:
             return
 
-        req = Request.new(NPP(nodes=Node.all()))
+        nodes = Node.iter_all(limit=settings.max_shared_objects.get())
+        req = Request.new(NPP(nodes=set(nodes)))
 
         return ToSend(
             network=nic,
@@ -135,13 +173,14 @@ class RequestsHandler:
     @staticmethod
     def dcp(data: DCP, **_) -> ToProcess:
         contact = data.author
-        contact.upsert()
+        contact.seen()
 
         nic = Networks().get_corresponding_network(contact)
         if nic is None:
             return
 
-        req = Request.new(CSP(contacts=Contact.all()))
+        contacts = Contact.iter_all(limit=settings.max_shared_objects.get())
+        req = Request.new(CSP(contacts=set(contacts)))
 
         return ToSend(
             network=nic,
@@ -156,30 +195,26 @@ class RequestsHandler:
             # We don't know the conversation, so we'll just ignore it
             return
         conversation.messages.append(data.message)
-        conversation.upsert()
         return
 
     @staticmethod
     def npp(data: NPP, **_) -> ToProcess:
-        to_broadcast = []
+        to_exchange = []
+        known_ids = Node.known_ids(node.id for node in data.nodes)
         for node in data.nodes:
-            if node.is_known():
+            if node.id in known_ids:
                 continue
             node.upsert()
-            # Create a new conversation with just this node and ourselves
-            conversation = Conversation(members={node, MasterNode()})
+            # Create a conversation with just this node and ourselves,
+            # unless we already exchanged keys with it
+            conversation = Conversation.load_or_new(members={node, MasterNode()})
+            if conversation.has_complete_key():
+                continue
             conversation.upsert()
-            to_broadcast.append(
-                ToBroadcast(
-                    request=Request.new(
-                        KEP.new(
-                            conversation=conversation,
-                            recipient=node,
-                        )
-                    )
-                )
-            )
-        return to_broadcast
+            to_exchange.append((conversation, node))
+        return [
+            ToBroadcast(request=Request.new(kep)) for kep in KEP.new_many(to_exchange)
+        ]
 
     @staticmethod
     def kep(data: KEP, **_) -> ToProcess:
@@ -193,21 +228,16 @@ class RequestsHandler:
             )
         )
 
+        # The key part is decrypted while we create our own KEPs.
+        # It also registers the session key the author sent us, if any.
+        key_part = data.to_clear_async()
         conversation = Conversation.load_or_new(members=data.members)
-        conversation.add_key_part(data.our_key_part.to_clear())
+        keps = KEP.new_many((conversation, member) for member in conversation.members)
+        if (key_part := key_part.result()) is not None:
+            conversation.add_key_part(key_part)
         conversation.upsert()
 
-        for member in conversation.members:
-            to_process.append(
-                ToBroadcast(
-                    request=Request.new(
-                        KEP.new(
-                            conversation=conversation,
-                            recipient=member,
-                        )
-                    ),
-                )
-            )
+        to_process.extend(ToBroadcast(request=Request.new(kep)) for kep in keps)
 
         return to_process
 
@@ -219,17 +249,21 @@ class RequestsHandler:
 
     @staticmethod
     def cep_ini(data: CEP_INI, networks: Networks, **_) -> ToProcess:
+        data.author.seen()
         for contact in data.contacts:
             contact.upsert()
-        all_contacts = Contact.all()
-        contacts_to_share = all_contacts.difference(data.contacts)
+        contacts_to_share = Contact.find(
+            Contact.query()
+            .notin("id", {contact.id for contact in data.contacts})
+            .limit(settings.max_shared_objects.get())
+        )
         net = networks.get_corresponding_network(data.author)
         return ToSend(
             network=net,
             contact=data.author,
             request=Request.new(
                 CEP_REP(
-                    contacts=contacts_to_share,
+                    contacts=set(contacts_to_share),
                     author=net.contact,
                 )
             ),
@@ -2,13 +2,13 @@ from __future__ import annotations
 
 import pickle
 from functools import cached_property
-from typing import Any, Generic, TypeVar
+from typing import Any, Generator, Generic, TypeVar
 
 import pydantic
 
 from ...config import Identifier, settings
 from ...cryptography.hashing import hash_object
-from ...database import Database
+from ...database import Database, RequestsLog
 from ...objects import StoredSamiObject
 from ...utils import get_id, get_time
 from ._base import RequestData
@@ -60,6 +60,9 @@ _S = TypeVar("_S", *_data_type_names)  # noqa
 class Request(pydantic.BaseModel, StoredSamiObject, Generic[_R]):
     __table_name__ = "requests"
     __node_specific__ = False
+    __indexes__ = {
+        "status": lambda dbo: dbo["status"],
+    }
 
     status: _S
     data: _R
@@ -100,9 +103,57 @@ class Request(pydantic.BaseModel, StoredSamiObject, Generic[_R]):
         )
 
     @classmethod
-    def last_received(cls):
-        with Database() as db:
-            db.get_last(cls, key=lambda req: req.timestamp)
+    def from_id(cls, identifier: Identifier) -> Request | None:
+        if not settings.requests_log.get():
+            return super().from_id(identifier)
+        with RequestsLog() as log:
+            payload = log.get(identifier)
+        if payload is not None:
+            return cls.from_bytes(payload)
+
+    @classmethod
+    def get_last(cls) -> Request | None:
+        """
+        Returns the most recent request we stored.
+        """
+        if settings.requests_log.get():
+            with RequestsLog() as log:
+                payload = log.get_last()
+            if payload is not None:
+                return cls.from_bytes(payload)
+        else:
+            with Database() as db:
+                dbo = db.get_last(cls, key=lambda doc: doc["timestamp"])
+            if dbo is not None:
+                return cls.from_document(dbo)
+
+    @classmethod
+    def get_between(cls, beginning: int, end: int) -> Generator[Request, None, None]:
+        """
+        Iterates over the requests we stored whose timestamp is comprised
+        between `beginning` and `end`.
+        With the requests log, payloads are only parsed when consumed.
+        """
+        if settings.requests_log.get():
+            with RequestsLog() as log:
+                for _, payload in log.get_between(beginning, end):
+                    yield cls.from_bytes(payload)
+        else:
+            yield from cls.find(
+                cls.query().between("timestamp", beginning, end).order_by("timestamp")
+            )
+
+    def upsert(self) -> None:
+        if not settings.requests_log.get():
+            return super().upsert()
+        with RequestsLog() as log:
+            log.append(self.id, self.timestamp, self.status, self.to_bytes())
+
+    def is_known(self) -> bool:
+        if not settings.requests_log.get():
+            return super().is_known()
+        with RequestsLog() as log:
+            return log.contains(self.id)
 
     @cached_property
     def id(self) -> Identifier:
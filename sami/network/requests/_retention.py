@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import json
+from collections import defaultdict
+from dataclasses import dataclass
+
+from loguru import logger
+
+from ...config import Identifier, settings
+from ...database import Database, RequestsLog
+from ...utils import get_time
+from ._request import Request, _data_name_to_type
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+
+    """
+    Describes how long we keep the requests of a given type.
+
+    Parameters
+    ----------
+    store: bool
+        Whether to store this type of request at all.
+    max_age: int, optional
+        Number of seconds after which a request is removed.
+    keep_last: int, optional
+        Number of requests of this type we keep, the most recent first.
+    """
+
+    store: bool = True
+    max_age: int | None = None
+    keep_last: int | None = None
+
+    def is_expired(self, timestamp: int, now: int) -> bool:
+        return self.max_age is not None and timestamp < now - self.max_age
+
+    def should_store(self, request: Request) -> bool:
+        return self.store and not self.is_expired(request.timestamp, get_time())
+
+
+@dataclass
+class RetentionReport:
+    removed: int = 0
+    reclaimed_bytes: int = 0
+
+
+def get_retention_policy(status: str) -> RetentionPolicy:
+    """
+    Returns the retention policy of a type of request.
+    By default, requests are kept for `settings.max_request_lifespan` seconds,
+    except the ones which are not meant to be stored at all.
+    """
+    if (policy := settings.requests_retention.get().get(status)) is not None:
+        return policy
+    data_type = _data_name_to_type.get(status)
+    if data_type is None or not data_type._to_store:
+        return RetentionPolicy(store=False)
+    return RetentionPolicy(max_age=settings.max_request_lifespan.get())
+
+
+def _select_discarded(
+    requests: list[tuple[Identifier, str, int]], now: int
+) -> set[Identifier]:
+    """
+    Takes a list of (identifier, status, timestamp) and returns the
+    identifiers of the requests which should be removed.
+    """
+    by_status: dict[str, list[tuple[int, Identifier]]] = defaultdict(list)
+    for identifier, status, timestamp in requests:
+        by_status[status].append((timestamp, identifier))
+
+    discarded = set()
+    for status, entries in by_status.items():
+        policy = get_retention_policy(status)
+        if not policy.store:
+            discarded.update(identifier for _, identifier in entries)
+            continue
+        discarded.update(
+            identifier
+            for timestamp, identifier in entries
+            if policy.is_expired(timestamp, now)
+        )
+        if policy.keep_last is not None:
+            entries.sort(reverse=True)
+            discarded.update(
+                identifier for _, identifier in entries[policy.keep_last :]
+            )
+    return discarded
+
+
+def enforce_retention() -> RetentionReport:
+    """
+    Removes the stored requests which are not covered by their retention
+    policy anymore, and reports how much was removed.
+    """
+    now = get_time()
+    if settings.requests_log.get():
+        with RequestsLog() as log:
+            discarded = _select_discarded(
+                [
+                    (identifier, entry.status, entry.timestamp)
+                    for identifier, entry in log.entries()
+                ],
+                now,
+            )
+            result = log.compact(
+                discard=lambda identifier, _: identifier in discarded,
+            )
+        report = RetentionReport(
+            removed=result.removed,
+            reclaimed_bytes=result.reclaimed,
+        )
+    else:
+        with Database() as db:
+            sizes = {}
+            requests = []
+            for batch in db.iter_batches(Request, settings.database_batch_size.get()):
+                for dbo in batch:
+                    identifier = Identifier(dbo.doc_id)
+                    sizes[identifier] = len(json.dumps(dbo, default=str))
+                    requests.append((identifier, dbo["status"], dbo["timestamp"]))
+            discarded = _select_discarded(requests, now)
+            db.remove_many(Request, discarded)
+        report = RetentionReport(
+            removed=len(discarded),
+            reclaimed_bytes=sum(sizes[identifier] for identifier in discarded),
+        )
+
+    logger.info(
+        f"Retention: removed {report.removed} requests ({report.reclaimed_bytes} bytes)"
+    )
+    return report
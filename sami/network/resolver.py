@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import ipaddress as ip
+import time
+from concurrent import futures
+from dataclasses import dataclass
+from threading import Lock
+
+import dns.exception
+import dns.resolver
+from dns.name import Name as DNSName
+from loguru import logger
+
+from ..config import settings
+from ..design import Singleton
+from .utils import get_address_object
+
+
+@dataclass
+class _Entry:
+    # None if the name could not be resolved
+    address: ip.IPv4Address | ip.IPv6Address | None
+    expires: float
+    # Set while the name is being resolved
+    future: futures.Future | None = None
+
+
+class Resolver(Singleton):
+
+    """
+    Caches the resolution of DNS names, which is done in the background.
+
+    `resolve` never blocks: it returns what we know of the name, possibly
+    outdated, and schedules a resolution if needed.
+    Addresses are kept for the TTL of the DNS record, and failures for
+    `settings.dns_negative_ttl` seconds.
+    """
+
+    _entries: dict[DNSName, _Entry]
+    _lock: Lock
+    _executor: futures.ThreadPoolExecutor
+
+    def __enter__(self) -> Resolver:
+        return self
+
+    def __exit__(self, *_) -> None:
+        pass
+
+    def init(self):
+        self._entries = {}
+        self._lock = Lock()
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=settings.dns_workers.get(),
+            thread_name_prefix="Resolver",
+        )
+
+    def _get_entry(self, name: DNSName) -> _Entry:
+        """
+        Returns the entry of a name, and schedules its resolution if it has
+        expired. Must be called with the lock held.
+        """
+        entry = self._entries.get(name)
+        if entry is None:
+            entry = self._entries[name] = _Entry(address=None, expires=0)
+        if entry.expires <= time.monotonic() and entry.future is None:
+            entry.future = self._executor.submit(self._refresh, name)
+        return entry
+
+    def resolve(self, name: DNSName) -> ip.IPv4Address | ip.IPv6Address | None:
+        """
+        Returns the last address we resolved `name` to, even if it has
+        expired, in which case it is refreshed in the background.
+        Returns None if the name was never resolved, or could not be.
+        """
+        with self._lock:
+            return self._get_entry(name).address
+
+    def resolve_now(
+        self, name: DNSName, timeout: float | None = None
+    ) -> ip.IPv4Address | ip.IPv6Address | None:
+        """
+        Same as `resolve`, but if the name was never resolved, waits (at
+        most `timeout` seconds) for it to be.
+        """
+        with self._lock:
+            entry = self._get_entry(name)
+            future = entry.future if not entry.expires else None
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except futures.TimeoutError:
+                pass
+        return entry.address
+
+    def _refresh(self, name: DNSName) -> None:
+        address, ttl = self._query(name)
+        with self._lock:
+            entry = self._entries[name]
+            # On failure, we keep the address we had
+            if address is not None:
+                entry.address = address
+            entry.expires = time.monotonic() + ttl
+            entry.future = None
+
+    @staticmethod
+    def _query(name: DNSName) -> tuple[ip.IPv4Address | ip.IPv6Address | None, int]:
+        """
+        Resolves a name, and returns the address along with the number of
+        seconds it is valid for.
+        """
+        timeout = settings.dns_timeout.get()
+        for record_type in ("A", "AAAA"):
+            try:
+                answer = dns.resolver.resolve(name, record_type, lifetime=timeout)
+            except (dns.resolver.NoAnswer, dns.resolver.NXDOMAIN):
+                continue
+            except dns.exception.DNSException as e:
+                logger.warning(f"Could not resolve host {name!r}: {e!r}")
+                break
+            ttl = min(
+                max(answer.rrset.ttl, settings.dns_min_ttl.get()),
+                settings.dns_max_ttl.get(),
+            )
+            return get_address_object(answer[0].address), ttl
+        else:
+            logger.error(f"Could not resolve host {name!r}")
+        return None, settings.dns_negative_ttl.get()
@@ -2,12 +2,14 @@ from __future__ import annotations
 
 from abc import ABC, abstractmethod
 from functools import cached_property
+from itertools import islice
+from typing import Any, Callable, Generator, Iterable
 
 import pydantic
 from loguru import logger
 
-from ..config import Identifier
-from ..database import Database
+from ..config import Identifier, settings
+from ..database import Database, Query
 
 _T = type["_T"]
 
@@ -33,6 +35,10 @@ class StoredSamiObject(SamiObject, ABC):
 
     __table_name__: str
     __node_specific__: bool
+    # Maps index names to functions computing, from a database object,
+    # the value(s) it is indexed under. Indexed fields can be queried with
+    # `find` without scanning the table.
+    __indexes__: dict[str, Callable[[dict], Any]] = {}
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -40,22 +46,108 @@ class StoredSamiObject(SamiObject, ABC):
     @classmethod
     def all(cls) -> set[_T]:
         """
-        Queries the database and returns all the conversations.
+        Queries the database and returns all the objects.
+        Prefer `iter_all` on large tables.
+        """
+        return set(cls.iter_all())
+
+    @classmethod
+    def iter_all(
+        cls,
+        filters: dict[str, Any] | None = None,
+        batch_size: int | None = None,
+        limit: int | None = None,
+    ) -> Generator[_T, None, None]:
+        """
+        Lazily iterates over the objects stored in the database.
+        Documents are read by batches of `batch_size`, and only validated
+        when the iteration reaches them.
+
+        Parameters
+        ----------
+        filters: dict[str, Any], optional
+            Maps field names to the value they must be equal to.
+        batch_size: int, optional
+            Number of documents read at once.
+            Defaults to `settings.database_batch_size`.
+        limit: int, optional
+            Maximum number of objects to yield.
+        """
+        if batch_size is None:
+            batch_size = settings.database_batch_size.get()
+        invalid = []
+        try:
+            with Database() as db:
+                objects = (
+                    obj
+                    for batch in db.iter_batches(cls, batch_size, filters)
+                    for obj in cls._validate_documents(batch, invalid)
+                )
+                yield from islice(objects, limit)
+        finally:
+            # Invalid documents are removed once we are done reading the table
+            with Database() as db:
+                db.remove_many(cls, invalid)
+
+    @classmethod
+    def _validate_documents(
+        cls, dbos: list, invalid: list[Identifier]
+    ) -> Generator[_T, None, None]:
+        for dbo in dbos:
+            try:
+                yield cls.from_document(dbo)
+            except pydantic.ValidationError:
+                logger.error(
+                    f"Found invalid information in the database: {dbo!r}. Removed it. "
+                )
+                invalid.append(dbo.doc_id)
+
+    @classmethod
+    def from_document(cls, document: dict) -> _T:
+        """
+        Builds an object from the document returned by `to_document`.
+        """
+        return cls(**document)
+
+    def to_document(self) -> dict:
+        """
+        Returns the document under which this object is stored.
+        """
+        return self.dict()
+
+    @classmethod
+    def query(cls) -> Query:
+        """
+        Returns a new query on this type of object, to pass to `find`.
+        """
+        return Query(cls)
+
+    @classmethod
+    def find(cls, query: Query) -> Generator[_T, None, None]:
+        """
+        Executes a query in the database, and lazily yields the matching
+        objects. Only the matching documents are validated.
+
+        Examples
+        --------
+        >>> Conversation.find(Conversation.query().where(size=2).limit(10))
+        """
+        invalid = []
+        try:
+            with Database() as db:
+                dbos = db.find(query)
+            yield from cls._validate_documents(dbos, invalid)
+        finally:
+            with Database() as db:
+                db.remove_many(cls, invalid)
+
+    @classmethod
+    def known_ids(cls, identifiers: Iterable[Identifier]) -> set[Identifier]:
+        """
+        Returns, among the identifiers passed, the ones which are stored.
         """
         with Database() as db:
-            dbos = db.get_all(cls)
-
-            objects = set()
-            for dbo in dbos:
-                try:
-                    objects.update(cls(**dbo))
-                except pydantic.ValidationError:
-                    logger.error(
-                        f"Found invalid information in the database: {dbo!r}. "
-                        "Removed it. "
-                    )
-                    db.remove(dbo.doc_id)
-        return objects
+            return db.find_ids(cls.query().isin("id", identifiers))
 
     @classmethod
     def from_id(cls, identifier: Identifier) -> _T | None:
@@ -65,11 +157,11 @@ class StoredSamiObject(SamiObject, ABC):
                 # Document with specified ID does not exist.
                 return
             try:
-                return cls(**info)
+                return cls.from_document(info)
             except pydantic.ValidationError:
                 # If loading the information in the database returned an error,
                 # that probably means it was altered, so we'll just remove it.
-                db.remove(identifier)
+                db.remove(cls, identifier)
 
     def upsert(self) -> None:
         with Database() as db:
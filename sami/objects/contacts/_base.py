@@ -8,20 +8,34 @@ from functools import cached_property
 import dns
 import pydantic
 
-from ...config import Identifier
+from ...config import Identifier, settings
 from ...cryptography.hashing import hash_object
-from ...network.utils import host_dns_name
+from ...database import Database
+from ...design import IdentityMap
+from ...network.resolver import Resolver
 from ...objects import StoredSamiObject
-from ...utils import get_id
+from ...utils import get_id, get_time
 
 logger = _logging.getLogger("objects")
 
+# Number of seconds under which we don't store a new `last_seen`,
+# so that a broadcast doesn't rewrite every contact we send it to
+_LAST_SEEN_RESOLUTION = 5 * 60
+# When we store too many contacts, we remove enough of them to go below
+# this fraction of the maximum, so that evictions are not done on each insert
+_EVICTION_TARGET = 0.9
+
+# Contacts are shared in batches, and the same ones are often sent again
+_contacts: IdentityMap[Identifier, Contact] = IdentityMap()
+
 
 class Contact(StoredSamiObject):
-    # TODO: add last_seen
+    # Allows registering instances in `_contacts`
+    __slots__ = ("__weakref__",)
 
     __table_name__ = "contacts"
     __node_specific__ = False
+    __indexes__ = {"last_seen": lambda dbo: dbo.get("last_seen", 0)}
 
     address: (
         ip.IPv4Address
@@ -31,23 +45,112 @@ class Contact(StoredSamiObject):
         | dns.name.Name
     )
     port: pydantic.conint(ge=1, le=65535, strict=True)
+    # Last time we interacted directly with this contact,
+    # 0 if we only heard of it from other clients
+    last_seen: pydantic.conint(ge=0) = 0
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self._original_address = deepcopy(self.address)
         self.update_address()
 
-    def update_address(self) -> None:
+    @classmethod
+    def validate(cls, value) -> Contact:
+        """
+        Called by pydantic when validating a field of this type, that is,
+        of a request.
+        Returns the instance we already have for this contact, if any.
+        Otherwise, as the `last_seen` we are sent is the one of another
+        node, it is reset.
+        Subclasses (e.g. `Beacon`) are left as is.
         """
-        Updates the address by resolving the DNS name again.
+        contact = super().validate(value)
+        if type(contact) is not Contact:
+            return contact
+
+        def from_peer() -> Contact:
+            contact.last_seen = 0
+            return contact
+
+        return _contacts.intern(contact.id, from_peer)
+
+    def update_address(self, wait: bool = False) -> None:
+        """
+        Updates the address with the last resolution of the DNS name.
+        Doesn't block unless `wait` is True, in which case we wait for the
+        name to be resolved if it never was.
+        If the name is not resolved, the address stays the DNS name.
         If the Contact is not stored as a DNS name, does nothing
         (uses the same address).
         """
         if isinstance(self._original_address, dns.name.Name):
-            self.address = host_dns_name(self._original_address)
+            with Resolver() as resolver:
+                if wait:
+                    address = resolver.resolve_now(
+                        self._original_address, timeout=settings.dns_timeout.get()
+                    )
+                else:
+                    address = resolver.resolve(self._original_address)
+            self.address = self._original_address if address is None else address
         else:
             self.address = self._original_address
 
+    @property
+    def is_resolved(self) -> bool:
+        return not isinstance(self.address, dns.name.Name)
+
     @cached_property
     def id(self) -> Identifier:
         return get_id(hash_object([self._original_address, self.port]))
+
+    def seen(self) -> None:
+        """
+        Records that we just interacted with this contact.
+        """
+        now = get_time()
+        with Database() as db:
+            stored = db.get_by_id(self, self.id)
+        if (
+            stored is not None
+            and now - stored.get("last_seen", 0) < _LAST_SEEN_RESOLUTION
+        ):
+            return
+        self.last_seen = now
+        self.upsert()
+
+    def upsert(self) -> None:
+        """
+        Stores the contact, keeping the most recent `last_seen` we know of.
+        If we then know more than `settings.max_contacts`, the ones we
+        haven't seen for the longest time are removed.
+        """
+        with Database() as db:
+            stored = db.get_by_id(self, self.id)
+            if stored is not None and stored.get("last_seen", 0) > self.last_seen:
+                self.last_seen = stored["last_seen"]
+            # Don't trust a date in the future we could have been sent
+            self.last_seen = min(self.last_seen, get_time())
+            db.upsert(self)
+        if stored is None:
+            self.evict()
+
+    @classmethod
+    def evict(cls) -> int:
+        """
+        Removes the least recently seen contacts if we know more than
+        `settings.max_contacts`. Beacons are never removed.
+        Returns the number of contacts removed.
+        """
+        max_contacts = settings.max_contacts.get()
+        with Database() as db:
+            count = db.count(cls)
+            if count <= max_contacts:
+                return 0
+            to_remove = count - int(max_contacts * _EVICTION_TARGET)
+            beacons = {beacon.id for beacon in settings.beacons.get()}
+            evicted = db.find_ids(
+                cls.query().notin("id", beacons).order_by("last_seen").limit(to_remove)
+            )
+            db.remove_many(cls, evicted)
+        logger.info(f"Evicted {len(evicted)} contacts")
+        return len(evicted)
@@ -2,11 +2,14 @@ from __future__ import annotations
 
 from ...config import Setting, settings
 from ...network.utils import get_address_object
+from ...utils import get_time
 from ._base import Contact
 
 
 class Beacon(Contact):
-    pass
+    def seen(self) -> None:
+        # Beacons are part of the settings, so we don't store them
+        self.last_seen = get_time()
 
 
 settings.beacons = Setting(
@@ -1,7 +1,11 @@
 from __future__ import annotations
 
+import sys
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from functools import cached_property
-from typing import Generator
+from threading import Lock
+from typing import Generator, Iterable
 
 import pydantic
 from Crypto.Random import get_random_bytes
@@ -10,11 +14,15 @@ from loguru import logger
 from ...config import Identifier, settings
 from ...cryptography.hashing import hash_object
 from ...cryptography.symmetric import (
+    AEAD_ENGINES,
     DecryptionKey,
+    EncryptionKey,
     SymmetricKey,
     SymmetricKeyPart,
     get_expected_key_length,
 )
+from ...database import Database, MessageRecord, MessagesStore
+from ...design import Singleton
 from ...objects import (
     ClearMessage,
     EncryptedMessage,
@@ -24,27 +32,255 @@ from ...objects import (
 )
 from ...utils import get_id
 
+# Approximate memory used by a decrypted message, besides its content,
+# in bytes. Its author is shared with the other messages.
+_MESSAGE_OVERHEAD = 400
 
-class _ClearMessagesProxy:
+
+class _Messages:
 
     """
-    Interact with a clear-text version of the messages
+    Lazy, append-only view over the encrypted messages of a conversation.
+    Messages are only read from the storage when iterated over.
     """
 
-    def __iter__(self):
-        return next(self)
+    def __init__(self, conversation_id: Identifier):
+        self.conversation_id = conversation_id
+
+    def __iter__(self) -> Generator[EncryptedMessage, None, None]:
+        with MessagesStore() as store:
+            for record in store.iter(self.conversation_id):
+                yield EncryptedMessage.parse_raw(record.payload)
+
+    def __len__(self) -> int:
+        with MessagesStore() as store:
+            return store.count(self.conversation_id)
+
+    def append(self, message: EncryptedMessage) -> None:
+        with MessagesStore() as store:
+            store.append(
+                self.conversation_id,
+                MessageRecord(
+                    time=message.time_received,
+                    identifier=message.id,
+                    payload=message.json(),
+                ),
+            )
+
+    def get_last(self) -> EncryptedMessage | None:
+        with MessagesStore() as store:
+            record = store.get_last(self.conversation_id)
+        if record is not None:
+            return EncryptedMessage.parse_raw(record.payload)
+
+
+@dataclass
+class _ClearMessages:
+    messages: list[ClearMessage] = field(default_factory=list)
+    # Number of messages of the conversation read so far
+    read: int = 0
+    # Identifier of the last message read
+    last_id: Identifier | None = None
+    # Estimation of the memory used by the messages, in bytes
+    size: int = 0
+
+
+class _ClearMessagesCache(Singleton):
 
-    def __next__(self) -> Generator[ClearMessage, None, None]:
-        for enc_message in self._enc_messages:
-            yield enc_message.decrypt(self._key)
-        raise StopIteration
+    """
+    Keeps in memory the messages of the conversations read recently,
+    once decrypted, so that each message is only decrypted once.
+    They are never written anywhere.
+
+    The memory used is bounded by `settings.clear_messages_cache_size`:
+    past it, the least recently read conversations are dropped.
+    """
+
+    _entries: OrderedDict[Identifier, _ClearMessages]
+    _size: int
+    _lock: Lock
+
+    def __enter__(self) -> _ClearMessagesCache:
+        return self
+
+    def __exit__(self, *_) -> None:
+        pass
+
+    def init(self):
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+
+    def get(self, conversation_id: Identifier) -> tuple[int, list[ClearMessage]]:
+        """
+        Returns the number of messages of the conversation read so far,
+        and a copy of the cached messages.
+        """
+        with self._lock:
+            entry = self._entries.setdefault(conversation_id, _ClearMessages())
+            self._entries.move_to_end(conversation_id)
+            return entry.read, list(entry.messages)
 
-    def __init__(self, key: DecryptionKey, enc_messages: list[EncryptedMessage]):
+    def get_last(
+        self, conversation_id: Identifier, identifier: Identifier
+    ) -> ClearMessage | None:
+        """
+        Returns the last message of a conversation if it is cached,
+        and its identifier is `identifier`.
+        """
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is not None and entry.last_id == identifier:
+                return entry.messages[-1]
+
+    def get_window(
+        self, conversation_id: Identifier, start: int, stop: int
+    ) -> list[ClearMessage] | None:
+        """
+        Returns the messages from position `start` to `stop` (excluded)
+        if they are all cached, None otherwise.
+        """
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is not None and stop <= entry.read:
+                return entry.messages[start:stop]
+
+    def extend(
+        self,
+        conversation_id: Identifier,
+        read: int,
+        records: list[MessageRecord],
+        messages: list[ClearMessage],
+    ) -> None:
+        """
+        Adds the messages decrypted after the first `read` ones.
+        A conversation which doesn't fit in the cache is not cached, as it
+        would evict every other one, then itself.
+        """
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None or entry.read != read:
+                # Dropped, or another thread got there first
+                return
+            size = sum(
+                sys.getsizeof(message.content) + _MESSAGE_OVERHEAD
+                for message in messages
+            )
+            if entry.size + size > settings.clear_messages_cache_size.get():
+                del self._entries[conversation_id]
+                self._size -= entry.size
+                return
+            entry.messages.extend(messages)
+            entry.read += len(records)
+            entry.last_id = records[-1].identifier
+            entry.size += size
+            self._size += size
+            while self._size > settings.clear_messages_cache_size.get():
+                _, dropped = self._entries.popitem(last=False)
+                self._size -= dropped.size
+
+
+class _ClearMessagesProxy:
+
+    """
+    Interact with a clear-text version of the messages.
+    Messages are decrypted once, and then kept in `_ClearMessagesCache`.
+    """
+
+    def __iter__(self) -> Generator[ClearMessage, None, None]:
+        yield from self._load()
+
+    def __init__(self, key: DecryptionKey, enc_messages: _Messages):
         self._key = key
         self._enc_messages = enc_messages
 
-    def get_last(self) -> ClearMessage:
-        return self._enc_messages[-1].decrypt(self._key)
+    def _decrypt(self, record: MessageRecord) -> ClearMessage:
+        return EncryptedMessage.parse_raw(record.payload).decrypt(self._key)
+
+    def _decrypt_many(self, records: list[MessageRecord]) -> list[ClearMessage]:
+        """
+        Decrypts the messages of `records` as a batch.
+        Raises the error of the first message we cannot decrypt.
+        """
+        results = EncryptedMessage.decrypt_many(
+            [EncryptedMessage.parse_raw(record.payload) for record in records],
+            self._key,
+        )
+        for result in results:
+            if result.error is not None:
+                raise result.error
+        return [result.value for result in results]
+
+    def _load(self) -> list[ClearMessage]:
+        """
+        Decrypts the messages we haven't read yet, and returns all of them.
+        """
+        conversation_id = self._enc_messages.conversation_id
+        with _ClearMessagesCache() as cache:
+            read, cached = cache.get(conversation_id)
+            with MessagesStore() as store:
+                records = list(store.iter(conversation_id, start=read))
+            if not records:
+                return cached
+            messages = self._decrypt_many(records)
+            cache.extend(conversation_id, read, records, messages)
+        return cached + messages
+
+    def get_last(self) -> ClearMessage | None:
+        conversation_id = self._enc_messages.conversation_id
+        with MessagesStore() as store:
+            record = store.get_last(conversation_id)
+        if record is None:
+            return
+        with _ClearMessagesCache() as cache:
+            last = cache.get_last(conversation_id, record.identifier)
+        if last is None:
+            last = self._decrypt(record)
+        return last
+
+    def __len__(self) -> int:
+        return len(self._enc_messages)
+
+    def get_window(self, start: int, stop: int) -> list[ClearMessage]:
+        """
+        Returns the messages from position `start` to `stop` (excluded),
+        the oldest message being at position 0.
+        Only these messages are read, and decrypted if they are not cached.
+        """
+        conversation_id = self._enc_messages.conversation_id
+        with _ClearMessagesCache() as cache:
+            messages = cache.get_window(conversation_id, start, stop)
+        if messages is None:
+            with MessagesStore() as store:
+                records = store.read(conversation_id, start, stop)
+            messages = self._decrypt_many(records)
+        return messages
+
+    def get_page(self, size: int, before: int | None = None) -> list[ClearMessage]:
+        """
+        Returns the `size` messages preceding position `before`,
+        by default the most recent ones.
+
+        Examples
+        --------
+        >>> messages = conversation.clear_messages
+        >>> latest = messages.get_page(50)
+        >>> older = messages.get_page(50, before=len(messages) - len(latest))
+        """
+        if before is None:
+            before = len(self)
+        return self.get_window(max(before - size, 0), before)
+
+    def get_between(self, beginning: int, end: int) -> list[ClearMessage]:
+        """
+        Returns the messages received between `beginning` and `end`
+        (inclusive).
+        """
+        conversation_id = self._enc_messages.conversation_id
+        with MessagesStore() as store:
+            start = store.bisect_time(conversation_id, beginning)
+            stop = store.bisect_time(conversation_id, end + 1)
+        return self.get_window(start, stop)
 
 
 class Conversation(StoredSamiObject):
@@ -54,7 +290,6 @@ class Conversation(StoredSamiObject):
     Examples
     --------
     >>> conv = Conversation(
-    >>>     messages=[],
     >>>     members={Node(...), MasterNode(...)},
     >>>     value={SymmetricKeyPart(...)},
     >>> )
@@ -66,10 +301,23 @@ class Conversation(StoredSamiObject):
 
     __table_name__ = "conversations"
     __node_specific__ = True
+    __indexes__ = {
+        "size": lambda dbo: len(dbo["members"]),
+        "members": lambda dbo: [
+            Node.get_id_from_document(member) for member in dbo["members"]
+        ],
+    }
 
-    messages: list[EncryptedMessage] = []
     members: pydantic.conset(Node, min_items=2, max_items=settings.aes_key_length)
     key: SymmetricKey | set[SymmetricKeyPart] = {}
+    # Engine our messages are encrypted with, see `settings.aead_engine`.
+    # Each message records its engine, so members can use different ones.
+    aead: str = pydantic.Field(default_factory=lambda: settings.aead_engine.get())
+
+    @pydantic.validator("aead")
+    def _check_aead(cls, aead: str) -> str:
+        assert aead in AEAD_ENGINES, f"Unknown AEAD engine {aead!r}"
+        return aead
 
     @classmethod
     @pydantic.validator("value", each_item=True)
@@ -119,18 +367,42 @@ class Conversation(StoredSamiObject):
 
     @classmethod
     def load_or_new(cls, members: set[Node]) -> Conversation:
-        temp_conv = Conversation(members=members)
-        if temp_conv.is_known():
-            conv = cls.from_id(temp_conv.id)
-            if not isinstance(conv, cls):
-                # Failed to create a valid Conversation from the values in
-                # the database.
-                # FIXME: repair database
-                conv = temp_conv
-        else:
-            conv = temp_conv
+        """
+        Returns the conversation we stored with these members, or a new one.
+        It is looked up with the members index, among the conversations of
+        one of the members other than us, which are few.
+        """
+        with MasterNode() as master_node:
+            member = min(members, key=lambda node: node.id == master_node.id)
+        member_ids = {node.id for node in members}
+        for conv in cls.of_member(member, size=len(members)):
+            if {node.id for node in conv.members} == member_ids:
+                return conv
+        # Either we don't know this conversation, or we failed to create
+        # a valid Conversation from the values in the database.
+        # FIXME: repair database
+        return cls(members=members)
+
+    @classmethod
+    def of_member(
+        cls, node: Node, size: int | None = None
+    ) -> Generator[Conversation, None, None]:
+        """
+        Iterates over the conversations `node` is a member of, optionally
+        only the ones with `size` members.
+        """
+        query = cls.query().where(members=node.id)
+        if size is not None:
+            query.where(size=size)
+        return cls.find(query)
 
-        return conv
+    @classmethod
+    def count_by_size(cls) -> dict[int, int]:
+        """
+        Returns the number of conversations for each number of members.
+        """
+        with Database() as db:
+            return db.count_by(cls, "size")
 
     def has_complete_key(self) -> bool:
         return isinstance(self.key, SymmetricKey)
@@ -147,15 +419,40 @@ class Conversation(StoredSamiObject):
             if isinstance(sym_key, SymmetricKey):
                 self.key = sym_key
 
+    @property
+    def messages(self) -> _Messages:
+        """
+        The encrypted messages of this conversation.
+        They are stored apart from the conversation itself, in an append-only
+        log, so adding a message does not rewrite the whole history.
+        """
+        return _Messages(self.id)
+
     @property
     def clear_messages(self) -> _ClearMessagesProxy | None:
         if self.has_complete_key():
             return _ClearMessagesProxy(DecryptionKey.from_key(self.key), self.messages)
 
+    @property
+    def encryption_key(self) -> EncryptionKey | None:
+        """
+        The key our messages are encrypted with, if the key of the
+        conversation is complete.
+        """
+        if self.has_complete_key():
+            return EncryptionKey.from_key(self.key, self.aead)
+
+    @classmethod
+    def get_id_from_members(cls, members: Iterable[Node]) -> Identifier:
+        return cls.get_id_from_member_ids(node.id for node in members)
+
+    @staticmethod
+    def get_id_from_member_ids(member_ids: Iterable[Identifier]) -> Identifier:
+        return get_id(hash_object(sorted(member_ids)))
+
     @cached_property
     def id(self) -> Identifier:
         """
         Note: the identifier of a conversation is computed from its members.
         """
-        sorted_members = sorted(node.id for node in self.members)
-        return get_id(hash_object(sorted_members))
+        return self.get_id_from_members(self.members)
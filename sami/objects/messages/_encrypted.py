@@ -1,13 +1,16 @@
 from __future__ import annotations
 
+from concurrent import futures
 from functools import cached_property
+from typing import Sequence
 
 import pydantic
 from pydantic import BaseModel
 
 from ...config import Identifier, settings
 from ...cryptography.hashing import hash_object
-from ...cryptography.symmetric import DecryptionKey
+from ...cryptography.serialization import BinaryModel, serialize_bytes
+from ...cryptography.symmetric import AEAD_ENGINES, BatchResult, DecryptionKey
 from ...utils import get_id
 from .._base import SamiObject
 from ..nodes import Node
@@ -15,7 +18,9 @@ from ._base import ReadOnlyMessage
 from ._clear import ClearMessage
 
 
-class EncryptedMessage(BaseModel, ReadOnlyMessage, pydantic.BaseModel, SamiObject):
+class EncryptedMessage(
+    BinaryModel, BaseModel, ReadOnlyMessage, pydantic.BaseModel, SamiObject
+):
     """
     This is the final state of a message.
     It is encrypted, and ready for storage / transmission.
@@ -24,15 +29,58 @@ class EncryptedMessage(BaseModel, ReadOnlyMessage, pydantic.BaseModel, SamiObjec
     """
 
     author: Node
-    content: str
-    digest: str
+    content: bytes
+    digest: bytes
     time_sent: pydantic.conint(gt=settings.sami_start)
     time_received: pydantic.conint(gt=settings.sami_start)
+    # Messages of older clients have neither, and are encrypted with EAX
+    nonce: bytes = b""
+    aead: str = "eax"
+
+    @pydantic.validator("aead")
+    def _check_aead(cls, aead: str) -> str:
+        assert aead in AEAD_ENGINES, f"Unknown AEAD engine {aead!r}"
+        return aead
 
     def decrypt(self, key: DecryptionKey) -> ClearMessage:
+        return self._to_clear(
+            key.decrypt_raw(self.content, self.digest, self.nonce, self.aead)
+        )
+
+    @staticmethod
+    def decrypt_many(
+        messages: Sequence[EncryptedMessage],
+        key: DecryptionKey,
+        executor: futures.Executor | None = None,
+    ) -> list[BatchResult]:
+        """
+        Decrypts messages with `DecryptionKey.decrypt_many`.
+        Returns, in order, a result per message, whose value is the
+        `ClearMessage`, or whose error is the one raised decrypting the
+        message or building it.
+        """
+        results = key.decrypt_many(
+            [
+                (message.content, message.digest, message.nonce, message.aead)
+                for message in messages
+            ],
+            executor=executor,
+        )
+        return [
+            result if result.error is not None else message._to_clear_result(result)
+            for message, result in zip(messages, results)
+        ]
+
+    def _to_clear_result(self, decrypted: BatchResult) -> BatchResult:
+        try:
+            return BatchResult(self._to_clear(decrypted.value))
+        except Exception as e:
+            return BatchResult(error=e)
+
+    def _to_clear(self, content: str) -> ClearMessage:
         return ClearMessage(
             author=self.author,
-            content=key.decrypt_raw(self.content, self.digest),
+            content=content,
             time_sent=self.time_sent,
             time_received=self.time_received,
         )
@@ -44,4 +92,6 @@ class EncryptedMessage(BaseModel, ReadOnlyMessage, pydantic.BaseModel, SamiObjec
         We use the time sent because it is a constant set by the author,
         and the digest because it is essentially a signature of the value.
         """
-        return get_id(hash_object([self.time_sent, self.digest]))
+        # The digest is hashed in its base64 form, which it used to be held
+        # in, so that identifiers do not change
+        return get_id(hash_object([self.time_sent, serialize_bytes(self.digest)]))
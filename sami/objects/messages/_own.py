@@ -23,11 +23,13 @@ class OwnMessage(EditableMessage, pydantic.BaseModel):
     content: str = ""
 
     def encrypt(self, key: EncryptionKey) -> EncryptedMessage:
-        se_en_data, se_tag = key.encrypt_raw(self.content)
+        en_data, tag, nonce = key.encrypt_raw(self.content)
         return EncryptedMessage(
             author=self.author,
-            content=se_en_data,
-            digest=se_tag,
+            content=en_data,
+            digest=tag,
+            nonce=nonce,
+            aead=key.aead,
             time_sent=get_time(),  # FIXME
             time_received=get_time(),  # FIXME
         )
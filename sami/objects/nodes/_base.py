@@ -5,8 +5,15 @@ import random
 from functools import cached_property
 from pathlib import Path
 
+import pydantic
+
 from ...config import Identifier
-from ...cryptography.asymmetric import PublicKey
+from ...cryptography.asymmetric import (
+    AnyPublicKey,
+    hash_public_key_document,
+    validate_public_key,
+)
+from ...design import IdentityMap
 from ...lib.dictionary import dictionary
 from ...objects import StoredSamiObject
 from ...utils import get_id
@@ -14,22 +21,69 @@ from ._pattern import Pattern
 
 logger = _logging.getLogger("objects")
 
+# The same nodes are part of many requests, conversations and messages.
+# So that each of them is held only once in memory, we use the instance
+# registered here when validating a field of type `Node`.
+_nodes: IdentityMap[Identifier, Node] = IdentityMap()
+
 
 class Node(StoredSamiObject):
+    # Allows registering instances in `_nodes`
+    __slots__ = ("__weakref__",)
+
     __table_name__ = "nodes"
     __node_specific__ = False
 
-    public_key: PublicKey
+    public_key: AnyPublicKey
     sig: str
     pattern: Pattern
 
     class Config:
         allow_mutation = False
 
+    @pydantic.validator("sig")
+    def _check_sig(cls, sig: str, values: dict) -> str:
+        """
+        A node's signature is the signature of its public key's hash,
+        by its private key.
+        """
+        if (public_key := values.get("public_key")) is None:
+            # The public key is invalid, which is reported already
+            return sig
+        assert public_key.is_signature_valid(public_key.hash, sig), "Invalid signature"
+        return sig
+
+    @classmethod
+    def validate(cls, value) -> Node:
+        """
+        Called by pydantic when validating a field of this type.
+        Returns the instance we already have for this node, if any.
+        Subclasses (e.g. `MasterNode`) are left as is.
+        """
+        if cls is not Node:
+            return super().validate(value)
+        if type(value) is Node:
+            return _nodes.intern(value.id, lambda: value)
+        if isinstance(value, dict) and "public_key" in value:
+            public_key = validate_public_key(value["public_key"])
+            return _nodes.intern(
+                get_id(public_key.hash),
+                lambda: super(Node, cls).validate({**value, "public_key": public_key}),
+            )
+        return super().validate(value)
+
     @cached_property
     def id(self) -> Identifier:
         return get_id(self.public_key.hash)
 
+    @staticmethod
+    def get_id_from_document(dbo: dict) -> Identifier:
+        """
+        Computes the identifier of a node from its stored form,
+        without validating it.
+        """
+        return get_id(hash_public_key_document(dbo["public_key"]))
+
     @cached_property
     def name(self) -> str:
         """
@@ -54,5 +108,5 @@ class Node(StoredSamiObject):
         return "".join(name_parts)
 
     def export_public_key(self, directory: Path) -> None:
-        path = directory / f"rsa_public_key-{self.id}.pem"
+        path = directory / f"{self.public_key.engine}_public_key-{self.id}.pem"
         self.public_key._to_file(path)
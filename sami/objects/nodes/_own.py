@@ -3,13 +3,13 @@ from __future__ import annotations
 from functools import cached_property
 from pathlib import Path
 
-from ...cryptography.asymmetric import PrivateKey
+from ...cryptography.asymmetric import AnyPrivateKey
 from ...design import Singleton
 from ._base import Node
 
 
 class MasterNode(Node, Singleton):
-    private_key: PrivateKey
+    private_key: AnyPrivateKey
 
     def __enter__(self) -> MasterNode:
         return self
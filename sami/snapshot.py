@@ -0,0 +1,282 @@
+"""
+Snapshots of the information shared across the network.
+
+A snapshot contains the contacts, the nodes and the recent requests we know,
+that is, everything which is not specific to our own node.
+A relay can publish one, so that a new client can import it instead of
+discovering the network through many rounds of DCP, DNP and WUP_INI.
+
+The format is a gzip-compressed text file, with one JSON object per line:
+a header, then one line per document, then a trailer with the number of
+documents of each table, which lets us detect truncated snapshots.
+
+Requests are stored as the pickles we keep them as. Snapshots must thus
+only be imported from a trusted source (e.g. a relay we chose), and
+their requests are loaded with an unpickler which refuses anything but
+our models.
+"""
+
+from __future__ import annotations
+
+import base64
+import gzip
+import io
+import json
+import pickle
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Generator
+
+import pydantic
+from loguru import logger
+from tinydb.table import Document
+
+from .config import settings
+from .database import Database, RequestsLog
+from .network.requests import Request
+from .objects import Contact, Node, StoredSamiObject
+from .utils import get_time
+
+SNAPSHOT_VERSION = 1
+
+_FORMAT = "sami-snapshot"
+_SHARED_TYPES = {obj.__table_name__: obj for obj in (Contact, Node)}
+# Fields of the lines holding documents
+_FIELDS = {"id", "document"}
+_REQUEST_FIELDS = {"id", "timestamp", "status", "payload"}
+
+
+@dataclass
+class SnapshotInfo:
+    version: int
+    created: int
+    counts: dict[str, int] = field(default_factory=dict)
+
+
+def _dumps(obj: dict) -> str:
+    # Addresses of the contacts are written as text, which they are parsed from
+    return json.dumps(obj, separators=(",", ":"), default=str) + "\n"
+
+
+class _PayloadUnpickler(pickle.Unpickler):
+
+    """
+    Only loads our models and the types their fields hold,
+    so that loading a snapshot cannot run arbitrary code.
+    """
+
+    _allowed = {
+        ("builtins", "set"),
+        ("builtins", "frozenset"),
+        ("ipaddress", "IPv4Address"),
+        ("ipaddress", "IPv6Address"),
+        ("ipaddress", "IPv4Interface"),
+        ("ipaddress", "IPv6Interface"),
+        ("dns.name", "Name"),
+    }
+
+    def find_class(self, module: str, name: str):
+        if (module, name) in self._allowed:
+            return super().find_class(module, name)
+        if module.startswith(f"{__package__}."):
+            obj = super().find_class(module, name)
+            if isinstance(obj, type) and issubclass(obj, pydantic.BaseModel):
+                return obj
+        raise pickle.UnpicklingError(f"Forbidden global {module}.{name}")
+
+
+def _load_request(payload: bytes) -> Request:
+    """
+    Loads a request payload of a snapshot.
+    Unpickling doesn't run the validators, so the request is validated
+    again from its fields.
+    Raises ValueError if it is not a valid request.
+    """
+    try:
+        stored = _PayloadUnpickler(io.BytesIO(payload)).load()
+    except (pickle.UnpicklingError, EOFError, AttributeError, TypeError) as e:
+        raise ValueError(f"Invalid request in snapshot: {e}") from e
+    if not isinstance(stored, Request):
+        raise ValueError(f"Invalid request in snapshot: {type(stored).__name__}")
+    return Request.from_document(stored.to_document())
+
+
+def _iter_request_records() -> Generator[dict, None, None]:
+    """
+    Yields the requests which have not expired yet, in a format which does
+    not depend on the storage we use.
+    """
+    expired_before = get_time() - settings.max_request_lifespan.get()
+    if settings.requests_log.get():
+        with RequestsLog() as log:
+            for identifier, entry in log.entries():
+                if entry.timestamp < expired_before:
+                    continue
+                if (payload := log.get(identifier)) is None:
+                    continue
+                yield {
+                    "id": f"{identifier:x}",
+                    "timestamp": entry.timestamp,
+                    "status": entry.status,
+                    "payload": base64.b64encode(payload).decode("ascii"),
+                }
+    else:
+        for request in Request.iter_all():
+            if request.timestamp < expired_before:
+                continue
+            yield {
+                "id": f"{request.id:x}",
+                "timestamp": request.timestamp,
+                "status": request.status,
+                "payload": base64.b64encode(request.to_bytes()).decode("ascii"),
+            }
+
+
+def export_snapshot(file: Path) -> SnapshotInfo:
+    """
+    Writes a snapshot of the shared tables to `file`.
+    """
+    info = SnapshotInfo(version=SNAPSHOT_VERSION, created=get_time())
+    with gzip.open(file, mode="wt", encoding="utf-8") as f:
+        f.write(
+            _dumps(
+                {"format": _FORMAT, "version": info.version, "created": info.created}
+            )
+        )
+        with Database() as db:
+            for table, obj in _SHARED_TYPES.items():
+                info.counts[table] = 0
+                for batch in db.iter_batches(obj, settings.database_batch_size.get()):
+                    for document in batch:
+                        f.write(
+                            _dumps(
+                                {
+                                    "table": table,
+                                    "id": f"{document.doc_id:x}",
+                                    "document": document,
+                                }
+                            )
+                        )
+                        info.counts[table] += 1
+        info.counts[Request.__table_name__] = 0
+        for record in _iter_request_records():
+            f.write(_dumps({"table": Request.__table_name__, **record}))
+            info.counts[Request.__table_name__] += 1
+        f.write(_dumps({"counts": info.counts}))
+    logger.info(f"Exported snapshot to {file!s}: {info.counts}")
+    return info
+
+
+def _load_requests(requests: list[Request]) -> int:
+    if not settings.requests_log.get():
+        return _insert(Request, requests)
+    with RequestsLog() as log:
+        return log.append_many(
+            (request.id, request.timestamp, request.status, request.to_bytes())
+            for request in requests
+        )
+
+
+def _insert(obj: type[StoredSamiObject], objects: list[StoredSamiObject]) -> int:
+    with Database() as db:
+        return db.insert_many(
+            obj,
+            [Document(item.to_document(), doc_id=item.id) for item in objects],
+        )
+
+
+def _read_lines(file: Path) -> Generator[dict, None, None]:
+    try:
+        with gzip.open(file, mode="rt", encoding="utf-8") as f:
+            yield from map(json.loads, f)
+    except (OSError, EOFError) as e:
+        raise ValueError(f"Could not read snapshot {file!s}: {e}") from e
+
+
+def _parse_line(line: dict) -> StoredSamiObject | None:
+    """
+    Validates a document of a snapshot through its model, so that its
+    identifier is computed by us rather than read from the snapshot.
+    Returns None if its table is unknown.
+    Raises ValueError if it is invalid.
+    """
+    table = line["table"]
+    fields = _REQUEST_FIELDS if table == Request.__table_name__ else _FIELDS
+    if missing := fields - line.keys():
+        raise ValueError(f"Missing fields {missing}")
+    if table == Request.__table_name__:
+        return _load_request(base64.b64decode(line["payload"]))
+    if (obj := _SHARED_TYPES.get(table)) is None:
+        return None
+    if not isinstance(line["document"], dict):
+        raise ValueError(f"Invalid document in table {table!r}")
+    return obj.from_document(line["document"])
+
+
+def _read_snapshot(
+    file: Path,
+) -> tuple[SnapshotInfo, dict[str, list[StoredSamiObject]]]:
+    """
+    Reads and validates the whole snapshot, and returns its header along
+    with the objects of each table.
+    Raises ValueError if it is invalid or incomplete.
+    """
+    lines = _read_lines(file)
+    header = next(lines, {})
+    if header.get("format") != _FORMAT:
+        raise ValueError(f"{file!s} is not a snapshot")
+    if header.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {header.get('version')}")
+    counts = {}
+    tables = {}
+    trailer = None
+    for number, line in enumerate(lines, start=2):
+        if trailer is not None:
+            raise ValueError(f"Snapshot {file!s} has data after its trailer")
+        if "table" not in line:
+            trailer = line
+            continue
+        table = line["table"]
+        try:
+            item = _parse_line(line)
+        except ValueError as e:
+            # Includes pydantic's validation errors
+            raise ValueError(f"Invalid line {number} in snapshot {file!s}: {e}") from e
+        if item is None:
+            logger.warning(f"Ignored unknown table {table!r} in snapshot")
+        else:
+            tables.setdefault(table, []).append(item)
+        counts[table] = counts.get(table, 0) + 1
+    if trailer is None:
+        raise ValueError(f"Snapshot {file!s} is incomplete")
+    # Tables without documents may be left out of our counts
+    expected = {
+        table: count for table, count in trailer.get("counts", {}).items() if count
+    }
+    if expected != counts:
+        raise ValueError(f"Snapshot {file!s} does not match its trailer")
+    info = SnapshotInfo(version=header["version"], created=header["created"])
+    return info, tables
+
+
+def import_snapshot(file: Path) -> SnapshotInfo:
+    """
+    Loads a snapshot written by `export_snapshot`.
+    Every document is validated through its model, and stored under the
+    identifier we compute, before anything is inserted, so that nothing
+    is inserted from an invalid or incomplete snapshot.
+    The documents are then inserted in bulk, one table at a time.
+    Documents we already know are left untouched.
+    Must only be used with snapshots from a trusted source
+    (see the module docstring).
+
+    Raises ValueError if the snapshot is invalid or incomplete.
+    """
+    info, tables = _read_snapshot(file)
+    for table, objects in tables.items():
+        if table == Request.__table_name__:
+            info.counts[table] = _load_requests(objects)
+        else:
+            info.counts[table] = _insert(_SHARED_TYPES[table], objects)
+    logger.info(f"Imported snapshot from {file!s}: {info.counts}")
+    return info
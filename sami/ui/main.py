@@ -13,9 +13,10 @@ from kivymd.uix.label import MDLabel
 
 from ..config import Identifier, Setting, settings
 from ..events import global_stop_event
+from ..migrations import migrate_identifiers
 from ..network import Networks
 from ..network.requests import MPP, Request
-from ..objects import Conversation, OwnMessage, is_private_key_loaded
+from ..objects import Conversation, MasterNode, OwnMessage, is_private_key_loaded
 from ..utils import format_err
 
 
@@ -46,6 +47,8 @@ class StartScreen(Screen):
     def on_enter(self, *args):
         def _end_start_sequence(_):
             if is_private_key_loaded():
+                # Before any message is read
+                migrate_identifiers()
                 self.manager.switch_to(ConversationsScreen())
             else:
                 self.manager.switch_to(LoadKeyScreen())
@@ -76,12 +79,10 @@ class ConversationsScreen(Screen):
         self._populate()
 
     def _populate(self) -> None:
-        conversations = Conversation.all()
+        # Group conversations are displayed in the group screen
+        with MasterNode() as master_node:
+            conversations = Conversation.of_member(master_node, size=2)
         for conv in conversations:
-            if len(conv.members) != 2:
-                # It's not a one-on-one conversation,
-                # so it should be displayed in the group conversations.
-                continue
             last_message = conv.messages.clear.get_last()
             if not last_message:
                 # There are no messages in this conversation
@@ -118,12 +119,10 @@ class GroupScreen(Screen):
         self._populate()
 
     def _populate(self) -> None:
-        conversations = Conversation.all()
+        # One-on-one conversations are displayed in the conversations screen
+        sizes = [size for size in Conversation.count_by_size() if size > 2]
+        conversations = Conversation.find(Conversation.query().isin("size", sizes))
         for conv in conversations:
-            if len(conv.members) == 2:
-                # It's not a group conversation, so it should be displayed
-                # in the one-to-one conversations screen.
-                continue
             last_message = conv.messages.clear.get_last()
             if last_message is None:
                 # There are no messages in this conversation
@@ -160,23 +159,48 @@ class ChatScreen(Screen):
     def __init__(self, conversation: Conversation, **kwargs):
         super().__init__(**kwargs)
         self.conversation = conversation
+        # Position of the oldest message displayed
+        self._oldest: int | None = None
 
     def on_enter(self, *args):
         self._populate()
 
     def _populate(self) -> None:
-        displayed: int = 0
-        for message in self.conversation.clear_messages:
-            chat_bubble = ChatBubble()
-            chat_bubble.message = message.value
-            chat_bubble.time = message.time_received
-            chat_bubble.sender = message.author
-            self.ids.message_list.add_widget(chat_bubble)
-            displayed += 1
-
-        if not displayed:
+        # Only the most recent messages are loaded, the others are loaded
+        # when scrolling up (see `load_older`)
+        messages = self.conversation.clear_messages.get_page(
+            settings.chat_page_size.get()
+        )
+        if not messages:
             Popup(title="Error", content=MDLabel(text="No message"))
             self.sm.switch_to(ConversationsScreen())
+            return
+
+        self._oldest = len(self.conversation.clear_messages) - len(messages)
+        for message in messages:
+            self.ids.message_list.add_widget(self._make_bubble(message))
+
+    def load_older(self) -> None:
+        if not self._oldest:
+            return
+        messages = self.conversation.clear_messages.get_page(
+            settings.chat_page_size.get(), before=self._oldest
+        )
+        self._oldest -= len(messages)
+        # Widgets are added at the top of the list, so in reverse order
+        for message in reversed(messages):
+            self.ids.message_list.add_widget(
+                self._make_bubble(message),
+                index=len(self.ids.message_list.children),
+            )
+
+    @staticmethod
+    def _make_bubble(message) -> ChatBubble:
+        chat_bubble = ChatBubble()
+        chat_bubble.message = message.value
+        chat_bubble.time = message.time_received
+        chat_bubble.sender = message.author
+        return chat_bubble
 
 
 class SettingListItem(MDCard):
@@ -282,12 +306,13 @@ class MainApp(MDApp):
         text_input = chat_screen.ids.input.ids.value
         message = OwnMessage(content=text_input)
         conversation = Conversation.from_id()
-        conversation.message.append(message)
+        encrypted_message = message.encrypt(conversation.encryption_key)
+        conversation.messages.append(encrypted_message)
         self.networks.broadcast(
             Request.new(
                 MPP(
                     conversation_id=conversation.id,
-                    message=message.encrypt(conversation.value),
+                    message=encrypted_message,
                 )
             )
         )